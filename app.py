@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import uuid
@@ -5,10 +6,51 @@ import re
 from datetime import datetime
 from pathlib import Path
 import subprocess
-import threading
-from flask import Flask, request, jsonify, send_from_directory, abort
+import queue
+import shutil
+import time
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory, abort, redirect, url_for, stream_with_context
+from werkzeug.security import safe_join
 from flask_cors import CORS
-from video_processor import create_dash_stream, extract_thumbnail, is_file_allowed, create_debug_mp4
+from video_processor import (
+    LADDER_QUALITIES,
+    create_dash_stream,
+    create_debug_mp4,
+    ffmpeg_version,
+    is_file_allowed,
+    probe_video,
+    publish_rendition,
+)
+from checkpoint import discard_checkpoint
+from dash_packaging import SegmentIndex, is_single_file_output
+from rendition_tiers import (
+    DemandCounter,
+    attach_tier,
+    detach_tier,
+    is_tier_dir,
+    is_tier_path,
+    plan_evictions,
+    tier_bytes,
+    tier_dir_name,
+)
+from cpu_budget import CpuScheduler
+from job_queue import JobDeferred, JobQueue, write_json_atomic
+from catalog import Catalog
+from resumable_upload import ResumableUploads, UploadConflict, ChecksumMismatch
+from events import EventBus, ProgressFile, format_sse
+from segment_delivery import SegmentCache, cache_control, file_etag, guess_mimetype
+from storage import create_storage, is_stored_output
+from dedup import link_video_outputs, save_and_hash
+from encoding_profiles import PROFILES, get_profile
+from metrics import (
+    LATENCY_BUCKETS,
+    PROMETHEUS_CONTENT_TYPE,
+    SPEED_BUCKETS,
+    STAGE_BUCKETS,
+    Metrics,
+    Timeline,
+    read_timeline,
+)
 
 UPLOADS_DIR = Path("uploads")
 UPLOADS_DIR.mkdir(exist_ok=True)
@@ -16,8 +58,152 @@ UPLOADS_DIR.mkdir(exist_ok=True)
 # Debug mode for video processing (saves intermediate files)
 DEBUG_VIDEO_PROCESSING = os.getenv("DEBUG_VIDEO_PROCESSING", "false").lower() == "true"
 
+# Number of concurrent ffmpeg processes used to encode the ladder of one video
+DASH_PARALLEL_WORKERS = int(os.getenv("DASH_PARALLEL_WORKERS", "1"))
+# Number of time chunks long videos are split into for concurrent encoding
+DASH_CHUNKS = int(os.getenv("DASH_CHUNKS", "1"))
+# Publish a dynamic manifest while encoding so videos can be watched before they finish
+DASH_PROGRESSIVE = os.getenv("DASH_PROGRESSIVE", "false").lower() == "true"
+# Fit the bitrate ladder to the content complexity of each video
+DASH_PER_TITLE = os.getenv("DASH_PER_TITLE", "false").lower() == "true"
+# Package every representation as one indexed MP4 served by byte ranges
+DASH_SINGLE_FILE = os.getenv("DASH_SINGLE_FILE", "false").lower() == "true"
+# Reuse the outputs of an already processed upload with the same content
+DEDUP_UPLOADS = os.getenv("DEDUP_UPLOADS", "true").lower() == "true"
+
+# Encoding profile of uploads that don't choose one (see encoding_profiles.py)
+ENCODING_PROFILE = get_profile(os.getenv("ENCODING_PROFILE", "default")).name
+# Profile videos are re-encoded to in the background when the server is idle ("" disables)
+REENCODE_PROFILE = os.getenv("REENCODE_PROFILE", "")
+if REENCODE_PROFILE:
+    REENCODE_PROFILE = get_profile(REENCODE_PROFILE).name
+# Re-encode only while the 1-minute load average per CPU is below this
+REENCODE_MAX_LOAD = float(os.getenv("REENCODE_MAX_LOAD", "0.5"))
+# Seconds the replaced segments stay available to players of the old manifest
+REENCODE_GRACE = float(os.getenv("REENCODE_GRACE", "21600"))
+REENCODE_PRIORITY = -100
+# Seconds between idle checks of a waiting re-encode
+REENCODE_IDLE_RETRY = 60
+
+# Rungs above this quality are only encoded once the video is played (0 encodes the full ladder)
+LAZY_RUNGS_ABOVE = int(os.getenv("LAZY_RUNGS_ABOVE", "0"))
+# Manifest loads of a video before its on-demand rungs are encoded
+LAZY_RUNGS_MIN_PLAYS = int(os.getenv("LAZY_RUNGS_MIN_PLAYS", "1"))
+# Disk space of the on-demand rungs of all videos, cold ones are evicted beyond it (0 is unlimited)
+LAZY_TIER_BUDGET_BYTES = int(os.getenv("LAZY_TIER_BUDGET_MB", "0")) * 1024 * 1024
+# On-demand rungs requested within this many seconds are never evicted
+LAZY_TIER_MIN_IDLE = float(os.getenv("LAZY_TIER_MIN_IDLE", "3600"))
+# Below uploads, above background re-encodes
+LAZY_TIER_PRIORITY = -10
+
+# Cores shared by the ffmpeg processes of concurrent jobs (0 uses every available CPU)
+CPU_CORES = int(os.getenv("CPU_CORES", "0"))
+# Pin the ffmpeg processes of every job to its own range of CPUs (Linux)
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "false").lower() == "true"
+
+# Transcode job queue settings
+JOBS_DIR = Path(os.getenv("JOBS_DIR", "jobs"))
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "30"))
+START_TRANSCODE_WORKERS = os.getenv("START_TRANSCODE_WORKERS", "true").lower() == "true"
+
+# SQLite index of all meta.json files, used to list videos
+CATALOG_DB = Path(os.getenv("CATALOG_DB", "catalog.db"))
+VIDEOS_PAGE_LIMIT = 100
+VIDEOS_PAGE_MAX_LIMIT = 1000
+
+# Seconds between keep-alive comments on idle event streams
+EVENTS_KEEPALIVE = 15
+# Seconds between checks of the progress file of encodes run by other processes
+EVENTS_POLL_INTERVAL = 1
+
+# In-memory cache of init segments and hot media segments
+SEGMENT_CACHE_BYTES = int(os.getenv("SEGMENT_CACHE_MB", "256")) * 1024 * 1024
+SEGMENT_CACHE_MAX_ITEM_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_ITEM_MB", "8")) * 1024 * 1024
+# Let a front proxy send files: "", "x-accel-redirect" (nginx) or "x-sendfile"
+SEGMENT_OFFLOAD = os.getenv("SEGMENT_OFFLOAD", "").lower()
+# Internal nginx location mapped to UPLOADS_DIR for X-Accel-Redirect
+SEGMENT_OFFLOAD_PREFIX = os.getenv("SEGMENT_OFFLOAD_PREFIX", "/protected-uploads/")
+
+# Where the served outputs are kept: "local" (STORAGE_ROOT) or "s3" (S3-compatible bucket)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+# Directory of the local backend, e.g. a volume shared with delivery hosts
+STORAGE_ROOT = Path(os.getenv("STORAGE_ROOT", str(UPLOADS_DIR)))
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "")
+# Endpoint of a self-hosted store such as MinIO (default: AWS S3)
+STORAGE_ENDPOINT_URL = os.getenv("STORAGE_ENDPOINT_URL", "")
+STORAGE_REGION = os.getenv("STORAGE_REGION", "")
+# Prefix of the keys in the bucket
+STORAGE_PREFIX = os.getenv("STORAGE_PREFIX", "")
+# Public base URL of the stored files (CDN, public bucket); unset signs URLs of private buckets
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "")
+# Seconds pre-signed URLs stay valid
+STORAGE_URL_EXPIRY = int(os.getenv("STORAGE_URL_EXPIRY", "3600"))
+# Redirect players to stored files with a direct URL instead of serving them from the API
+STORAGE_REDIRECT = os.getenv("STORAGE_REDIRECT", "true").lower() == "true"
+# Files, or parts of a large file, uploaded to the store at a time
+STORAGE_UPLOAD_WORKERS = int(os.getenv("STORAGE_UPLOAD_WORKERS", "8"))
+
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+app.config["USE_X_SENDFILE"] = SEGMENT_OFFLOAD == "x-sendfile"
+CORS(
+    app,
+    expose_headers=["ETag", "Link", "X-Next-Cursor", "Location", "Upload-Offset", "Upload-Length"],
+)  # Enable CORS for all routes
+
+catalog = Catalog(CATALOG_DB)
+events = EventBus()
+cpu_scheduler = CpuScheduler(CPU_CORES or None, affinity=CPU_AFFINITY)
+segment_cache = SegmentCache(SEGMENT_CACHE_BYTES, SEGMENT_CACHE_MAX_ITEM_BYTES)
+segment_index = SegmentIndex()
+storage = create_storage(
+    STORAGE_BACKEND,
+    UPLOADS_DIR,
+    root=STORAGE_ROOT,
+    bucket=STORAGE_BUCKET,
+    endpoint_url=STORAGE_ENDPOINT_URL,
+    region=STORAGE_REGION,
+    prefix=STORAGE_PREFIX,
+    public_url=STORAGE_PUBLIC_URL,
+    url_expiry=STORAGE_URL_EXPIRY,
+    upload_workers=STORAGE_UPLOAD_WORKERS,
+)
+demand = DemandCounter()
+if catalog.is_empty():
+    catalog.rebuild(UPLOADS_DIR)
+
+metrics = Metrics()
+stage_seconds = metrics.histogram(
+    "dashstreamer_stage_seconds", "Duration of processing stages", STAGE_BUCKETS
+)
+stage_failures = metrics.counter(
+    "dashstreamer_stage_failures_total", "Processing stages that raised an error"
+)
+encode_speed = metrics.histogram(
+    "dashstreamer_encode_speed_ratio", "Encode speed as a multiple of realtime", SPEED_BUCKETS
+)
+encoded_media_seconds = metrics.counter(
+    "dashstreamer_encoded_media_seconds_total", "Seconds of source video encoded"
+)
+request_seconds = metrics.histogram(
+    "dashstreamer_http_request_duration_seconds",
+    "Time to serve a request, until the last byte is sent",
+    LATENCY_BUCKETS,
+)
+response_bytes = metrics.counter(
+    "dashstreamer_http_response_bytes_total", "Response body bytes sent"
+)
+metrics.gauge(
+    "dashstreamer_segment_cache_bytes",
+    "Bytes held by the in-memory segment cache",
+    callback=lambda: segment_cache.stats()["bytes"],
+)
+metrics.gauge(
+    "dashstreamer_cpu_threads_allocated",
+    "ffmpeg threads allocated to the jobs running in this process",
+    callback=cpu_scheduler.allocated,
+)
 
 
 def title_to_snake_case(title):
@@ -46,6 +232,608 @@ def ensure_unique_folder_name(base_name):
     return folder_name
 
 
+def create_video_folder(title):
+    """Create the folder of a new video, named after its title."""
+    # Create snake_case folder name from title
+    base_folder_name = title_to_snake_case(title)
+    video_id = ensure_unique_folder_name(base_folder_name)
+    video_dir = UPLOADS_DIR / video_id
+    video_dir.mkdir(parents=True, exist_ok=True)
+    return video_id, video_dir
+
+
+def record_span(span):
+    """Export a finished timeline span as metrics."""
+    stage_seconds.observe(span["duration_s"], stage=span["name"])
+    if span.get("status") == "error":
+        stage_failures.inc(stage=span["name"])
+    if span["name"] == "encode" and "speed" in span:
+        encode_speed.observe(span["speed"], mode=span.get("mode", ""))
+        encoded_media_seconds.inc(span["media_seconds"])
+
+
+def video_timeline(video_id):
+    """Processing timeline of a video, exported to the metrics as it grows."""
+    return Timeline(UPLOADS_DIR / video_id, on_span=record_span)
+
+
+def read_meta(video_id):
+    """Read the meta.json of a video."""
+    with open(UPLOADS_DIR / video_id / "meta.json") as f:
+        return json.load(f)
+
+
+def write_meta(video_id, meta):
+    """Atomically replace the meta.json of a video and update the catalog."""
+    write_json_atomic(UPLOADS_DIR / video_id / "meta.json", meta)
+    catalog.upsert(meta)
+    events.publish(video_id, "status", meta)
+    if meta.get("status") in ("done", "error"):
+        events.forget(video_id)
+        ProgressFile(UPLOADS_DIR / video_id).remove()
+
+
+def reuse_duplicate_outputs(video_id, meta):
+    """
+    Complete a video by linking the outputs of a processed upload with the same SHA-256.
+
+    Returns:
+        bool: Whether a processed duplicate was found and reused
+    """
+    if not DEDUP_UPLOADS or not meta.get("sha256"):
+        return False
+    source_id = catalog.find_by_hash(meta["sha256"], exclude=video_id)
+    if source_id is None:
+        return False
+    video_dir = UPLOADS_DIR / video_id
+    try:
+        with video_timeline(video_id).span("dedup_link", source=source_id):
+            source_meta = read_meta(source_id)
+            linked = link_video_outputs(UPLOADS_DIR / source_id, video_dir)
+            storage.upload_dir(video_dir, f"{video_id}/")
+    except (OSError, json.JSONDecodeError):
+        return False
+
+    with open(video_dir / "processing.log", "a") as logf:
+        logf.write(f"Same content as {source_id} (sha256 {meta['sha256']}): linked {linked} files\n")
+    meta.pop("error", None)
+    meta["status"] = "done"
+    meta["playable"] = True
+    meta["duplicate_of"] = source_id
+    meta["log"] = "processing.log"
+    for key in ("video", "thumbnail", "thumbnails", "profile", "rendition", "lazy_tier"):
+        if key in source_meta:
+            meta[key] = source_meta[key]
+    write_meta(video_id, meta)
+    return True
+
+
+def serving_dir(video_id, meta):
+    """Directory of the rendition the served manifest points to."""
+    video_dir = UPLOADS_DIR / video_id
+    return video_dir / meta["rendition"] if meta.get("rendition") else video_dir
+
+
+def lazy_tier_dir(video_id, meta):
+    """Directory of the current generation of the on-demand tier of a video."""
+    return serving_dir(video_id, meta) / tier_dir_name(meta["lazy_tier"].get("generation", 0))
+
+
+def storage_key(path):
+    """Key of a file or directory of a video folder in the storage backend."""
+    return Path(path).relative_to(UPLOADS_DIR).as_posix()
+
+
+def store_manifest(video_id):
+    """Store the served manifest of a video after it changed."""
+    storage.put_file(f"{video_id}/video.mpd", UPLOADS_DIR / video_id / "video.mpd")
+
+
+def store_original(video_id, original_path, meta):
+    """Keep an uploaded original in the storage, so any transcode host can fetch it."""
+    meta["original"] = original_path.name
+    if storage.in_place:
+        return
+    with video_timeline(video_id).span("store_original") as span:
+        span["bytes"] = storage.put_file(storage_key(original_path), original_path)
+
+
+def local_original(video_id, meta):
+    """Path of the original of a video, fetched from the storage if this host has no copy."""
+    video_dir = UPLOADS_DIR / video_id
+    original_path = next(video_dir.glob("original.*"), None)
+    if original_path is None and meta.get("original"):
+        original_path = video_dir / meta["original"]
+        with video_timeline(video_id).span("fetch_original"):
+            storage.get_file(storage_key(original_path), original_path)
+    if original_path is None:
+        raise FileNotFoundError(f"No original for {video_id}")
+    return original_path
+
+
+def lazy_qualities(probe):
+    """Qualities of the rungs of a source only encoded on demand."""
+    if not LAZY_RUNGS_ABOVE:
+        return []
+    stream = probe.video_stream or {}
+    short_side = min(int(stream.get("width", 0)), int(stream.get("height", 0)))
+    return [quality for quality in LADDER_QUALITIES if LAZY_RUNGS_ABOVE < quality <= short_side]
+
+
+def source_pixels(probe):
+    """Pixel count of a source's frames, which sizes its share of the cores."""
+    stream = probe.video_stream or {}
+    return int(stream.get("width", 0)) * int(stream.get("height", 0))
+
+
+def system_idle():
+    """Whether no other job is waiting or running and the CPUs are mostly free."""
+    if job_queue.depth(min_priority=REENCODE_PRIORITY + 1) or job_queue.running() > 1:
+        return False
+    try:
+        load = os.getloadavg()[0]
+    except OSError:
+        return True  # Unavailable on this platform
+    return load / (os.cpu_count() or 1) < REENCODE_MAX_LOAD
+
+
+def reencode_video(job):
+    """
+    Re-encode a processed video with another profile while the server is idle.
+
+    The new rendition is encoded into a subdirectory named after the profile
+    and published by atomically replacing the manifest. The previous segments
+    are removed by a follow-up job once players had REENCODE_GRACE seconds to
+    reload the manifest.
+    """
+    if not system_idle():
+        raise JobDeferred(REENCODE_IDLE_RETRY)
+    video_id = job["video_id"]
+    video_dir = UPLOADS_DIR / video_id
+    profile = get_profile(job["payload"]["profile"])
+    meta = read_meta(video_id)
+    if meta.get("status") != "done" or meta.get("profile") == profile.name:
+        return
+
+    original_path = local_original(video_id, meta)
+    log_path = video_dir / "processing.log"
+    rendition_dir = video_dir / profile.name
+    # A failed attempt's checkpoint is resumed
+    rendition_dir.mkdir(exist_ok=True)
+    timeline = video_timeline(video_id)
+    with open(log_path, "a") as logf:
+        logf.write(f"\nRe-encoding with profile {profile.name}\n")
+
+    meta["reencoding"] = profile.name
+    write_meta(video_id, meta)
+    with timeline.span("probe", attempt=job["attempts"], task="reencode"):
+        probe = probe_video(original_path)
+    with cpu_scheduler.job(video_id, source_pixels(probe), priority=job["priority"]) as cpu:
+        create_dash_stream(
+            original_path,
+            rendition_dir,
+            log_path=log_path,
+            probe=probe,
+            per_title=DASH_PER_TITLE,
+            timeline=timeline,
+            parallel_workers=DASH_PARALLEL_WORKERS,
+            chunks=DASH_CHUNKS,
+            profile=profile,
+            cpu=cpu,
+            single_file=DASH_SINGLE_FILE,
+            max_quality=meta.get("lazy_tier", {}).get("above"),
+            storage=storage,
+            storage_prefix=f"{storage_key(rendition_dir)}/",
+        )
+    publish_rendition(rendition_dir, video_dir / "video.mpd")
+    store_manifest(video_id)
+
+    meta = read_meta(video_id)
+    if meta.get("lazy_tier"):
+        # The new manifest has no on-demand rungs, the old ones go with the old rendition
+        meta["lazy_tier"] = {
+            "state": "absent",
+            "above": meta["lazy_tier"]["above"],
+            "generation": meta["lazy_tier"].get("generation", 0),
+        }
+    meta.pop("reencoding", None)
+    meta.pop("reencode_error", None)
+    meta["profile"] = profile.name
+    meta["rendition"] = profile.name
+    write_meta(video_id, meta)
+    job_queue.enqueue(
+        video_id,
+        priority=REENCODE_PRIORITY,
+        payload={"task": "remove_replaced"},
+        delay=REENCODE_GRACE,
+    )
+
+
+def remove_replaced_outputs(job):
+    """Delete the segments of renditions replaced by a background re-encode."""
+    video_dir = UPLOADS_DIR / job["video_id"]
+    current = read_meta(job["video_id"]).get("rendition")
+    if not current:
+        return
+    removed = 0
+    removed_files = []
+    for path in video_dir.iterdir():
+        if path.is_file() and (path.suffix == ".m4s" or is_single_file_output(path.name)):
+            path.unlink()
+            removed_files.append(storage_key(path))
+            removed += 1
+        elif path.is_dir() and (path.name in PROFILES or is_tier_dir(path.name)) and path.name != current:
+            shutil.rmtree(path)
+            storage.delete_prefix(f"{storage_key(path)}/")
+            removed += 1
+    storage.delete(removed_files)
+    with open(video_dir / "processing.log", "a") as logf:
+        logf.write(f"Removed {removed} replaced outputs, serving profile {current}\n")
+
+
+def encode_lazy_tier(job):
+    """
+    Encode the on-demand rungs of a played video and add them to its manifest.
+
+    The rungs are encoded from the original into a ``lazy-<generation>/``
+    subdirectory of the served rendition, with its profile and keyframe
+    plan, and only added to the served manifest once complete. Every encode
+    after an eviction is a new generation with new segment URLs. Cold tiers
+    of other videos are then evicted to stay within LAZY_TIER_BUDGET_MB.
+    """
+    video_id = job["video_id"]
+    video_dir = UPLOADS_DIR / video_id
+    meta = read_meta(video_id)
+    tier = meta.get("lazy_tier")
+    if meta.get("status") != "done" or not tier or tier["state"] not in ("absent", "encoding"):
+        return
+
+    original_path = local_original(video_id, meta)
+    log_path = video_dir / "processing.log"
+    if tier["state"] == "absent":
+        tier["generation"] = tier.get("generation", 0) + 1
+    # A failed attempt of the same generation is resumed from its checkpoint
+    tier_dir = lazy_tier_dir(video_id, meta)
+    tier_dir.mkdir(exist_ok=True)
+    timeline = video_timeline(video_id)
+    with open(log_path, "a") as logf:
+        logf.write(f"\nEncoding the rungs above {tier['above']}p on demand\n")
+
+    tier["state"] = "encoding"
+    write_meta(video_id, meta)
+    with timeline.span("probe", attempt=job["attempts"], task="lazy_tier"):
+        probe = probe_video(original_path)
+    with cpu_scheduler.job(video_id, source_pixels(probe), priority=job["priority"]) as cpu:
+        create_dash_stream(
+            original_path,
+            tier_dir,
+            log_path=log_path,
+            probe=probe,
+            per_title=DASH_PER_TITLE,
+            timeline=timeline,
+            parallel_workers=DASH_PARALLEL_WORKERS,
+            chunks=DASH_CHUNKS,
+            profile=get_profile(meta["profile"]),
+            cpu=cpu,
+            single_file=DASH_SINGLE_FILE,
+            min_quality=tier["above"] + 1,
+            audio=False,
+            storage=storage,
+            storage_prefix=f"{storage_key(tier_dir)}/",
+        )
+    added = attach_tier(video_dir / "video.mpd", tier_dir)
+    store_manifest(video_id)
+
+    meta = read_meta(video_id)
+    meta["lazy_tier"] = {
+        "state": "ready",
+        "above": tier["above"],
+        "generation": tier["generation"],
+        "bytes": tier_bytes(tier_dir),
+        "encoded": datetime.utcnow().isoformat(),
+    }
+    write_meta(video_id, meta)
+    # Just requested, so it is the last candidate for eviction
+    catalog.record_demand({video_id: (0, time.time())})
+    with open(log_path, "a") as logf:
+        logf.write(f"Added {added} on-demand rungs ({meta['lazy_tier']['bytes'] / 1e6:.1f} MB)\n")
+    evict_cold_tiers()
+
+
+def evict_cold_tiers():
+    """Queue the eviction of the least recently used tiers beyond the disk budget."""
+    if not LAZY_TIER_BUDGET_BYTES:
+        return
+    for video_id in plan_evictions(catalog.lazy_tiers(), LAZY_TIER_BUDGET_BYTES, LAZY_TIER_MIN_IDLE):
+        if not job_queue.has_job(video_id, "evict_tier"):
+            job_queue.enqueue(video_id, priority=LAZY_TIER_PRIORITY, payload={"task": "evict_tier"})
+
+
+def evict_lazy_tier(job):
+    """
+    Remove the on-demand rungs of a cold video, which are encoded again when it is played.
+
+    The rungs are removed from the manifest before their segments are
+    deleted. Eviction is checked again when the job runs, since the video may
+    have been played since it was queued.
+    """
+    video_id = job["video_id"]
+    meta = read_meta(video_id)
+    tier = meta.get("lazy_tier")
+    if not tier or tier["state"] != "ready":
+        return
+    evictions = plan_evictions(catalog.lazy_tiers(), LAZY_TIER_BUDGET_BYTES, LAZY_TIER_MIN_IDLE)
+    if not LAZY_TIER_BUDGET_BYTES or video_id not in evictions:
+        return
+    video_dir = UPLOADS_DIR / video_id
+    removed = detach_tier(video_dir / "video.mpd")
+    store_manifest(video_id)
+    tier_dir = lazy_tier_dir(video_id, meta)
+    shutil.rmtree(tier_dir, ignore_errors=True)
+    storage.delete_prefix(f"{storage_key(tier_dir)}/")
+    meta["lazy_tier"] = {"state": "absent", "above": tier["above"], "generation": tier.get("generation", 0)}
+    write_meta(video_id, meta)
+    with open(video_dir / "processing.log", "a") as logf:
+        logf.write(f"Evicted {removed} cold on-demand rungs ({tier.get('bytes', 0) / 1e6:.1f} MB)\n")
+
+
+def track_demand(video_id, filename):
+    """
+    Count the plays and tier accesses of served files, and act on them once due.
+
+    Counts are written to the catalog every few seconds, and videos played
+    at least LAZY_RUNGS_MIN_PLAYS times get their on-demand rungs encoded.
+    """
+    demand.hit(video_id, play=filename == "video.mpd", tier=is_tier_path(filename))
+    counts = demand.drain()
+    if not counts:
+        return
+    plays = catalog.record_demand(counts)
+    for played_id, (new_plays, _) in counts.items():
+        if not new_plays or plays.get(played_id, 0) < LAZY_RUNGS_MIN_PLAYS:
+            continue
+        meta = catalog.get(played_id) or {}
+        if meta.get("status") != "done" or meta.get("lazy_tier", {}).get("state") != "absent":
+            continue
+        if not job_queue.has_job(played_id, "lazy_tier"):
+            job_queue.enqueue(played_id, priority=LAZY_TIER_PRIORITY, payload={"task": "lazy_tier"})
+
+
+def process_video(job):
+    """Run the full processing pipeline for a queued video."""
+    task = job["payload"].get("task")
+    if task == "reencode":
+        return reencode_video(job)
+    if task == "remove_replaced":
+        return remove_replaced_outputs(job)
+    if task == "lazy_tier":
+        return encode_lazy_tier(job)
+    if task == "evict_tier":
+        return evict_lazy_tier(job)
+
+    video_id = job["video_id"]
+    video_dir = UPLOADS_DIR / video_id
+    log_path = video_dir / "processing.log"
+
+    timeline = video_timeline(video_id)
+    timeline.record(
+        {
+            "name": "queue_wait",
+            "start": datetime.utcfromtimestamp(job["enqueued"]).isoformat(),
+            "duration_s": round(job["started"] - job["enqueued"], 4),
+            "attempt": job["attempts"],
+        }
+    )
+
+    meta = read_meta(video_id)
+    # The same content may have finished processing while this job was queued
+    if reuse_duplicate_outputs(video_id, meta):
+        return
+    meta["status"] = "processing"
+    meta["attempts"] = job["attempts"]
+    meta.pop("error", None)
+    write_meta(video_id, meta)
+    original_path = local_original(video_id, meta)
+
+    # Probe once and share the result with every stage
+    with timeline.span("probe", attempt=job["attempts"]):
+        probe = probe_video(original_path)
+    meta["video"] = probe.summary()
+    profile = get_profile(meta.get("profile", ENCODING_PROFILE))
+    meta["profile"] = profile.name
+    if lazy_qualities(probe):
+        meta["lazy_tier"] = {"state": "absent", "above": LAZY_RUNGS_ABOVE}
+    else:
+        meta.pop("lazy_tier", None)
+
+    # Threads are rebalanced with the other running jobs as they start and finish
+    with cpu_scheduler.job(video_id, source_pixels(probe), priority=job.get("priority", 0)) as cpu:
+        # Create debug MP4 if in debug mode
+        if DEBUG_VIDEO_PROCESSING:
+            debug_mp4_path = video_dir / "debug_converted.mp4"
+            with timeline.span("debug_mp4"):
+                create_debug_mp4(
+                    original_path,
+                    debug_mp4_path,
+                    log_path=log_path,
+                    probe=probe,
+                    profile=profile,
+                    cpu=cpu,
+                )
+
+        # Event streams of the API processes watch the file when this is transcode_worker.py
+        progress_file = ProgressFile(video_dir)
+
+        def on_progress(progress):
+            events.publish(video_id, "progress", progress)
+            progress_file.write(progress)
+            # The first published manifest makes the video watchable while encoding
+            if DASH_PROGRESSIVE and not meta.get("playable") and (video_dir / "video.mpd").exists():
+                meta["playable"] = True
+                write_meta(video_id, meta)
+
+        meta["playable"] = False
+        if DASH_PROGRESSIVE:
+            # A manifest left by a failed attempt must not be published as playable
+            (video_dir / "video.mpd").unlink(missing_ok=True)
+        create_dash_stream(
+            original_path,
+            video_dir,
+            log_path=log_path,
+            debug=DEBUG_VIDEO_PROCESSING,
+            probe=probe,
+            progress=on_progress,
+            progressive=DASH_PROGRESSIVE,
+            per_title=DASH_PER_TITLE,
+            previews=True,
+            timeline=timeline,
+            parallel_workers=DASH_PARALLEL_WORKERS,
+            chunks=DASH_CHUNKS,
+            profile=profile,
+            cpu=cpu,
+            single_file=DASH_SINGLE_FILE,
+            max_quality=meta.get("lazy_tier", {}).get("above"),
+            storage=storage,
+            storage_prefix=f"{video_id}/",
+        )
+        meta["status"] = "done"
+        meta["playable"] = True
+        meta["log"] = str(log_path.name)
+        meta["thumbnail"] = "thumbnail.jpg"
+        if (video_dir / "thumbnails.vtt").exists():
+            meta["thumbnails"] = "thumbnails.vtt"
+        write_meta(video_id, meta)
+
+    if REENCODE_PROFILE and REENCODE_PROFILE != profile.name:
+        # Runs after this job, once the server is idle
+        job_queue.enqueue(
+            video_id, priority=REENCODE_PRIORITY, payload={"task": "reencode", "profile": REENCODE_PROFILE}
+        )
+
+
+def on_job_failure(job, error, will_retry):
+    """Record a failed processing attempt in the video metadata."""
+    meta = read_meta(job["video_id"])
+    if isinstance(error, subprocess.CalledProcessError):
+        message = error.stderr
+    else:
+        message = str(error)
+    if job["payload"].get("task") in ("lazy_tier", "evict_tier"):
+        # The manifest only lists complete tiers, the video keeps playing its other rungs
+        if not will_retry and meta.get("lazy_tier", {}).get("state") == "encoding":
+            detach_tier(UPLOADS_DIR / job["video_id"] / "video.mpd")
+            store_manifest(job["video_id"])
+            tier_dir = lazy_tier_dir(job["video_id"], meta)
+            shutil.rmtree(tier_dir, ignore_errors=True)
+            storage.delete_prefix(f"{storage_key(tier_dir)}/")
+            meta["lazy_tier"] = {
+                "state": "failed",
+                "above": meta["lazy_tier"]["above"],
+                "generation": meta["lazy_tier"].get("generation", 0),
+                "error": message,
+            }
+            write_meta(job["video_id"], meta)
+        return
+    if job["payload"].get("task"):
+        # Background work on a done video, which keeps playing its current rendition
+        meta.pop("reencoding", None)
+        meta["reencode_error"] = message
+        write_meta(job["video_id"], meta)
+        if not will_retry and job["payload"].get("profile"):
+            shutil.rmtree(UPLOADS_DIR / job["video_id"] / job["payload"]["profile"], ignore_errors=True)
+            storage.delete_prefix(f"{job['video_id']}/{job['payload']['profile']}/")
+        return
+    if not will_retry:
+        # Retries resume the encode, the last one leaves nothing to resume
+        discard_checkpoint(UPLOADS_DIR / job["video_id"])
+    meta["status"] = "pending" if will_retry else "error"
+    meta["playable"] = False
+    meta["error"] = message
+    write_meta(job["video_id"], meta)
+
+
+def recover_orphaned_videos():
+    """Requeue videos left pending or processing without a queued job."""
+    for video_dir in UPLOADS_DIR.iterdir():
+        meta_file = video_dir / "meta.json"
+        if not meta_file.exists() or job_queue.has_job(video_dir.name):
+            continue
+        try:
+            meta = read_meta(video_dir.name)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if meta.get("status") in ("pending", "processing"):
+            meta["status"] = "pending"
+            write_meta(video_dir.name, meta)
+            job_queue.enqueue(video_dir.name)
+
+
+resumable_uploads = ResumableUploads()
+
+job_queue = JobQueue(
+    JOBS_DIR,
+    process_video,
+    on_failure=on_job_failure,
+    workers=TRANSCODE_WORKERS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_backoff=JOB_RETRY_BACKOFF,
+)
+metrics.gauge(
+    "dashstreamer_queue_depth", "Transcode jobs waiting to run", callback=job_queue.depth
+)
+metrics.gauge(
+    "dashstreamer_active_jobs", "Transcode jobs running in any process", callback=job_queue.running
+)
+if START_TRANSCODE_WORKERS:
+    ffmpeg_version()  # Picks how rotated sources are encoded, once before any job
+    recover_orphaned_videos()
+    job_queue.start()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Record latency and bytes served per endpoint once the response is sent."""
+    endpoint = request.endpoint or "unmatched"
+    started = g.get("request_started")
+    if started is None or endpoint == "video_events":
+        return response  # Event streams stay open for the whole processing
+
+    def on_close():
+        request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        response_bytes.inc(response.content_length or 0, endpoint=endpoint)
+
+    if response.direct_passthrough:
+        # send_file bodies go straight to the server, which doesn't run close hooks
+        on_close()
+    else:
+        response.call_on_close(on_close)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Metrics of this process in the Prometheus text format."""
+    return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route("/profiles", methods=["GET"])
+def list_profiles():
+    """Encoding profiles accepted by uploads, and the server defaults."""
+    return jsonify(
+        {
+            "default": ENCODING_PROFILE,
+            "reencode": REENCODE_PROFILE or None,
+            "profiles": [
+                {**profile.summary(), "description": profile.description}
+                for profile in PROFILES.values()
+            ],
+        }
+    )
 
 
 @app.route("/videos", methods=["POST"])
@@ -56,70 +844,172 @@ def upload_video():
     title = request.form["title"]
     if file.filename == "" or not is_file_allowed(file.filename):
         return jsonify({"error": "Invalid file"}), 400
+    try:
+        priority = int(request.form.get("priority", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid priority"}), 400
+    profile = request.form.get("profile", ENCODING_PROFILE)
+    if profile not in PROFILES:
+        return jsonify({"error": f"Unknown profile, available: {', '.join(PROFILES)}"}), 400
 
-    # Create snake_case folder name from title
-    base_folder_name = title_to_snake_case(title)
-    video_id = ensure_unique_folder_name(base_folder_name)
-    video_dir = UPLOADS_DIR / video_id
-    video_dir.mkdir(parents=True, exist_ok=True)
+    video_id, video_dir = create_video_folder(title)
 
     original_path = video_dir / f"original{Path(file.filename).suffix}"
-    file.save(original_path)
+    with video_timeline(video_id).span("upload_write") as span:
+        sha256 = save_and_hash(file.stream, original_path)
+        span["bytes"] = original_path.stat().st_size
 
     meta = {
         "id": video_id,
         "title": title,
         "created": datetime.utcnow().isoformat(),
         "status": "pending",
+        "sha256": sha256,
+        "profile": profile,
     }
-    with open(video_dir / "meta.json", "w") as f:
-        json.dump(meta, f)
+    if reuse_duplicate_outputs(video_id, meta):
+        return jsonify(meta), 201
+    store_original(video_id, original_path, meta)
+    write_meta(video_id, meta)
+    job_queue.enqueue(video_id, priority=priority)
+
+    return jsonify(meta), 202
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """Start a resumable upload (tus-like); chunks are sent with PATCH."""
+    data = request.get_json(silent=True) or request.form
+    title = data.get("title")
+    filename = data.get("filename", "")
+    if not title or not is_file_allowed(filename):
+        return jsonify({"error": "Missing title or invalid filename"}), 400
+    try:
+        length = int(request.headers.get("Upload-Length") or data.get("length"))
+        priority = int(data.get("priority", 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid upload length or priority"}), 400
+    if length <= 0:
+        return jsonify({"error": "Invalid upload length"}), 400
+    profile = data.get("profile", ENCODING_PROFILE)
+    if profile not in PROFILES:
+        return jsonify({"error": f"Unknown profile, available: {', '.join(PROFILES)}"}), 400
 
-    def process_video():
+    video_id, video_dir = create_video_folder(title)
+    resumable_uploads.create(video_dir, filename, length, priority=priority)
+    meta = {
+        "id": video_id,
+        "title": title,
+        "created": datetime.utcnow().isoformat(),
+        "status": "uploading",
+        "profile": profile,
+    }
+    write_meta(video_id, meta)
+
+    response = jsonify(meta)
+    response.status_code = 201
+    response.headers["Location"] = url_for("upload_chunk", video_id=video_id)
+    response.headers["Upload-Offset"] = "0"
+    response.headers["Upload-Length"] = str(length)
+    return response
+
+
+@app.route("/uploads/<video_id>", methods=["HEAD"])
+def upload_status(video_id: str):
+    video_dir = UPLOADS_DIR / video_id
+    state = resumable_uploads.state(video_dir) if video_dir.is_dir() else None
+    if state is None:
+        abort(404)
+    response = app.response_class(status=200)
+    response.headers["Upload-Offset"] = str(state["offset"])
+    response.headers["Upload-Length"] = str(state["length"])
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@app.route("/uploads/<video_id>", methods=["PATCH"])
+def upload_chunk(video_id: str):
+    """Append the request body at the Upload-Offset of a resumable upload."""
+    if request.mimetype != "application/offset+octet-stream":
+        return jsonify({"error": "Content-Type must be application/offset+octet-stream"}), 415
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Missing or invalid Upload-Offset"}), 400
+    video_dir = UPLOADS_DIR / video_id
+    if not video_dir.is_dir() or resumable_uploads.state(video_dir) is None:
+        abort(404)
+
+    with resumable_uploads.lock(video_dir):
         try:
-            # Update status to processing
-            meta["status"] = "processing"
-            with open(video_dir / "meta.json", "w") as f:
-                json.dump(meta, f)
-            log_path = video_dir / "processing.log"
-
-            # Extract thumbnail at 1 second
-            thumb_path = video_dir / "thumbnail.jpg"
-            extract_thumbnail(original_path, thumb_path)
-
-            # Create debug MP4 if in debug mode
-            if DEBUG_VIDEO_PROCESSING:
-                debug_mp4_path = video_dir / "debug_converted.mp4"
-                create_debug_mp4(original_path, debug_mp4_path, log_path=log_path)
-
-            create_dash_stream(original_path, video_dir, log_path=log_path, debug=DEBUG_VIDEO_PROCESSING)
-            meta["status"] = "done"
-            meta["log"] = str(log_path.name)
-            meta["thumbnail"] = "thumbnail.jpg"
-        except subprocess.CalledProcessError as e:
-            meta["status"] = "error"
-            meta["error"] = e.stderr
-        except Exception as e:
-            meta["status"] = "error"
-            meta["error"] = str(e)
-        with open(video_dir / "meta.json", "w") as f:
-            json.dump(meta, f)
-
-    threading.Thread(target=process_video, daemon=True).start()
+            with video_timeline(video_id).span("upload_write", offset=offset) as span:
+                state = resumable_uploads.append(
+                    video_dir, offset, request.stream, request.headers.get("Upload-Checksum")
+                )
+                span["bytes"] = state["offset"] - offset
+        except UploadConflict as e:
+            return jsonify({"error": str(e)}), 409
+        except ChecksumMismatch as e:
+            return jsonify({"error": str(e)}), 460
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-    return jsonify(meta), 202
+        if state["complete"]:
+            meta = read_meta(video_id)
+            meta["status"] = "pending"
+            meta["sha256"] = state["sha256"]
+            if not reuse_duplicate_outputs(video_id, meta):
+                store_original(video_id, video_dir / state["filename"], meta)
+                write_meta(video_id, meta)
+                job_queue.enqueue(video_id, priority=state.get("priority", 0))
+
+    response = app.response_class(status=204)
+    response.headers["Upload-Offset"] = str(state["offset"])
+    return response
 
 
 @app.route("/videos", methods=["GET"])
 def list_videos():
-    videos = []
-    for video_dir in UPLOADS_DIR.iterdir():
-        meta_file = video_dir / "meta.json"
-        if meta_file.exists():
-            with open(meta_file) as f:
-                meta = json.load(f)
-                videos.append(meta)
-    return jsonify(videos)
+    status = request.args.get("status")
+    order = request.args.get("order", "desc")
+    cursor = request.args.get("cursor")
+    try:
+        limit = int(request.args.get("limit", VIDEOS_PAGE_LIMIT))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    if order not in ("asc", "desc") or not 1 <= limit <= VIDEOS_PAGE_MAX_LIMIT:
+        return jsonify({"error": "Invalid order or limit"}), 400
+
+    # The catalog version changes on every write, so it validates any page
+    query = request.query_string.decode()
+    etag = hashlib.sha1(f"{catalog.version()}:{query}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        videos, next_cursor = catalog.list(status=status, order=order, limit=limit, cursor=cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if storage.public_url:
+        # Public URLs don't expire, so they are safe in a cached page
+        for video in videos:
+            if video.get("status") == "done":
+                video["manifest_url"] = storage.url(f"{video['id']}/video.mpd")
+                if video.get("thumbnail"):
+                    video["thumbnail_url"] = storage.url(f"{video['id']}/{video['thumbnail']}")
+
+    response = jsonify(videos)
+    response.set_etag(etag)
+    if next_cursor:
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        next_url = url_for("list_videos", **args)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 
 @app.route("/videos/<video_id>/info", methods=["GET"])
@@ -132,6 +1022,61 @@ def video_info(video_id: str):
     return jsonify(meta)
 
 
+@app.route("/videos/<video_id>/events", methods=["GET"])
+def video_events(video_id: str):
+    """Stream status and encode progress of a video as Server-Sent Events."""
+    if not (UPLOADS_DIR / video_id / "meta.json").exists():
+        abort(404)
+
+    def stream():
+        subscriber = events.subscribe(video_id)
+        progress_file = ProgressFile(UPLOADS_DIR / video_id)
+        # Whether the job runs in this process, so its progress comes from the EventBus
+        local_progress = False
+        # Whether the progress file of another process was seen
+        remote_progress = False
+        try:
+            last_meta = read_meta(video_id)
+            yield format_sse("status", last_meta)
+            next_poll = time.monotonic() + EVENTS_KEEPALIVE
+            while last_meta.get("status") not in ("done", "error"):
+                try:
+                    event, data = subscriber.get(timeout=EVENTS_POLL_INTERVAL)
+                except queue.Empty:
+                    # Encodes run by another process (transcode_worker.py) only
+                    # reach the progress file, and their status changes the catalog
+                    progress = None if local_progress else progress_file.read_if_changed()
+                    if progress is not None:
+                        remote_progress = True
+                        yield format_sse("progress", progress)
+                    # The file is removed once the video is done or failed
+                    finished = remote_progress and not progress_file.exists()
+                    if time.monotonic() < next_poll and not finished:
+                        continue
+                    next_poll = time.monotonic() + EVENTS_KEEPALIVE
+                    meta = catalog.get(video_id) or last_meta
+                    if meta != last_meta:
+                        last_meta = meta
+                        yield format_sse("status", meta)
+                    elif progress is None:
+                        yield ": keep-alive\n\n"
+                    continue
+                if event == "progress":
+                    local_progress = True
+                elif event == "status":
+                    if data == last_meta:
+                        continue
+                    last_meta = data
+                yield format_sse(event, data)
+        finally:
+            events.unsubscribe(video_id, subscriber)
+
+    response = Response(stream_with_context(stream()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/videos/<video_id>/log", methods=["GET"])
 def get_processing_log(video_id: str):
     video_dir = UPLOADS_DIR / video_id
@@ -143,6 +1088,16 @@ def get_processing_log(video_id: str):
     return jsonify({"log": log_content})
 
 
+@app.route("/videos/<video_id>/timeline", methods=["GET"])
+def get_timeline(video_id: str):
+    """Timing spans of the upload and processing stages of a video."""
+    try:
+        timeline = read_timeline(UPLOADS_DIR / video_id)
+    except FileNotFoundError:
+        return jsonify({"error": "Timeline not found"}), 404
+    return jsonify(timeline)
+
+
 @app.route("/videos/<video_id>/thumbnail", methods=["GET"])
 def get_thumbnail(video_id: str):
     video_dir = UPLOADS_DIR / video_id
@@ -152,22 +1107,189 @@ def get_thumbnail(video_id: str):
     return send_from_directory(video_dir, "thumbnail.jpg", mimetype="image/jpeg")
 
 
+def serve_indexed_segment(video_id: str, filename: str, single_file: str, offset: int, length: int):
+    """Serve a segment URL of the template from its byte range in a single-file rendition."""
+    try:
+        with open(single_file, "rb") as f:
+            stat = os.fstat(f.fileno())
+            f.seek(offset)
+            data = f.read(length)
+    except FileNotFoundError:
+        abort(404)
+    meta = catalog.get(video_id)
+    complete = meta is not None and meta.get("status") == "done"
+    response = app.response_class(data, mimetype=guess_mimetype(filename))
+    response.set_etag(f"{file_etag(stat)}-{offset:x}")
+    response.last_modified = stat.st_mtime
+    response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    response.headers["Cache-Control"] = cache_control(filename, complete)
+    return response
+
+
+def read_stored_segment(key: str, offset: int, length: int):
+    """
+    Bytes of a segment URL of a single-file rendition only found in the storage backend.
+
+    Args:
+        key: Storage key of the single file
+        offset: Offset of the segment in it
+        length: Length of the segment
+
+    Returns:
+        tuple: (data, etag, last modified), or None if the single file is not stored
+    """
+    stored = storage.get(key, f"bytes={offset}-{offset + length - 1}")
+    if stored is None:
+        return None
+    try:
+        if stored.status != 206:
+            return None
+        data = b"".join(stored.chunks)
+    finally:
+        stored.close()
+    tag = (stored.etag or "").strip('"')
+    return data, f"{tag}-{offset:x}", stored.last_modified
+
+
+def is_packed_segment(file_path: str, key: str):
+    """
+    Whether a file is a segment URL of a single-file rendition, which only
+    exists as a byte range and can't be redirected to.
+    """
+    if not key.endswith(".m4s"):
+        return False
+    if segment_index.locate(file_path) is not None:
+        return True
+    return not storage.in_place and segment_index.locate_stored(storage, key) is not None
+
+
+def serve_stored_segment(filename: str, key: str, offset: int, length: int, complete: bool):
+    """Serve a segment URL of the template from its byte range in a stored single-file rendition."""
+    segment = read_stored_segment(key, offset, length)
+    if segment is None:
+        abort(404)
+    data, etag, last_modified = segment
+    response = app.response_class(data, mimetype=guess_mimetype(filename))
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    response.headers["Cache-Control"] = cache_control(filename, complete)
+    return response
+
+
+def serve_stored_file(video_id: str, filename: str, complete: bool):
+    """Serve a file this host only has in the storage backend, e.g. on a delivery host."""
+    key = f"{video_id}/{filename}"
+    mimetype = guess_mimetype(filename)
+    path = storage.path(key)
+    if path is not None:
+        try:
+            stat = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            abort(404)
+        response = send_file(
+            path.resolve(),
+            mimetype=mimetype,
+            conditional=True,
+            etag=file_etag(stat),
+            last_modified=stat.st_mtime,
+            max_age=None,
+        )
+    else:
+        stored = storage.get(key, request.headers.get("Range"), request.headers.get("If-None-Match"))
+        if stored is None:
+            abort(404)
+        response = app.response_class(stored.chunks, status=stored.status, mimetype=mimetype)
+        response.call_on_close(stored.close)
+        response.headers["Accept-Ranges"] = "bytes"
+        if stored.status in (200, 206):
+            response.headers["Content-Length"] = str(stored.length)
+        if stored.content_range:
+            response.headers["Content-Range"] = stored.content_range
+        if stored.etag:
+            response.headers["ETag"] = stored.etag
+        if stored.last_modified:
+            response.last_modified = stored.last_modified
+    response.headers["Cache-Control"] = cache_control(filename, complete)
+    return response
+
+
 @app.route("/videos/<video_id>/<path:filename>", methods=["GET"])
 def serve_video_file(video_id: str, filename: str):
-    video_dir = UPLOADS_DIR / video_id
-    file_path = video_dir / filename
-    if not file_path.exists():
-        abort(404)
+    file_path = safe_join(str(UPLOADS_DIR), video_id, filename)
+    if file_path is None or filename.endswith(".tmp"):
+        abort(404)  # Files still being written by ffmpeg or write_json_atomic
+    meta = catalog.get(video_id)
+    complete = meta is not None and meta.get("status") == "done"
+    key = f"{video_id}/{filename}"
+    if (
+        complete
+        and STORAGE_REDIRECT
+        and is_stored_output(filename)
+        and not is_packed_segment(file_path, key)
+    ):
+        # Players fetch the bytes straight from the store or its CDN
+        url = storage.redirect_url(key)
+        if url:
+            if LAZY_RUNGS_ABOVE:
+                track_demand(video_id, filename)
+            response = redirect(url)
+            response.headers["Cache-Control"] = (
+                cache_control(filename, complete)
+                if storage.public_url
+                else f"private, max-age={STORAGE_URL_EXPIRY // 2}"
+            )
+            return response
+    try:
+        stat = os.stat(file_path)
+    except (FileNotFoundError, NotADirectoryError):
+        location = segment_index.locate(file_path)
+        if location is None and (storage.in_place or not is_stored_output(filename)):
+            abort(404)
+        if LAZY_RUNGS_ABOVE:
+            track_demand(video_id, filename)
+        if location is None:
+            # Not encoded on this host
+            location = segment_index.locate_stored(storage, key)
+            if location is None:
+                return serve_stored_file(video_id, filename, complete)
+            return serve_stored_segment(filename, *location, complete)
+        return serve_indexed_segment(video_id, filename, *location)
+    if LAZY_RUNGS_ABOVE:
+        track_demand(video_id, filename)
+
     # Set correct mimetype for manifest and segments
-    if filename.endswith(".mpd"):
-        mimetype = "application/dash+xml"
-    elif filename.endswith(".m4s"):
-        mimetype = "video/iso.segment"
-    elif filename.endswith(".jpg") or filename.endswith(".jpeg"):
-        mimetype = "image/jpeg"
+    mimetype = guess_mimetype(filename)
+    etag = file_etag(stat)
+    if SEGMENT_OFFLOAD == "x-accel-redirect":
+        response = app.response_class(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = f"{SEGMENT_OFFLOAD_PREFIX}{video_id}/{filename}"
     else:
-        mimetype = None
-    return send_from_directory(video_dir, filename, mimetype=mimetype)
+        data = segment_cache.get(file_path, stat)
+        if data is None and not app.config["USE_X_SENDFILE"] and segment_cache.should_cache(file_path, stat):
+            with open(file_path, "rb") as f:
+                data = f.read()
+            segment_cache.put(file_path, stat, data)
+
+        if data is None:
+            # Large or cold files: werkzeug streams them and handles ranges/X-Sendfile
+            response = send_file(
+                os.path.abspath(file_path),
+                mimetype=mimetype,
+                conditional=True,
+                etag=etag,
+                last_modified=stat.st_mtime,
+                max_age=None,
+            )
+        else:
+            response = app.response_class(data, mimetype=mimetype)
+            response.set_etag(etag)
+            response.last_modified = stat.st_mtime
+            response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+    response.headers["Cache-Control"] = cache_control(filename, complete)
+    return response
 
 
 if __name__ == "__main__":
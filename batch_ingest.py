@@ -0,0 +1,263 @@
+"""
+Ingest a directory or manifest of videos without going through the HTTP API.
+
+Every file gets the same ``uploads/<video_id>/`` folder, ``meta.json`` and
+outputs as an upload to ``POST /videos``: the original is copied and hashed,
+and the video is processed by the server's own pipeline (duplicate reuse,
+probe, DASH ladder, thumbnails) in a bounded pool of processes.
+
+Progress is kept in a state file mapping every source file to its video id,
+so an interrupted run resumes where it stopped: completed videos are
+skipped and unfinished ones are processed again in their existing folder.
+Run it from the server directory, with the same environment as the server
+(e.g. ``ENCODING_PROFILE``, ``DASH_PARALLEL_WORKERS``).
+
+Usage:
+    python batch_ingest.py /archive/videos --workers 4
+    python batch_ingest.py manifest.jsonl --state backfill_state.json
+
+A manifest is either a text file with one path per line, or a JSON Lines
+file with ``{"path": ..., "title": ..., "profile": ..., "priority": ...}``
+objects (only ``path`` is required).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+# The pool processes only run the pipeline, they must not start queue workers
+os.environ["START_TRANSCODE_WORKERS"] = "false"
+
+import app  # noqa: E402
+from dedup import save_and_hash  # noqa: E402
+from encoding_profiles import PROFILES  # noqa: E402
+from job_queue import write_json_atomic  # noqa: E402
+from video_processor import is_file_allowed  # noqa: E402
+
+DEFAULT_STATE_FILE = Path("batch_ingest_state.json")
+
+
+def read_items(source: Path) -> list:
+    """
+    List the files to ingest from a directory (recursively) or a manifest.
+
+    Returns:
+        list: Dicts with the absolute ``path`` and optional title, profile and priority
+    """
+    if source.is_dir():
+        paths = sorted(p for p in source.rglob("*") if p.is_file() and is_file_allowed(p.name))
+        return [{"path": str(p.resolve())} for p in paths]
+
+    items = []
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line) if line.startswith("{") else {"path": line}
+            # Relative paths in a manifest are relative to the manifest
+            item["path"] = str((source.parent / item["path"]).resolve())
+            items.append(item)
+    return items
+
+
+def read_state(path: Path) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"items": {}}
+
+
+def is_done(video_id: str) -> bool:
+    try:
+        return app.read_meta(video_id).get("status") == "done"
+    except (OSError, json.JSONDecodeError):
+        return False
+
+
+def ingest(item: dict, video_id: str) -> dict:
+    """
+    Copy one file into its video folder and run the processing pipeline on it.
+
+    Runs in a pool process. Failures are recorded in ``meta.json`` like a
+    failed job, and reported instead of raised.
+
+    Returns:
+        dict: Outcome with the video id, status, media duration and timings
+    """
+    source = Path(item["path"])
+    video_dir = app.UPLOADS_DIR / video_id
+    video_dir.mkdir(parents=True, exist_ok=True)
+    started = time.time()
+    result = {"path": item["path"], "id": video_id, "duration": 0.0}
+
+    try:
+        original_path = video_dir / f"original{source.suffix}"
+        for stale in video_dir.glob("original.*"):
+            if stale != original_path:
+                stale.unlink()
+        meta = {
+            "id": video_id,
+            "title": item.get("title") or source.stem,
+            "created": datetime.utcnow().isoformat(),
+            "status": "pending",
+            "profile": item.get("profile", app.ENCODING_PROFILE),
+            "source": item["path"],
+        }
+        if (video_dir / "meta.json").exists():
+            previous = app.read_meta(video_id)
+            meta["created"] = previous.get("created", meta["created"])
+            meta["sha256"] = previous.get("sha256")
+        if not meta.get("sha256") or not original_path.exists() or (
+            original_path.stat().st_size != source.stat().st_size
+        ):
+            with app.video_timeline(video_id).span("upload_write") as span:
+                with open(source, "rb") as f:
+                    meta["sha256"] = save_and_hash(f, original_path)
+                span["bytes"] = original_path.stat().st_size
+            app.store_original(video_id, original_path, meta)
+        app.write_meta(video_id, meta)
+
+        now = time.time()
+        job = {
+            "id": video_id,
+            "video_id": video_id,
+            "attempts": 1,
+            "enqueued": now,
+            "started": now,
+            "payload": {},
+        }
+        try:
+            app.process_video(job)
+        except Exception as e:
+            app.on_job_failure(job, e, will_retry=False)
+            raise
+
+        meta = app.read_meta(video_id)
+        result["status"] = meta["status"]
+        result["duplicate_of"] = meta.get("duplicate_of")
+        result["duration"] = (meta.get("video") or {}).get("duration") or 0.0
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["wall_s"] = round(time.time() - started, 2)
+    return result
+
+
+def summarize(results: list, wall_s: float, skipped: int) -> dict:
+    """Aggregate throughput of a batch run."""
+    done = [r for r in results if r["status"] == "done"]
+    encoded = [r for r in done if not r.get("duplicate_of")]
+    media_s = sum(r["duration"] for r in encoded)
+    return {
+        "done": len(done),
+        "duplicates": len(done) - len(encoded),
+        "failed": len(results) - len(done),
+        "skipped": skipped,
+        "wall_s": round(wall_s, 1),
+        "media_s": round(media_s, 1),
+        "videos_per_hour": round(len(done) / wall_s * 3600, 1) if wall_s else None,
+        # Seconds of video encoded per second of wall time, all processes together
+        "realtime_factor": round(media_s / wall_s, 2) if wall_s else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", type=Path, help="Directory of videos or manifest file")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=app.TRANSCODE_WORKERS,
+        help="Videos processed concurrently (default TRANSCODE_WORKERS)",
+    )
+    parser.add_argument(
+        "--state",
+        type=Path,
+        default=DEFAULT_STATE_FILE,
+        help="Progress file used to skip completed files and resume",
+    )
+    parser.add_argument("--profile", choices=sorted(PROFILES), help="Profile of items without one")
+    parser.add_argument("--retry-failed", action="store_true", help="Process failed items again")
+    parser.add_argument("--json", type=Path, help="Write the per-file results and summary here")
+    args = parser.parse_args()
+
+    items = read_items(args.source)
+    for item in items:
+        if args.profile:
+            item.setdefault("profile", args.profile)
+        if item.get("profile", app.ENCODING_PROFILE) not in PROFILES:
+            parser.error(f"Unknown profile {item['profile']} for {item['path']}")
+    items.sort(key=lambda item: -int(item.get("priority", 0)))
+
+    state = read_state(args.state)
+    pending = []
+    skipped = 0
+    for item in items:
+        entry = state["items"].get(item["path"])
+        if entry and is_done(entry["id"]):
+            skipped += 1
+            continue
+        if entry and entry.get("status") == "error" and not args.retry_failed:
+            skipped += 1
+            continue
+        if entry is None:
+            # Ids are assigned here, so concurrent processes never pick the same folder
+            video_id, _ = app.create_video_folder(item.get("title") or Path(item["path"]).stem)
+            entry = state["items"][item["path"]] = {"id": video_id}
+        pending.append((item, entry["id"]))
+    write_json_atomic(args.state, state)
+    print(f"{len(items)} files, {skipped} skipped, {len(pending)} to process with {args.workers} workers")
+
+    results = []
+    started = time.time()
+    # Every pool process schedules its ffmpeg threads within its share of the cores
+    if not app.CPU_CORES:
+        os.environ["CPU_CORES"] = str(max(1, app.cpu_scheduler.cores // max(1, args.workers)))
+    # Fresh interpreters: the server modules hold SQLite connections and threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), mp_context=context) as pool:
+        futures = [pool.submit(ingest, item, video_id) for item, video_id in pending]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                state["items"][result["path"]].update(
+                    status=result["status"], error=result.get("error")
+                )
+                write_json_atomic(args.state, state)
+                detail = result.get("error") or (
+                    f"duplicate of {result['duplicate_of']}" if result.get("duplicate_of") else ""
+                )
+                print(
+                    f"[{len(results)}/{len(pending)}] {result['status']:<5} {result['id']}"
+                    f" {result['wall_s']:.1f}s {detail}"
+                )
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            print("Interrupted, run the same command again to resume")
+            raise
+
+    summary = summarize(results, time.time() - started, skipped)
+    print(
+        f"\n{summary['done']} done ({summary['duplicates']} duplicates), {summary['failed']} failed,"
+        f" {summary['skipped']} skipped in {summary['wall_s']}s"
+    )
+    print(
+        f"{summary['videos_per_hour']} videos/hour, {summary['media_s']}s of video encoded"
+        f" at {summary['realtime_factor']}x realtime"
+    )
+    if args.json:
+        args.json.write_text(json.dumps({"summary": summary, "results": results}, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
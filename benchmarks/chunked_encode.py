@@ -0,0 +1,135 @@
+"""
+Benchmark chunked (split-and-stitch) DASH encoding against the chunk count.
+
+Generates a synthetic source with ffmpeg lavfi and encodes it with
+create_dash_stream for each requested chunk count, reporting wall time and
+speedup relative to a single chunk. Every output must also be one timeline:
+the decode times of each representation's segments follow each other
+without gaps or overlaps and cover the source, otherwise the script exits
+with status 1.
+
+Usage:
+    python benchmarks/chunked_encode.py --duration 120 --chunks 1 2 4 8
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dash_packaging import segment_timeline  # noqa: E402
+from video_processor import create_dash_stream  # noqa: E402
+
+# Largest gap, overlap or difference to the source duration in seconds
+# (audio frames are about 21 ms long, video frames 33 ms at 30 fps)
+TIMELINE_TOLERANCE = 0.05
+
+
+def make_source(path: Path, duration: int, size: str, rate: int):
+    """Generate a deterministic test video with a sine audio track."""
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size={size}:rate={rate}:duration={duration}",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:sample_rate=48000:duration={duration}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-c:a",
+            "aac",
+            "-shortest",
+            str(path),
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+def timeline_problems(output_dir: Path, duration: float) -> list:
+    """Discontinuities of the segment timelines of an output, and coverage errors."""
+    problems = []
+    for init in sorted(output_dir.glob("init_*.m4s")):
+        rep_id = init.stem.split("_", 1)[1]
+        segments = sorted(
+            output_dir.glob(f"chunk_{rep_id}_*.m4s"), key=lambda path: int(path.stem.rsplit("_", 1)[1])
+        )
+        timeline = segment_timeline(init, segments)
+        if not timeline:
+            problems.append(f"representation {rep_id}: no segments")
+            continue
+        for (start, length), (next_start, _), path in zip(timeline, timeline[1:], segments[1:]):
+            if abs(start + length - next_start) > TIMELINE_TOLERANCE:
+                problems.append(
+                    f"{path.name} starts at {next_start:.3f}s, the previous segment ends at {start + length:.3f}s"
+                )
+        first, (last, last_length) = timeline[0][0], timeline[-1]
+        covered = last + last_length - first
+        if abs(covered - duration) > TIMELINE_TOLERANCE or abs(first) > TIMELINE_TOLERANCE:
+            problems.append(
+                f"representation {rep_id}: {first:.3f}s to {last + last_length:.3f}s, source is {duration}s"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=int, default=120, help="Source duration in seconds")
+    parser.add_argument("--size", default="1920x1080", help="Source resolution")
+    parser.add_argument("--rate", type=int, default=30, help="Source frame rate")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_chunked_"))
+    try:
+        source = work_dir / "source.mp4"
+        make_source(source, args.duration, args.size, args.rate)
+
+        results = []
+        problems = []
+        for chunks in args.chunks:
+            output_dir = work_dir / f"chunks_{chunks}"
+            output_dir.mkdir()
+            start = time.perf_counter()
+            create_dash_stream(source, output_dir, chunks=chunks)
+            elapsed = time.perf_counter() - start
+            segments = len(list(output_dir.glob("chunk_*.m4s")))
+            results.append({"chunks": chunks, "seconds": elapsed, "segments": segments})
+            problems += [f"{chunks} chunks: {problem}" for problem in timeline_problems(output_dir, args.duration)]
+
+        baseline = results[0]["seconds"]
+        print(f"{'chunks':>6} {'seconds':>9} {'speedup':>8} {'x realtime':>10} {'segments':>8}")
+        for result in results:
+            result["speedup"] = baseline / result["seconds"]
+            result["realtime_factor"] = args.duration / result["seconds"]
+            print(
+                f"{result['chunks']:>6} {result['seconds']:>9.2f} {result['speedup']:>8.2f}"
+                f" {result['realtime_factor']:>10.2f} {result['segments']:>8}"
+            )
+
+        if args.json:
+            args.json.write_text(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for problem in problems:
+        print(f"TIMELINE: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Deterministic synthetic test videos generated with ffmpeg lavfi.
+
+Every fixture is rendered from testsrc2 (video) and sine (audio), so the
+same spec always produces the same frames. Rotated fixtures carry a Display
+Matrix like phone recordings, and the mebx fixture adds an iPhone-style
+timed metadata track. The scene-cut fixture concatenates different lavfi
+sources, with cuts that don't fall on segment boundaries.
+"""
+import subprocess
+import tempfile
+from pathlib import Path
+
+FIXTURES = {
+    "landscape_1080p": {"size": "1920x1080", "duration": 20},
+    "landscape_720p_short": {"size": "1280x720", "duration": 6},
+    "landscape_480p_1s": {"size": "854x480", "duration": 1},
+    "portrait_1080x1920": {"size": "1080x1920", "duration": 10},
+    "rotated_90": {"size": "1920x1080", "duration": 10, "rotation": 90},
+    "rotated_270": {"size": "1920x1080", "duration": 10, "rotation": 270},
+    "iphone_mebx_rotated": {"size": "1920x1080", "duration": 10, "rotation": 90, "mebx": True},
+    "uhd_2160p": {"size": "3840x2160", "duration": 10},
+    "silent_720p": {"size": "1280x720", "duration": 10, "audio": False},
+    "scene_cuts_1080p": {"size": "1920x1080", "duration": 20, "scenes": "5.5,4.3,6.1,4.1"},
+}
+
+# Sources of consecutive scenes, all with motion
+SCENE_SOURCES = ("testsrc2", "mandelbrot", "life=mold=10:ratio=0.3:seed=1", "cellauto=rule=110:seed=1")
+
+
+def _video_source(spec: dict, rate: int) -> str:
+    """lavfi graph of the fixture video."""
+    size = spec["size"]
+    if not spec.get("scenes"):
+        return f"testsrc2=size={size}:rate={rate}:duration={spec['duration']}"
+    labels = []
+    graph = []
+    for i, length in enumerate(spec["scenes"].split(",")):
+        source = SCENE_SOURCES[i % len(SCENE_SOURCES)]
+        separator = ":" if "=" in source else "="
+        graph.append(
+            f"{source}{separator}size={size}:rate={rate},trim=duration={length},"
+            f"setpts=PTS-STARTPTS,format=yuv420p[s{i}]"
+        )
+        labels.append(f"[s{i}]")
+    graph.append(f"{''.join(labels)}concat=n={len(labels)}:v=1:a=0[out0]")
+    return ";".join(graph)
+
+
+def fixture_name(name: str, spec: dict) -> str:
+    """File name of a fixture, changing whenever its spec changes."""
+    key = "_".join(f"{k}{v}" for k, v in sorted(spec.items()))
+    return f"{name}__{key.replace(':', '')}.mov"
+
+
+def make_fixture(path: Path, spec: dict):
+    """
+    Render a fixture video.
+
+    Args:
+        path: Output file (a .mov, so that data tracks can be muxed)
+        spec: Fixture spec with size, duration, and optionally rate (30),
+            audio (True), rotation (degrees of Display Matrix), mebx (False) and
+            scenes (comma-separated scene lengths in seconds, summing to duration)
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg fails (e.g. it cannot mux mebx)
+    """
+    rate = spec.get("rate", 30)
+    duration = spec["duration"]
+    with tempfile.TemporaryDirectory(prefix="fixture_") as tmp:
+        base = Path(tmp) / "base.mov"
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            _video_source(spec, rate),
+        ]
+        if spec.get("audio", True):
+            cmd += [
+                "-f",
+                "lavfi",
+                "-i",
+                f"sine=frequency=440:sample_rate=48000:duration={duration}",
+                "-c:a",
+                "aac",
+            ]
+        cmd += [
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-pix_fmt",
+            "yuv420p",
+            "-g",
+            str(rate * 2),
+            "-threads",
+            "1",  # Single-threaded x264 output is bit-exact between runs
+            "-shortest",
+            str(base),
+        ]
+        subprocess.run(cmd, check=True, capture_output=True)
+
+        # Stream copy adds the Display Matrix and the data track without re-encoding
+        cmd = ["ffmpeg", "-y"]
+        if spec.get("rotation"):
+            cmd += ["-display_rotation:v:0", str(spec["rotation"])]
+        cmd += ["-i", str(base)]
+        maps = ["-map", "0:v", "-map", "0:a?"]
+        if spec.get("mebx"):
+            # One 16-byte metadata sample per second, like the iPhone's mebx tracks
+            samples = Path(tmp) / "mebx.bin"
+            samples.write_bytes(bytes(16) * duration)
+            cmd += ["-f", "data", "-i", str(samples)]
+            maps += ["-map", "1:d", "-tag:d", "mebx"]
+        cmd += maps + ["-c", "copy", str(path)]
+        subprocess.run(cmd, check=True, capture_output=True)
+
+
+def ensure_fixture(fixtures_dir: Path, name: str, spec: dict = None) -> Path:
+    """Path of a fixture, rendering it into fixtures_dir if it is not there yet."""
+    spec = spec or FIXTURES[name]
+    fixtures_dir.mkdir(parents=True, exist_ok=True)
+    path = fixtures_dir / fixture_name(name, spec)
+    if not path.exists():
+        tmp = path.with_suffix(".tmp.mov")
+        make_fixture(tmp, spec)
+        tmp.rename(path)
+    return path
@@ -0,0 +1,177 @@
+"""
+Compare the bitrate of segment-aligned and scene-cut-aware keyframes.
+
+Encodes fixtures at the constant quality (CRF) of an encoding profile with
+three keyframe placements and reports the bitrate and the PSNR/SSIM against
+the source, so the byte savings can be weighed against the quality:
+
+- legacy: a keyframe every second, plus the encoder's own scene cuts
+  (the placement used before GOPs were aligned to segments)
+- aligned: one closed GOP per segment (the profile's regular grid)
+- scene: the grid moved to nearby scene cuts, plus keyframes at the others
+
+Usage:
+    python benchmarks/gop_alignment.py
+    python benchmarks/gop_alignment.py --fixtures landscape_1080p --profile archive
+"""
+import argparse
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from encoding_profiles import PROFILES  # noqa: E402
+from fixtures import FIXTURES, ensure_fixture  # noqa: E402
+from video_processor import (  # noqa: E402
+    KeyframePlan,
+    detect_scene_cuts,
+    plan_keyframe_times,
+    probe_video,
+)
+
+VARIANTS = ("legacy", "aligned", "scene")
+
+
+def keyframe_args(variant: str, profile, source: Path) -> list:
+    """ffmpeg arguments placing the keyframes of a variant."""
+    if variant == "legacy":
+        return ["-force_key_frames", "expr:gte(t,n_forced*1)", "-sc_threshold", "40"]
+    probe = probe_video(source)
+    plan = KeyframePlan(profile.seg_duration, profile.gop, frame_rate=probe.frame_rate)
+    if variant == "scene":
+        cuts = detect_scene_cuts(source)
+        plan = KeyframePlan(
+            profile.seg_duration,
+            profile.gop,
+            plan_keyframe_times(
+                probe.duration,
+                profile.gop,
+                cuts,
+                profile.scene_cut_tolerance,
+                seg_duration=profile.seg_duration,
+            ),
+            probe.frame_rate,
+        )
+    options = {**plan.dash_options(), **profile.keyframe_options()}
+    options.pop("seg_duration")
+    options.pop("use_timeline", None)
+    args = []
+    for key, value in options.items():
+        args += [f"-{key}", str(value)]
+    return args
+
+
+def encode(source: Path, output: Path, profile, variant: str):
+    cmd = ["ffmpeg", "-y", "-i", str(source), "-map", "0:v:0"]
+    cmd += profile.encoder_args() + keyframe_args(variant, profile, source)
+    cmd += [str(output)]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def quality(encoded: Path, source: Path) -> dict:
+    """Average PSNR and SSIM of an encode against its source."""
+    result = subprocess.run(
+        [
+            "ffmpeg",
+            "-i",
+            str(encoded),
+            "-i",
+            str(source),
+            "-lavfi",
+            "[0:v][1:v]psnr;[0:v][1:v]ssim",
+            "-f",
+            "null",
+            "-",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr)
+    ssim = re.search(r"SSIM .*All:([\d.]+)", result.stderr)
+    return {
+        "psnr": float(psnr.group(1)) if psnr else None,
+        "ssim": float(ssim.group(1)) if ssim else None,
+    }
+
+
+def keyframe_count(path: Path) -> int:
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-skip_frame",
+            "nokey",
+            "-show_entries",
+            "frame=pts_time",
+            "-of",
+            "csv=p=0",
+            str(path),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return len(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--fixtures",
+        nargs="+",
+        choices=sorted(FIXTURES),
+        default=["landscape_1080p", "scene_cuts_1080p"],
+    )
+    parser.add_argument(
+        "--fixtures-dir",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "dashstreamer_fixtures",
+        help="Directory where rendered fixtures are kept between runs",
+    )
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="archive")
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    results = {"profile": profile.name, "fixtures": {}}
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_gop_"))
+    try:
+        print(f"{'fixture':<20} {'variant':<8} {'keys':>5} {'kbps':>8} {'saved':>7} {'PSNR':>7} {'SSIM':>7}")
+        for name in args.fixtures:
+            source = ensure_fixture(args.fixtures_dir, name)
+            duration = probe_video(source).duration
+            rows = {}
+            for variant in VARIANTS:
+                output = work_dir / f"{name}_{variant}.mp4"
+                encode(source, output, profile, variant)
+                rows[variant] = {
+                    "keyframes": keyframe_count(output),
+                    "kbps": round(output.stat().st_size * 8 / duration / 1000, 1),
+                    **quality(output, source),
+                }
+            for variant, row in rows.items():
+                row["saved"] = round(1 - row["kbps"] / rows["legacy"]["kbps"], 4)
+                print(
+                    f"{name:<20} {variant:<8} {row['keyframes']:>5} {row['kbps']:>8.0f}"
+                    f" {row['saved']:>7.1%} {row['psnr'] or 0:>7.2f} {row['ssim'] or 0:>7.4f}"
+                )
+            results["fixtures"][name] = rows
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
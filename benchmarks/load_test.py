@@ -0,0 +1,448 @@
+"""
+Load test the delivery of a processed video to concurrent DASH players.
+
+Every simulated player loads the manifest, picks a video representation
+and fetches its init segment and media segments in order over one
+keep-alive connection, then starts again from the manifest until the test
+duration is over. Template manifests are fetched by segment URL,
+single-file ones (SegmentBase) by byte range from their ``sidx``. With
+--realtime, players wait for the duration of every segment before fetching
+the next one, like a player with a full buffer, instead of fetching back to
+back.
+
+With --bandwidth, every player's link is limited to that many kbps and the
+players simulate playback: it starts once --startup-buffer seconds are
+downloaded, stalls whenever the next segment arrives after the buffer ran
+dry, and players stop fetching while --max-buffer seconds are ahead. The
+``adaptive`` rung picks, for every segment, the highest representation
+whose bandwidth fits the measured throughput, so a ladder without low rungs
+shows up as rebuffering on slow links.
+
+Prints requests per second, bytes per second, errors and latency
+percentiles (time to the last byte) for manifests and segments, and with
+--bandwidth the startup time, rebuffering and played bitrate of the
+playback sessions.
+
+Usage:
+    python benchmarks/load_test.py http://localhost:8001 <video_id> --players 200 --duration 30
+    python benchmarks/load_test.py http://localhost:8000 <video_id> --rung lowest --json load.json
+    python benchmarks/load_test.py http://localhost:8001 <video_id> --rung adaptive --bandwidth 800
+"""
+import argparse
+import http.client
+import json
+import math
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin, urlsplit
+
+RUNGS = ("highest", "lowest", "random", "adaptive")
+# Share of the measured throughput an adaptive player spends on video
+ADAPTIVE_SAFETY = 0.8
+# Weight of the last segment in the throughput estimate of adaptive players
+THROUGHPUT_WEIGHT = 0.3
+
+
+def parse_duration(value: str) -> float:
+    """Seconds of an ISO 8601 duration such as ``PT1H2M3.5S``."""
+    match = re.fullmatch(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?", value or "")
+    if not match:
+        return 0.0
+    days, hours, minutes, seconds = (float(part or 0) for part in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def parse_sidx(data: bytes, index_start: int) -> list:
+    """Byte ranges and durations of the segments referenced by a ``sidx`` box."""
+    size, box_type = struct.unpack_from(">I4s", data, 0)
+    if box_type != b"sidx":
+        raise ValueError("No sidx box at the index range")
+    version = data[8]
+    timescale = struct.unpack_from(">I", data, 16)[0]
+    if version == 0:
+        first_offset = struct.unpack_from(">I", data, 24)[0]
+        offset = 28
+    else:
+        first_offset = struct.unpack_from(">Q", data, 28)[0]
+        offset = 36
+    count = struct.unpack_from(">H", data, offset + 2)[0]
+    position = index_start + size + first_offset
+    segments = []
+    for i in range(count):
+        reference, duration, _ = struct.unpack_from(">III", data, offset + 4 + 12 * i)
+        length = reference & 0x7FFFFFFF
+        segments.append((position, length, duration / timescale))
+        position += length
+    return segments
+
+
+class Player:
+    """One simulated player, with its own keep-alive connection."""
+
+    def __init__(
+        self,
+        base_url: str,
+        video_id: str,
+        rung: str,
+        realtime: bool,
+        stats,
+        bandwidth: float = None,
+        startup_buffer: float = None,
+        max_buffer: float = 30.0,
+    ):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.manifest_url = f"{self.prefix}/videos/{video_id}/video.mpd"
+        self.rung = rung
+        self.realtime = realtime
+        self.stats = stats
+        # Link of the player in bits per second, None if unlimited
+        self.bandwidth = bandwidth * 1000 if bandwidth else None
+        self.startup_buffer = startup_buffer
+        self.max_buffer = max_buffer
+        self.connection = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        self.connection = cls(self.host, timeout=30)
+
+    def get(self, path: str, kind: str, byte_range: tuple = None) -> bytes:
+        """Fetch a path and record its latency until the last byte."""
+        headers = {}
+        if byte_range:
+            headers["Range"] = f"bytes={byte_range[0]}-{byte_range[0] + byte_range[1] - 1}"
+        if self.connection is None:
+            self._connect()
+        started = time.perf_counter()
+        try:
+            self.connection.request("GET", path, headers=headers)
+            response = self.connection.getresponse()
+            body = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            self.stats.record(kind, time.perf_counter() - started, 0, error=True)
+            return None
+        if self.bandwidth:
+            # The body arrives no faster than the player's link allows
+            time.sleep(max(0.0, len(body) * 8 / self.bandwidth - (time.perf_counter() - started)))
+        ok = status in (200, 206)
+        self.stats.record(kind, time.perf_counter() - started, len(body), error=not ok)
+        return body if ok else None
+
+    def representations(self, manifest: bytes):
+        """
+        Parse a manifest.
+
+        Returns:
+            tuple: Root element, XML namespace prefix, and the video
+                representations as (element, base URL), highest bandwidth first
+        """
+        root = ET.fromstring(manifest)
+        ns = root.tag[: root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+        base = self.manifest_url
+        mpd_base = root.find(f"{ns}BaseURL")
+        if mpd_base is not None:
+            base = urljoin(base, mpd_base.text)
+        video = [
+            rep
+            for rep in root.iter(f"{ns}Representation")
+            if rep.get("width") and rep.get("height")
+        ]
+        video.sort(key=lambda rep: int(rep.get("bandwidth", 0)), reverse=True)
+        return root, ns, [(rep, base) for rep in video]
+
+    def segments(self, root, ns: str, rep, base: str) -> list:
+        """Fetch the init segment of a representation and return its media requests as (path, range, seconds)."""
+        rep_base = rep.find(f"{ns}BaseURL")
+        if rep_base is not None:
+            base = urljoin(base, rep_base.text)
+
+        segment_base = rep.find(f"{ns}SegmentBase")
+        if segment_base is not None:
+            index_start, index_end = (int(v) for v in segment_base.get("indexRange").split("-"))
+            head = self.get(base, "init", (0, index_end + 1))
+            if head is None:
+                return []
+            references = parse_sidx(head[index_start:], index_start)
+            return [(base, (offset, length), seconds) for offset, length, seconds in references]
+
+        template = rep.find(f"{ns}SegmentTemplate")
+        rep_id = rep.get("id")
+
+        def url(pattern, number=None):
+            name = pattern.replace("$RepresentationID$", rep_id)
+            if number is not None:
+                name = re.sub(
+                    r"\$Number(?:%0(\d+)d)?\$",
+                    lambda m: str(number).zfill(int(m.group(1) or 0)),
+                    name,
+                )
+            return urljoin(base, name)
+
+        timescale = int(template.get("timescale", "1"))
+        start = int(template.get("startNumber", "1"))
+        timeline = template.find(f"{ns}SegmentTimeline")
+        if timeline is not None:
+            durations = []
+            for s in timeline.findall(f"{ns}S"):
+                durations += [int(s.get("d")) / timescale] * (int(s.get("r", "0")) + 1)
+        else:
+            seconds = int(template.get("duration")) / timescale
+            total = parse_duration(root.get("mediaPresentationDuration"))
+            durations = [seconds] * max(1, math.ceil(total / seconds - 1e-6))
+        self.get(url(template.get("initialization")), "init")
+        return [
+            (url(template.get("media"), start + i), None, seconds)
+            for i, seconds in enumerate(durations)
+        ]
+
+    def choose(self, video: list, throughput: float):
+        """Representation of the next segment, as (element, base URL)."""
+        if self.rung != "adaptive":
+            return {"highest": video[0], "lowest": video[-1]}.get(self.rung) or random.choice(video)
+        if throughput is None:
+            # Start low like most players, until a segment measured the link
+            return video[-1]
+        budget = throughput * ADAPTIVE_SAFETY
+        return next((item for item in video if int(item[0].get("bandwidth", 0)) <= budget), video[-1])
+
+    def play(self, manifest: bytes, deadline: float) -> dict:
+        """
+        Fetch the segments of one session, from the first to the last or until the deadline.
+
+        Returns:
+            dict: With a bandwidth limit, the startup time, stalls and played
+                bitrate of the simulated playback, else None
+        """
+        root, ns, video = self.representations(manifest)
+        if not video:
+            return None
+        fixed = None if self.rung == "adaptive" else self.choose(video, None)
+        requests = {}
+        throughput = None
+        session = {"startup": None, "stalls": 0, "stalled": 0.0, "buffered": 0.0, "bits": 0.0, "switches": 0}
+        requested = time.monotonic()
+        playing_since = None
+        current = None
+        index = 0
+        while time.monotonic() < deadline:
+            rep, base = fixed or self.choose(video, throughput)
+            if rep.get("id") not in requests:
+                requests[rep.get("id")] = self.segments(root, ns, rep, base)
+            if index >= len(requests[rep.get("id")]):
+                break
+            if current is not None and current is not rep:
+                session["switches"] += 1
+            current = rep
+            path, byte_range, seconds = requests[rep.get("id")][index]
+            started = time.monotonic()
+            body = self.get(path, "segment", byte_range)
+            now = time.monotonic()
+            index += 1
+            if body:
+                measured = len(body) * 8 / max(now - started, 1e-6)
+                if throughput is None:
+                    throughput = measured
+                else:
+                    throughput = THROUGHPUT_WEIGHT * measured + (1 - THROUGHPUT_WEIGHT) * throughput
+            if self.realtime and not self.bandwidth:
+                time.sleep(max(0.0, seconds - (now - started)))
+            if not self.bandwidth:
+                continue
+
+            if playing_since is not None:
+                played = now - playing_since - session["stalled"]
+                if played > session["buffered"]:
+                    # The buffer ran dry before this segment arrived
+                    session["stalls"] += 1
+                    session["stalled"] += played - session["buffered"]
+            session["buffered"] += seconds
+            session["bits"] += int(rep.get("bandwidth", 0)) * seconds
+            startup_buffer = self.startup_buffer or seconds
+            if playing_since is None and session["buffered"] >= startup_buffer:
+                playing_since = now
+                session["startup"] = now - requested
+            if playing_since is not None:
+                ahead = session["buffered"] - (time.monotonic() - playing_since - session["stalled"])
+                if ahead > self.max_buffer:
+                    time.sleep(min(ahead - self.max_buffer, max(0.0, deadline - time.monotonic())))
+        return session if self.bandwidth else None
+
+    def run(self, deadline: float):
+        while time.monotonic() < deadline:
+            manifest = self.get(self.manifest_url, "manifest")
+            if manifest is None:
+                time.sleep(0.5)
+                continue
+            session = self.play(manifest, deadline)
+            if session is not None:
+                self.stats.record_session(session)
+        if self.connection is not None:
+            self.connection.close()
+
+
+class Stats:
+    """Latencies, bytes, errors and playback sessions, shared by the players."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.bytes = 0
+        self.errors = 0
+        self.sessions = []
+
+    def record(self, kind: str, seconds: float, size: int, error: bool = False):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            self.bytes += size
+            self.errors += error
+
+    def record_session(self, session: dict):
+        with self._lock:
+            self.sessions.append(session)
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def summarize(stats: Stats, elapsed: float) -> dict:
+    everything = [value for values in stats.latencies.values() for value in values]
+    summary = {
+        "seconds": round(elapsed, 2),
+        "requests": len(everything),
+        "errors": stats.errors,
+        "requests_per_second": round(len(everything) / elapsed, 1),
+        "megabytes_per_second": round(stats.bytes / elapsed / 1e6, 2),
+        "latency_ms": {},
+    }
+    for kind, values in sorted(stats.latencies.items()) + [("all", everything)]:
+        if values:
+            summary["latency_ms"][kind] = {
+                "count": len(values),
+                **{
+                    name: round(percentile(values, fraction) * 1000, 2)
+                    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+                },
+            }
+    if stats.sessions:
+        summary["playback"] = summarize_playback(stats.sessions)
+    return summary
+
+
+def summarize_playback(sessions: list) -> dict:
+    """Startup time, rebuffering and played bitrate of the simulated playback sessions."""
+    started = [session for session in sessions if session["startup"] is not None]
+    buffered = sum(session["buffered"] for session in started)
+    stalled = sum(session["stalled"] for session in started)
+    playback = {
+        "sessions": len(sessions),
+        "never_started": len(sessions) - len(started),
+        "rebuffers": sum(session["stalls"] for session in started),
+        "sessions_with_rebuffers": sum(1 for session in started if session["stalls"]),
+        "rebuffer_seconds": round(stalled, 2),
+        # Share of the watching time spent waiting, after playback started
+        "rebuffer_ratio": round(stalled / (buffered + stalled), 4) if buffered else None,
+        "switches": sum(session["switches"] for session in started),
+        "mean_video_kbps": round(sum(s["bits"] for s in started) / buffered / 1000) if buffered else None,
+        "startup_ms": {},
+    }
+    if started:
+        startups = [session["startup"] for session in started]
+        playback["startup_ms"] = {
+            name: round(percentile(startups, fraction) * 1000, 2)
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+        }
+    return playback
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base_url", help="Server URL, e.g. http://localhost:8001")
+    parser.add_argument("video_id", help="Id of a processed video")
+    parser.add_argument("--players", type=int, default=50, help="Concurrent players")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--rung", choices=RUNGS, default="random", help="Representation of every player")
+    parser.add_argument("--realtime", action="store_true", help="Pace segments at playback speed")
+    parser.add_argument(
+        "--bandwidth", type=float, help="Link of every player in kbps, simulates playback"
+    )
+    parser.add_argument(
+        "--startup-buffer",
+        type=float,
+        help="Seconds buffered before playback starts (default: one segment)",
+    )
+    parser.add_argument(
+        "--max-buffer", type=float, default=30.0, help="Seconds buffered ahead at most"
+    )
+    parser.add_argument("--json", help="Write the summary to this file")
+    args = parser.parse_args()
+
+    stats = Stats()
+    deadline = time.monotonic() + args.duration
+    players = [
+        Player(
+            args.base_url,
+            args.video_id,
+            args.rung,
+            args.realtime,
+            stats,
+            bandwidth=args.bandwidth,
+            startup_buffer=args.startup_buffer,
+            max_buffer=args.max_buffer,
+        )
+        for _ in range(args.players)
+    ]
+    threads = [threading.Thread(target=player.run, args=(deadline,), daemon=True) for player in players]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize(stats, time.monotonic() - started)
+    summary.update(
+        players=args.players, rung=args.rung, realtime=args.realtime, bandwidth_kbps=args.bandwidth
+    )
+
+    print(
+        f"{summary['requests']} requests in {summary['seconds']}s with {args.players} players: "
+        f"{summary['requests_per_second']} req/s, {summary['megabytes_per_second']} MB/s, "
+        f"{summary['errors']} errors"
+    )
+    print(f"{'kind':<10} {'count':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, row in summary["latency_ms"].items():
+        print(
+            f"{kind:<10} {row['count']:>8} {row['p50']:>9.2f} {row['p90']:>9.2f}"
+            f" {row['p99']:>9.2f} {row['max']:>9.2f}"
+        )
+    playback = summary.get("playback")
+    if playback:
+        startup = playback["startup_ms"]
+        print(
+            f"\n{playback['sessions']} playback sessions at {args.bandwidth:g} kbps"
+            f" ({playback['never_started']} never started): startup p50 {startup.get('p50', 0):.0f} ms,"
+            f" p90 {startup.get('p90', 0):.0f} ms"
+        )
+        print(
+            f"{playback['rebuffers']} rebuffers in {playback['sessions_with_rebuffers']} sessions,"
+            f" {playback['rebuffer_seconds']}s stalled (ratio {playback['rebuffer_ratio']}),"
+            f" {playback['switches']} rung switches, {playback['mean_video_kbps']} kbps played"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if summary["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
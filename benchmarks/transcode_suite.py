@@ -0,0 +1,365 @@
+"""
+Benchmark the processing pipeline on synthetic fixtures and compare to a baseline.
+
+Renders the deterministic fixtures of benchmarks/fixtures.py (landscape,
+portrait, rotated 90/270 with a Display Matrix, iPhone-style mebx, several
+durations and resolutions) and runs get_video_properties, extract_thumbnail
+and create_dash_stream on each of them. Every operation runs in a fresh
+process, and its wall time, CPU time (including ffmpeg children), peak RSS,
+encode fps and output bytes per rung are recorded as JSON. The outputs of
+the rotated fixtures are also checked: they must have the whole ladder down
+to the lowest rung, in display orientation and without a Display Matrix
+(players would rotate the upright frames again), or the script fails.
+
+With --baseline, the results are compared to a stored run and the script
+exits with status 1 when anything regressed beyond the tolerances.
+
+Usage:
+    python benchmarks/transcode_suite.py --output results.json
+    python benchmarks/transcode_suite.py --baseline benchmarks/baseline.json
+    python benchmarks/transcode_suite.py --baseline benchmarks/baseline.json --update-baseline
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fixtures import FIXTURES, ensure_fixture  # noqa: E402
+from video_processor import (  # noqa: E402
+    INIT_SEG_NAME,
+    LADDER_QUALITIES,
+    MPD_NAMESPACE,
+    _segment_files,
+    create_dash_stream,
+    extract_thumbnail,
+    get_video_properties,
+    probe_video,
+)
+
+OPERATIONS = ("probe", "thumbnail", "dash")
+# Metrics compared against the baseline, with the absolute change below which
+# a relative regression is considered noise
+TIMING_METRICS = {"wall_s": 0.05, "cpu_s": 0.05, "peak_rss_bytes": 8 * 1024 * 1024}
+
+
+def _run_operation(operation: str, source: str, output_dir: str, dash_options: dict):
+    if operation == "probe":
+        get_video_properties(Path(source))
+    elif operation == "thumbnail":
+        extract_thumbnail(
+            Path(source), Path(output_dir) / "thumbnail.jpg", probe=probe_video(Path(source))
+        )
+    else:
+        create_dash_stream(Path(source), Path(output_dir), **dash_options)
+
+
+def _measured_child(connection, operation, source, output_dir, dash_options):
+    """Run one operation and send back its resource usage (runs in a fresh process)."""
+    try:
+        before_self = resource.getrusage(resource.RUSAGE_SELF)
+        before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        _run_operation(operation, source, output_dir, dash_options)
+        wall = time.perf_counter() - start
+        after_self = resource.getrusage(resource.RUSAGE_SELF)
+        after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = sum(
+            getattr(after, field) - getattr(before, field)
+            for before, after in ((before_self, after_self), (before_children, after_children))
+            for field in ("ru_utime", "ru_stime")
+        )
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        unit = 1 if sys.platform == "darwin" else 1024
+        peak_rss = max(after_self.ru_maxrss, after_children.ru_maxrss) * unit
+        connection.send({"wall_s": wall, "cpu_s": cpu, "peak_rss_bytes": peak_rss})
+    except Exception as e:
+        connection.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        connection.close()
+
+
+def measure(operation: str, source: Path, output_dir: Path, dash_options: dict) -> dict:
+    """Run an operation in a fresh process so that its peak RSS and probe cache are its own."""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_measured_child,
+        args=(sender, operation, str(source), str(output_dir), dash_options),
+    )
+    process.start()
+    sender.close()
+    result = receiver.recv()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(f"{operation} failed on {source.name}: {result['error']}")
+    return result
+
+
+def rung_bytes(output_dir: Path) -> list:
+    """Bytes written per representation of a DASH output, read from its manifest."""
+    ns = {"mpd": MPD_NAMESPACE}
+    root = ET.parse(output_dir / "video.mpd").getroot()
+    rungs = []
+    for adaptation_set in root.iter(f"{{{MPD_NAMESPACE}}}AdaptationSet"):
+        content_type = adaptation_set.get("contentType") or adaptation_set.get("mimeType", "")
+        for rep in adaptation_set.findall("mpd:Representation", ns):
+            files = _segment_files(output_dir, rep.get("id"))
+            rungs.append(
+                {
+                    "id": rep.get("id"),
+                    "type": "audio" if "audio" in content_type else "video",
+                    "width": int(rep.get("width", 0)),
+                    "height": int(rep.get("height", 0)),
+                    "bandwidth": int(rep.get("bandwidth", 0)),
+                    "segments": len(files) - 1,
+                    "bytes": sum(f.stat().st_size for f in files if f.exists()),
+                }
+            )
+    return rungs
+
+
+def source_frames(source: Path) -> int:
+    """Number of video frames of a fixture, from its duration and frame rate."""
+    probe = probe_video(source)
+    if probe.video_stream.get("nb_frames"):
+        return int(probe.video_stream["nb_frames"])
+    num, _, den = probe.video_stream.get("avg_frame_rate", "0/1").partition("/")
+    if not int(den or 0) or not probe.duration:
+        return 0
+    return round(probe.duration * int(num) / int(den))
+
+
+def rotation_problems(spec: dict, output_dir: Path, rungs: list) -> list:
+    """
+    Problems of the DASH output of a fixture with a Display Matrix.
+
+    Its ladder must go down to the lowest rung like the one of a source
+    recorded upright, every video rung must have the display orientation,
+    and the init segments must not carry a rotation anymore.
+
+    Returns:
+        list: Human-readable descriptions of every problem
+    """
+    width, height = (int(v) for v in spec["size"].split("x"))
+    if spec["rotation"] % 180:
+        width, height = height, width
+    video = [rung for rung in rungs if rung["type"] == "video"]
+    problems = []
+    lowest = min((min(rung["width"], rung["height"]) for rung in video), default=None)
+    if lowest != LADDER_QUALITIES[-1]:
+        problems.append(f"lowest rung is {lowest}p instead of {LADDER_QUALITIES[-1]}p")
+    for rung in video:
+        if (rung["width"] > rung["height"]) != (width > height):
+            problems.append(
+                f"rung {rung['id']} is {rung['width']}x{rung['height']}, source displays {width}x{height}"
+            )
+        init = output_dir / INIT_SEG_NAME.replace("$RepresentationID$", rung["id"])
+        rotation = probe_video(init).rotation if init.exists() else 0
+        if rotation:
+            problems.append(f"rung {rung['id']} keeps a Display Matrix rotation of {rotation}")
+    return problems
+
+
+def best_of(runs: list) -> dict:
+    """Fastest of repeated runs, with the highest peak RSS seen."""
+    best = dict(min(runs, key=lambda r: r["wall_s"]))
+    best["peak_rss_bytes"] = max(r["peak_rss_bytes"] for r in runs)
+    return best
+
+
+def run_fixture(name: str, source: Path, work_dir: Path, repeat: int, dash_options: dict) -> dict:
+    result = {"spec": FIXTURES.get(name, {}), "frames": source_frames(source)}
+    for operation in OPERATIONS:
+        runs = []
+        for attempt in range(repeat):
+            output_dir = work_dir / name / f"{operation}_{attempt}"
+            shutil.rmtree(output_dir, ignore_errors=True)
+            output_dir.mkdir(parents=True)
+            runs.append(measure(operation, source, output_dir, dash_options))
+        result[operation] = best_of(runs)
+
+    dash = result["dash"]
+    dash["fps"] = result["frames"] / dash["wall_s"] if result["frames"] else None
+    dash["rungs"] = rung_bytes(work_dir / name / "dash_0")
+    dash["total_bytes"] = sum(rung["bytes"] for rung in dash["rungs"])
+    if result["spec"].get("rotation"):
+        dash["problems"] = rotation_problems(result["spec"], work_dir / name / "dash_0", dash["rungs"])
+    shutil.rmtree(work_dir / name, ignore_errors=True)
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float, bytes_tolerance: float) -> list:
+    """
+    Compare a run to a baseline.
+
+    Returns:
+        list: Human-readable descriptions of every regression
+    """
+    regressions = []
+    for name, base in baseline["fixtures"].items():
+        current = results["fixtures"].get(name)
+        if current is None:
+            continue
+        for operation in OPERATIONS:
+            for metric, noise in TIMING_METRICS.items():
+                old, new = base[operation][metric], current[operation][metric]
+                if new > old * (1 + tolerance) and new - old > noise:
+                    regressions.append(
+                        f"{name} {operation} {metric}: {old:.3f} -> {new:.3f} (+{(new / old - 1) * 100:.0f}%)"
+                    )
+
+        old_rungs = {(r["type"], r["width"], r["height"]): r for r in base["dash"]["rungs"]}
+        new_rungs = {(r["type"], r["width"], r["height"]): r for r in current["dash"]["rungs"]}
+        if old_rungs.keys() != new_rungs.keys():
+            regressions.append(
+                f"{name} ladder changed: {sorted(old_rungs)} -> {sorted(new_rungs)}"
+            )
+            continue
+        for key, old in old_rungs.items():
+            new = new_rungs[key]
+            if new["bytes"] > old["bytes"] * (1 + bytes_tolerance):
+                regressions.append(
+                    f"{name} {key[0]} {key[1]}x{key[2]} bytes: {old['bytes']} -> {new['bytes']}"
+                    f" (+{(new['bytes'] / old['bytes'] - 1) * 100:.1f}%)"
+                )
+    return regressions
+
+
+def ffmpeg_version() -> str:
+    output = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout
+    return output.splitlines()[0] if output else "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--fixtures", nargs="+", choices=sorted(FIXTURES), default=sorted(FIXTURES)
+    )
+    parser.add_argument(
+        "--fixtures-dir",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "dashstreamer_fixtures",
+        help="Directory where rendered fixtures are kept between runs",
+    )
+    parser.add_argument(
+        "--source",
+        type=Path,
+        nargs="*",
+        default=[],
+        help="Additional real recordings (e.g. an iPhone video with mebx tracks)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Runs per operation, the fastest is kept"
+    )
+    parser.add_argument("--parallel-workers", type=int, default=1)
+    parser.add_argument("--chunks", type=int, default=1)
+    parser.add_argument("--per-title", action="store_true")
+    parser.add_argument("--previews", action="store_true")
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    parser.add_argument(
+        "--baseline", type=Path, help="Compare to (or with --update-baseline, write) this file"
+    )
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.15,
+        help="Allowed relative increase of wall time, CPU time and peak RSS",
+    )
+    parser.add_argument(
+        "--bytes-tolerance",
+        type=float,
+        default=0.02,
+        help="Allowed relative increase of the bytes of a rung",
+    )
+    args = parser.parse_args()
+
+    dash_options = {
+        "parallel_workers": args.parallel_workers,
+        "chunks": args.chunks,
+        "per_title": args.per_title,
+        "previews": args.previews,
+    }
+    results = {
+        "meta": {
+            "created": datetime.utcnow().isoformat(),
+            "ffmpeg": ffmpeg_version(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "dash_options": dash_options,
+        },
+        "fixtures": {},
+    }
+
+    sources = []
+    for name in args.fixtures:
+        try:
+            sources.append((name, ensure_fixture(args.fixtures_dir, name)))
+        except subprocess.CalledProcessError as e:
+            reason = e.stderr.decode(errors="replace")[-200:].strip()
+            print(f"Skipping fixture {name}: ffmpeg could not render it ({reason})")
+    sources += [(path.stem, path) for path in args.source]
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_suite_"))
+    try:
+        print(f"{'fixture':<24} {'op':<10} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'fps':>8} {'MB out':>8}")
+        for name, source in sources:
+            result = run_fixture(name, source, work_dir, args.repeat, dash_options)
+            results["fixtures"][name] = result
+            for operation in OPERATIONS:
+                metrics = result[operation]
+                fps = f"{metrics['fps']:.1f}" if metrics.get("fps") else ""
+                size = f"{metrics['total_bytes'] / 1e6:.2f}" if "total_bytes" in metrics else ""
+                print(
+                    f"{name:<24} {operation:<10} {metrics['wall_s']:>8.2f} {metrics['cpu_s']:>8.2f}"
+                    f" {metrics['peak_rss_bytes'] / 2**20:>8.0f} {fps:>8} {size:>8}"
+                )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    problems = [
+        f"{name}: {problem}"
+        for name, result in results["fixtures"].items()
+        for problem in result["dash"].get("problems", ())
+    ]
+    for problem in problems:
+        print(f"PROBLEM {problem}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.baseline and args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["meta"].get("dash_options") != dash_options:
+            print("Warning: the baseline was recorded with different create_dash_stream options")
+        regressions = compare(results, baseline, args.tolerance, args.bytes_tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} REGRESSION(S) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import base64
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id TEXT PRIMARY KEY,
+    status TEXT,
+    created TEXT NOT NULL,
+    meta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_created ON videos (created, id);
+CREATE INDEX IF NOT EXISTS videos_status_created ON videos (status, created, id);
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO catalog_version (id, version) VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS video_hashes (
+    video_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS video_hashes_sha256 ON video_hashes (sha256);
+CREATE TABLE IF NOT EXISTS video_demand (
+    video_id TEXT PRIMARY KEY,
+    plays INTEGER NOT NULL DEFAULT 0,
+    last_access REAL
+);
+"""
+
+
+def encode_cursor(created: str, video_id: str) -> str:
+    """Encode a keyset pagination position as an opaque cursor."""
+    raw = json.dumps([created, video_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Decode a cursor created by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created, video_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return str(created), str(video_id)
+
+
+class Catalog:
+    """
+    SQLite index of the video metadata, kept in sync with meta.json writes.
+
+    Listing uses keyset pagination on (created, id), so the cost of a page does
+    not depend on the size of the library. Every write bumps a version number
+    that callers can use as a cheap validator for cached listings. The SHA-256
+    of the uploaded files is indexed to find duplicate uploads, and the plays
+    and last access of every video are kept to tier their renditions.
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        Args:
+            db_path: Path of the SQLite database file
+        """
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, meta: dict):
+        """Insert or replace the metadata of a video."""
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO videos (id, status, created, meta) VALUES (?, ?, ?, ?)",
+                (meta["id"], meta.get("status"), meta.get("created", ""), json.dumps(meta)),
+            )
+            if meta.get("sha256"):
+                conn.execute(
+                    "INSERT OR REPLACE INTO video_hashes (video_id, sha256) VALUES (?, ?)",
+                    (meta["id"], meta["sha256"]),
+                )
+            conn.execute("UPDATE catalog_version SET version = version + 1")
+
+    def delete(self, video_id: str):
+        """Remove a video from the index."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM videos WHERE id = ?", (video_id,))
+            conn.execute("DELETE FROM video_hashes WHERE video_id = ?", (video_id,))
+            conn.execute("DELETE FROM video_demand WHERE video_id = ?", (video_id,))
+            conn.execute("UPDATE catalog_version SET version = version + 1")
+
+    def get(self, video_id: str) -> dict:
+        """Metadata of a video, or None if it is not indexed."""
+        row = (
+            self._connection()
+            .execute("SELECT meta FROM videos WHERE id = ?", (video_id,))
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def find_by_hash(self, sha256: str, exclude: str = None) -> str:
+        """
+        Id of the oldest processed video whose upload has this SHA-256.
+
+        Args:
+            sha256: Hex digest of the uploaded file
+            exclude: Video id to ignore (the duplicate itself)
+
+        Returns:
+            str: Video id, or None if no processed video has this content
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT v.id FROM video_hashes h JOIN videos v ON v.id = h.video_id"
+                " WHERE h.sha256 = ? AND v.status = 'done' AND v.id != ?"
+                " ORDER BY v.created, v.id LIMIT 1",
+                (sha256, exclude or ""),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def record_demand(self, counts: dict) -> dict:
+        """
+        Add plays and access times of videos, without changing the catalog version.
+
+        Args:
+            counts: (plays, last access epoch seconds or None) by video id
+
+        Returns:
+            dict: Total plays of every given video
+        """
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO video_demand (video_id, plays, last_access) VALUES (?, ?, ?)"
+                " ON CONFLICT (video_id) DO UPDATE SET plays = plays + excluded.plays,"
+                " last_access = MAX(COALESCE(last_access, 0), COALESCE(excluded.last_access, 0))",
+                [(video_id, plays, last_access) for video_id, (plays, last_access) in counts.items()],
+            )
+            rows = conn.execute(
+                f"SELECT video_id, plays FROM video_demand WHERE video_id IN ({','.join('?' * len(counts))})",
+                list(counts),
+            ).fetchall()
+        return dict(rows)
+
+    def lazy_tiers(self) -> list:
+        """
+        Encoded on-demand tiers of all videos.
+
+        Returns:
+            list: Dicts with the video ``id``, the ``bytes`` of its tier and
+                its ``last_access`` (None if never requested)
+        """
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT v.id, json_extract(v.meta, '$.lazy_tier.bytes'), d.last_access"
+                " FROM videos v LEFT JOIN video_demand d ON d.video_id = v.id"
+                " WHERE json_extract(v.meta, '$.lazy_tier.state') = 'ready'"
+            )
+            .fetchall()
+        )
+        return [
+            {"id": video_id, "bytes": size or 0, "last_access": last_access or None}
+            for video_id, size, last_access in rows
+        ]
+
+    def version(self) -> int:
+        """Number that changes whenever the catalog is modified."""
+        row = self._connection().execute("SELECT version FROM catalog_version").fetchone()
+        return row[0]
+
+    def is_empty(self) -> bool:
+        return self._connection().execute("SELECT 1 FROM videos LIMIT 1").fetchone() is None
+
+    def list(
+        self,
+        status: str = None,
+        order: str = "desc",
+        limit: int = 100,
+        cursor: str = None,
+    ):
+        """
+        List one page of videos sorted by creation date.
+
+        Args:
+            status: Only return videos with this status (optional)
+            order: "desc" for newest first, "asc" for oldest first
+            limit: Maximum number of videos in the page
+            cursor: Cursor returned with the previous page (optional)
+
+        Returns:
+            tuple: (list of metadata dicts, cursor of the next page or None)
+        """
+        descending = order != "asc"
+        where = []
+        params = []
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if cursor:
+            created, video_id = decode_cursor(cursor)
+            where.append(f"(created, id) {'<' if descending else '>'} (?, ?)")
+            params += [created, video_id]
+
+        direction = "DESC" if descending else "ASC"
+        query = "SELECT id, created, meta FROM videos"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += f" ORDER BY created {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._connection().execute(query, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        return [json.loads(row[2]) for row in rows], next_cursor
+
+    def rebuild(self, uploads_dir: Path) -> int:
+        """
+        Re-index every meta.json found in the uploads directory.
+
+        Returns:
+            int: Number of indexed videos
+        """
+        metas = []
+        for video_dir in Path(uploads_dir).iterdir():
+            meta_file = video_dir / "meta.json"
+            if not meta_file.exists():
+                continue
+            try:
+                with open(meta_file) as f:
+                    meta = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            meta.setdefault("id", video_dir.name)
+            metas.append(meta)
+
+        with self._connection() as conn:
+            conn.execute("DELETE FROM videos")
+            conn.execute("DELETE FROM video_hashes")
+            conn.executemany(
+                "INSERT OR REPLACE INTO videos (id, status, created, meta) VALUES (?, ?, ?, ?)",
+                [
+                    (m["id"], m.get("status"), m.get("created", ""), json.dumps(m))
+                    for m in metas
+                ],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO video_hashes (video_id, sha256) VALUES (?, ?)",
+                [(m["id"], m["sha256"]) for m in metas if m.get("sha256")],
+            )
+            conn.execute("UPDATE catalog_version SET version = version + 1")
+        return len(metas)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from job_queue import write_json_atomic
+
+CHECKPOINT_FILE = "checkpoint.json"
+# Working directory of the ffmpeg processes of an encode, next to the checkpoint
+PARTS_DIR = "parts"
+# Minimum seconds between two checkpoint writes while a part is encoding
+CHECKPOINT_INTERVAL = 10
+
+
+def encode_fingerprint(settings: dict) -> str:
+    """Stable hash of the settings the outputs of an encode depend on."""
+    data = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def discard_checkpoint(output_dir: Path):
+    """Remove the checkpoint and the working directory of an abandoned encode."""
+    shutil.rmtree(Path(output_dir) / PARTS_DIR, ignore_errors=True)
+    (Path(output_dir) / CHECKPOINT_FILE).unlink(missing_ok=True)
+
+
+class EncodeCheckpoint:
+    """
+    Progress of the ffmpeg processes ("parts") of one encode.
+
+    Stored in ``<output_dir>/checkpoint.json`` next to the ``parts/`` working
+    directory. For every part it records the number of complete media
+    segments of each representation, and whether the part finished. ffmpeg
+    writes segments under temporary names and renames them once complete, so
+    the segment files are the ground truth: counts are scanned again when an
+    encode resumes, the checkpoint tells which parts are finished and which
+    encode the files belong to.
+
+    A checkpoint only applies to an encode with the same fingerprint, and not
+    once the parts started being merged into the final output (``assembling``),
+    since merging moves their segments away.
+    """
+
+    def __init__(self, output_dir: Path, fingerprint: str):
+        """
+        Args:
+            output_dir: Directory of the encode's manifest
+            fingerprint: encode_fingerprint of the encode settings
+        """
+        self.path = Path(output_dir) / CHECKPOINT_FILE
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            state = {}
+        self.restored = state.get("fingerprint") == fingerprint and not state.get("assembling")
+        if not self.restored:
+            state = {"fingerprint": fingerprint, "parts": {}}
+        self.state = state
+
+    def part(self, name: str) -> dict:
+        """Recorded state of a part (empty if it has not started)."""
+        with self._lock:
+            return dict(self.state["parts"].get(name, {}))
+
+    def update(self, name: str, scan, force: bool = False, **fields):
+        """
+        Record the complete segments of a running part.
+
+        Args:
+            name: Name of the part
+            scan: Callable returning the complete segment count of each
+                representation, only called when the checkpoint is written
+            force: Write even if the last write is less than
+                CHECKPOINT_INTERVAL seconds old
+            **fields: Other values stored in the part's state
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_write < CHECKPOINT_INTERVAL:
+                return
+            self._last_write = now
+            part = self.state["parts"].setdefault(name, {})
+            part.update(fields, segments=scan(), updated=time.time())
+            write_json_atomic(self.path, self.state)
+
+    def finish(self, name: str, segments: dict, **fields):
+        """Record a part whose ffmpeg process completed."""
+        self.update(name, lambda: segments, force=True, done=True, **fields)
+
+    def assemble(self):
+        """Mark the start of the merge of the parts, after which they can't be resumed."""
+        with self._lock:
+            self.state["assembling"] = True
+            write_json_atomic(self.path, self.state)
+
+    def resumed_parts(self) -> dict:
+        """Segment each resumed part continued from, by part name."""
+        with self._lock:
+            return {
+                name: part["resumed_from"]
+                for name, part in self.state["parts"].items()
+                if part.get("resumed_from")
+            }
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
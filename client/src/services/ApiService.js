@@ -38,6 +38,11 @@ export default {
         });
     },
 
+    // Subscribe to processing status and encode progress (Server-Sent Events)
+    getEventsUrl(videoId) {
+        return `${API_URL}/videos/${videoId}/events`;
+    },
+
     // Get video manifest URL
     getManifestUrl(videoId) {
         return `${API_URL}/videos/${videoId}/video.mpd`;
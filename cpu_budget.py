@@ -0,0 +1,199 @@
+import os
+import subprocess
+import threading
+from contextlib import contextmanager
+
+# Each priority step doubles the share of a job, up to this many steps either way
+MAX_PRIORITY_STEPS = 3
+
+
+def available_cpus() -> list:
+    """Ids of the CPUs this process may run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS and Windows
+        return list(range(os.cpu_count() or 1))
+
+
+def allocate_threads(cores: int, weights: list) -> list:
+    """
+    Split cores between jobs proportionally to their weights.
+
+    Every job gets at least one thread, so jobs outnumbering the cores get
+    one each. The remaining cores go to the largest remainders.
+
+    Args:
+        cores: Number of cores to share
+        weights: Positive weight of every job
+
+    Returns:
+        list: Thread budget of every job, in the order of weights
+    """
+    if len(weights) >= cores:
+        return [1] * len(weights)
+    spare = cores - len(weights)
+    total = sum(weights)
+    exact = [spare * weight / total for weight in weights]
+    shares = [int(value) for value in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - shares[i], reverse=True)
+    for i in by_remainder[: spare - sum(shares)]:
+        shares[i] += 1
+    return [1 + share for share in shares]
+
+
+def _pin(pid: int, cpus: set):
+    """Move every thread of a process to a set of CPUs."""
+    try:
+        tids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except (AttributeError, OSError):
+            pass  # Exited, or not supported on this platform
+
+
+class CpuLease:
+    """
+    CPU budget of one job, updated by its scheduler as other jobs start and finish.
+
+    Attributes:
+        threads: Threads the job's ffmpeg processes may use together
+        cpus: CPUs the job's processes are pinned to (None without affinity)
+    """
+
+    def __init__(self, scheduler, job_id: str, weight: float):
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.weight = weight
+        self.threads = 1
+        self.cpus = None
+        self._pids = set()
+
+    def share(self, fraction: float) -> int:
+        """Threads of a process doing a fraction of the job's work, at least one."""
+        return max(1, round(self.threads * fraction))
+
+    def attach(self, pid: int):
+        """Keep a process on the job's CPUs, now and after every rebalance."""
+        with self.scheduler._lock:
+            self._pids.add(pid)
+            cpus = self.cpus
+        if cpus:
+            _pin(pid, cpus)
+
+    def detach(self, pid: int):
+        with self.scheduler._lock:
+            self._pids.discard(pid)
+
+
+class CpuScheduler:
+    """
+    Share the cores of the host between the encodes running in this process.
+
+    Every job gets an explicit thread budget proportional to its weight (the
+    pixel count of its source, doubled for each priority step), so
+    concurrent ffmpeg processes add up to the cores instead of each sizing
+    its thread pools for the whole machine. Budgets are recomputed whenever
+    a job starts or finishes: ffmpeg processes started afterwards use the new
+    budget, and with affinity, every job gets a disjoint range of CPUs its
+    running processes are moved to.
+    """
+
+    def __init__(self, cores: int = None, affinity: bool = False):
+        """
+        Args:
+            cores: Number of cores to share (defaults to the CPUs available
+                to the process)
+            affinity: Pin the processes of every job to its own CPUs
+        """
+        self.cpus = available_cpus()
+        self.cores = cores or len(self.cpus)
+        self.cpus = self.cpus[: self.cores]
+        self.affinity = affinity
+        self._lock = threading.Lock()
+        self._leases = []
+
+    @contextmanager
+    def job(self, job_id: str, pixels: int, priority: int = 0):
+        """
+        Reserve a share of the cores while a job runs.
+
+        Args:
+            job_id: Name of the job, for reporting
+            pixels: Pixel count of the job's source
+            priority: Scheduling priority of the job, higher gets more threads
+
+        Yields:
+            CpuLease: Budget of the job, kept up to date until the job ends
+        """
+        steps = max(-MAX_PRIORITY_STEPS, min(MAX_PRIORITY_STEPS, priority))
+        lease = CpuLease(self, job_id, max(1, pixels) * 2.0**steps)
+        with self._lock:
+            self._leases.append(lease)
+            pins = self._rebalance()
+        for pid, cpus in pins:
+            _pin(pid, cpus)
+        try:
+            yield lease
+        finally:
+            with self._lock:
+                self._leases.remove(lease)
+                pins = self._rebalance()
+            for pid, cpus in pins:
+                _pin(pid, cpus)
+
+    def _rebalance(self) -> list:
+        """Recompute the budgets, returns the (pid, cpus) to pin. Holds the lock."""
+        budgets = allocate_threads(self.cores, [lease.weight for lease in self._leases])
+        pins = []
+        start = 0
+        for lease, threads in zip(self._leases, budgets):
+            lease.threads = threads
+            if self.affinity:
+                # Consecutive ranges, wrapping around when jobs outnumber the CPUs
+                lease.cpus = {self.cpus[(start + i) % len(self.cpus)] for i in range(threads)}
+                start += threads
+                pins += [(pid, lease.cpus) for pid in lease._pids]
+        return pins
+
+    def allocations(self) -> dict:
+        """Current threads (and CPUs) of every job."""
+        with self._lock:
+            return {
+                lease.job_id: {"threads": lease.threads, "cpus": sorted(lease.cpus or [])}
+                for lease in self._leases
+            }
+
+    def allocated(self) -> int:
+        """Threads allocated to the running jobs."""
+        with self._lock:
+            return sum(lease.threads for lease in self._leases)
+
+
+def run_ffmpeg(cmd: list, cpu: CpuLease = None, text: bool = True) -> subprocess.CompletedProcess:
+    """
+    Run an ffmpeg command and capture its output, attached to a job's CPU budget.
+
+    Raises:
+        subprocess.CalledProcessError: If the command fails
+    """
+    with subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text
+    ) as process:
+        if cpu:
+            cpu.attach(process.pid)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            if cpu:
+                cpu.detach(process.pid)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def thread_args(cpu: CpuLease, fraction: float = 1.0) -> list:
+    """ffmpeg ``-threads`` option for a share of a job's budget (none without a budget)."""
+    return ["-threads", str(cpu.share(fraction))] if cpu else []
@@ -0,0 +1,479 @@
+import json
+import os
+import posixpath
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from pathlib import Path
+
+from job_queue import write_json_atomic
+
+SINGLE_FILE_NAME = "stream_$RepresentationID$.mp4"
+# Byte ranges of the former segment files inside the single files, by file name
+SEGMENT_INDEX_FILE = "segments.json"
+# Seconds a segment index read from the storage backend (or its absence) is
+# used before asking the storage again
+STORED_INDEX_TTL = 60
+# Top-level boxes of media segments that are not part of a fragment
+_SEGMENT_HEADER_BOXES = (b"styp", b"sidx")
+
+
+def is_single_file_output(name: str) -> bool:
+    """Whether a file name is a single-file rendition or its segment index."""
+    prefix, suffix = SINGLE_FILE_NAME.split("$RepresentationID$")
+    return name == SEGMENT_INDEX_FILE or (name.startswith(prefix) and name.endswith(suffix))
+
+
+def _boxes(data: bytes, start: int = 0, end: int = None):
+    """Yield (type, offset, size, header size) of the ISO BMFF boxes in a range."""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ValueError(f"Invalid {box_type!r} box at offset {offset}")
+        yield box_type, offset, size, header
+        offset += size
+
+
+def _find(data: bytes, path: list, start: int = 0, end: int = None):
+    """Offset and end of the payload of the first box at a path of box types, or None."""
+    end = len(data) if end is None else end
+    for box_type, offset, size, header in _boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return offset + header, offset + size
+            return _find(data, path[1:], offset + header, offset + size)
+    return None
+
+
+def _track_info(init: bytes) -> dict:
+    """Track id, timescale and default sample duration of an init segment."""
+    tkhd = _find(init, [b"moov", b"trak", b"tkhd"])
+    mdhd = _find(init, [b"moov", b"trak", b"mdia", b"mdhd"])
+    trex = _find(init, [b"moov", b"mvex", b"trex"])
+    if tkhd is None or mdhd is None:
+        raise ValueError("Init segment without a track header")
+    # Full boxes: version, then 32 or 64-bit creation and modification times
+    tkhd_times = 16 if init[tkhd[0]] == 1 else 8
+    mdhd_times = 16 if init[mdhd[0]] == 1 else 8
+    return {
+        "track_id": struct.unpack_from(">I", init, tkhd[0] + 4 + tkhd_times)[0],
+        "timescale": struct.unpack_from(">I", init, mdhd[0] + 4 + mdhd_times)[0],
+        "default_duration": struct.unpack_from(">I", init, trex[0] + 12)[0] if trex else 0,
+    }
+
+
+def _fragment_timing(data: bytes, moof: tuple, default_duration: int):
+    """Decode time of the first sample and duration of the samples of a moof."""
+    traf = _find(data, [b"traf"], *moof)
+    if traf is None:
+        raise ValueError("Movie fragment without a track")
+    tfdt = _find(data, [b"tfdt"], *traf)
+    tfhd = _find(data, [b"tfhd"], *traf)
+    if tfdt is None or tfhd is None:
+        raise ValueError("Movie fragment without a decode time")
+    if data[tfdt[0]] == 1:
+        decode_time = struct.unpack_from(">Q", data, tfdt[0] + 4)[0]
+    else:
+        decode_time = struct.unpack_from(">I", data, tfdt[0] + 4)[0]
+
+    flags = struct.unpack_from(">I", data, tfhd[0])[0] & 0xFFFFFF
+    field = tfhd[0] + 8  # After the version, flags and track id
+    if flags & 0x01:
+        field += 8  # base-data-offset
+    if flags & 0x02:
+        field += 4  # sample-description-index
+    if flags & 0x08:
+        default_duration = struct.unpack_from(">I", data, field)[0]
+
+    duration = 0
+    for box_type, offset, size, header in _boxes(data, *traf):
+        if box_type != b"trun":
+            continue
+        flags = struct.unpack_from(">I", data, offset + header)[0] & 0xFFFFFF
+        count = struct.unpack_from(">I", data, offset + header + 4)[0]
+        field = offset + header + 8
+        field += 4 * bool(flags & 0x01) + 4 * bool(flags & 0x04)
+        if not flags & 0x100:
+            duration += count * default_duration
+            continue
+        stride = 4 * sum(bool(flags & bit) for bit in (0x100, 0x200, 0x400, 0x800))
+        for i in range(count):
+            duration += struct.unpack_from(">I", data, field + i * stride)[0]
+    return decode_time, duration
+
+
+def _decode_time_fields(data: bytes) -> list:
+    """
+    Offset, width and box type of the times of a media segment.
+
+    These are the ``tfdt`` decode times of every track fragment and the
+    earliest presentation time of the segment's ``sidx`` boxes, which all
+    advance together when the segment moves on the timeline.
+    """
+    fields = []
+    for box_type, offset, size, header in _boxes(data):
+        if box_type == b"sidx":
+            # After the version, flags, reference id and timescale
+            fields.append((offset + header + 12, data[offset + header] == 1, box_type))
+        elif box_type == b"moof":
+            for traf_type, traf, traf_size, traf_header in _boxes(data, offset + header, offset + size):
+                if traf_type != b"traf":
+                    continue
+                tfdt = _find(data, [b"tfdt"], traf + traf_header, traf + traf_size)
+                if tfdt is None:
+                    raise ValueError("Movie fragment without a decode time")
+                fields.append((tfdt[0] + 4, data[tfdt[0]] == 1, b"tfdt"))
+    return fields
+
+
+def retime_segments(init_path: Path, segment_paths: list, start: float):
+    """
+    Move media segments on the timeline so the first one starts at a time.
+
+    ffmpeg starts the decode times of every output at 0, so segments of a
+    time chunk or of a resumed encode must be moved to their place in the
+    source before joining the others. All segments shift by the same amount,
+    which makes the call idempotent. Segments are rewritten in place.
+
+    Args:
+        init_path: Init segment of the representation, for its timescale
+        segment_paths: Consecutive media segments, in playback order
+        start: Source time of the first segment in seconds
+
+    Raises:
+        ValueError: If a segment has no decode time, or a 32-bit one overflows
+    """
+    if not segment_paths:
+        return
+    timescale = _track_info(init_path.read_bytes())["timescale"]
+    delta = None
+    for path in segment_paths:
+        data = bytearray(path.read_bytes())
+        fields = _decode_time_fields(data)
+        if delta is None:
+            first = next((f for f in fields if f[2] == b"tfdt"), None)
+            if first is None:
+                raise ValueError(f"No movie fragment in {path.name}")
+            offset, wide, _ = first
+            delta = round(start * timescale) - struct.unpack_from(">Q" if wide else ">I", data, offset)[0]
+            if delta == 0:
+                return
+        for offset, wide, _ in fields:
+            value = struct.unpack_from(">Q" if wide else ">I", data, offset)[0] + delta
+            if value < 0 or (not wide and value >= 1 << 32):
+                raise ValueError(f"Decode time {value} out of range in {path.name}")
+            struct.pack_into(">Q" if wide else ">I", data, offset, value)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+
+def _scan_segment(path: Path, default_duration: int) -> dict:
+    """Byte ranges of the fragments of a media segment and its timing."""
+    data = path.read_bytes()
+    ranges = []
+    decode_time = None
+    duration = 0
+    for box_type, offset, size, header in _boxes(data):
+        if box_type in _SEGMENT_HEADER_BOXES:
+            continue
+        ranges.append((offset, size))
+        if box_type == b"moof":
+            fragment_time, fragment_duration = _fragment_timing(
+                data, (offset + header, offset + size), default_duration
+            )
+            if decode_time is None:
+                decode_time = fragment_time
+            duration += fragment_duration
+    if decode_time is None:
+        raise ValueError(f"No movie fragment in {path.name}")
+    return {
+        "path": path,
+        "ranges": ranges,
+        "size": sum(size for _, size in ranges),
+        "decode_time": decode_time,
+        "duration": duration,
+    }
+
+
+def segment_timeline(init_path: Path, segment_paths: list) -> list:
+    """
+    Decode time and duration of media segments, in seconds.
+
+    Args:
+        init_path: Init segment of the representation
+        segment_paths: Media segments, in playback order
+
+    Returns:
+        list: (decode time, duration) tuples, one per segment
+    """
+    track = _track_info(init_path.read_bytes())
+    timeline = []
+    for path in segment_paths:
+        segment = _scan_segment(path, track["default_duration"])
+        timeline.append(
+            (segment["decode_time"] / track["timescale"], segment["duration"] / track["timescale"])
+        )
+    return timeline
+
+
+def _sidx_box(track: dict, segments: list) -> bytes:
+    """Segment index box referencing every media segment, which start with a SAP."""
+    payload = struct.pack(
+        ">BBBBIIQQHH",
+        1,  # version 1, 64-bit times and offset
+        0,
+        0,
+        0,
+        track["track_id"],
+        track["timescale"],
+        segments[0]["decode_time"],
+        0,  # The first segment directly follows the index
+        0,
+        len(segments),
+    )
+    for i, segment in enumerate(segments):
+        if i + 1 < len(segments):
+            duration = segments[i + 1]["decode_time"] - segment["decode_time"]
+        else:
+            duration = segment["duration"]
+        # reference_type 0 (media) and size, duration, starts_with_SAP 1 and SAP type 1
+        payload += struct.pack(">III", segment["size"], duration, 0x90000000)
+    return struct.pack(">I4s", 8 + len(payload), b"sidx") + payload
+
+
+def pack_representation(init_path: Path, segment_paths: list, output_path: Path) -> dict:
+    """
+    Concatenate the init and media segments of a representation into one file.
+
+    The file is the init segment, a ``sidx`` indexing every media segment,
+    then the fragments of the segments in order (without their ``styp`` and
+    per-segment ``sidx`` boxes). Fragments address their data relative to
+    their ``moof``, so they are copied unchanged.
+
+    Args:
+        init_path: Init segment of the representation
+        segment_paths: Media segments, in playback order
+        output_path: Path of the single file
+
+    Returns:
+        dict: Byte ranges ``[offset, length]`` of the init segment (``init``),
+            the index (``index``) and every media segment (``segments``), and
+            the ``timescale``
+    """
+    init = init_path.read_bytes()
+    track = _track_info(init)
+    segments = [_scan_segment(path, track["default_duration"]) for path in segment_paths]
+    if not segments:
+        raise ValueError(f"No media segments for {init_path.name}")
+    sidx = _sidx_box(track, segments)
+
+    layout = {
+        "init": [0, len(init)],
+        "index": [len(init), len(sidx)],
+        "segments": [],
+        "timescale": track["timescale"],
+    }
+    offset = len(init) + len(sidx)
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+    with open(tmp_path, "wb") as out:
+        out.write(init)
+        out.write(sidx)
+        for segment in segments:
+            data = segment["path"].read_bytes()
+            for start, size in segment["ranges"]:
+                out.write(data[start : start + size])
+            layout["segments"].append([offset, segment["size"]])
+            offset += segment["size"]
+    tmp_path.replace(output_path)
+    return layout
+
+
+def package_single_file(manifest_path: Path, segment_files) -> dict:
+    """
+    Repackage the segments of a DASH output into one file per representation.
+
+    Every representation's ``SegmentTemplate`` is replaced by a ``BaseURL``
+    to its single file and a ``SegmentBase`` giving the byte ranges of the
+    init segment and the ``sidx``, which players fetch with range requests.
+    The former segment files are recorded in ``segments.json`` with their
+    range in the single files, so URLs of the template (from manifests
+    loaded before, or cached by players and CDNs) are still served.
+
+    The single files and the index are written before the manifest, and the
+    segment files are only removed once the new manifest is in place.
+
+    Args:
+        manifest_path: ``video.mpd`` of the output, next to its segments
+        segment_files: Callable returning the init and media segment paths
+            of a representation id, init first
+
+    Returns:
+        dict: Number of ``representations`` and of ``segments`` packaged
+    """
+    output_dir = manifest_path.parent
+    tree = ET.parse(manifest_path)
+    root = tree.getroot()
+    namespace = root.tag[1:].split("}")[0] if root.tag.startswith("{") else ""
+    ET.register_namespace("", namespace)
+    tag = (lambda name: f"{{{namespace}}}{name}") if namespace else (lambda name: name)
+
+    index = {}
+    packed = []
+    for rep in root.iter(tag("Representation")):
+        template = rep.find(tag("SegmentTemplate"))
+        if template is None:
+            continue
+        rep_id = rep.get("id")
+        files = segment_files(rep_id)
+        name = SINGLE_FILE_NAME.replace("$RepresentationID$", rep_id)
+        layout = pack_representation(files[0], files[1:], output_dir / name)
+        index[files[0].name] = [name, *layout["init"]]
+        for path, (offset, length) in zip(files[1:], layout["segments"]):
+            index[path.name] = [name, offset, length]
+
+        index_start, index_length = layout["index"]
+        segment_base = ET.Element(
+            tag("SegmentBase"),
+            {
+                "timescale": str(layout["timescale"]),
+                "indexRange": f"{index_start}-{index_start + index_length - 1}",
+                "indexRangeExact": "true",
+            },
+        )
+        if template.get("presentationTimeOffset"):
+            segment_base.set("presentationTimeOffset", template.get("presentationTimeOffset"))
+        ET.SubElement(
+            segment_base, tag("Initialization"), {"range": f"0-{layout['init'][1] - 1}"}
+        )
+        position = list(rep).index(template)
+        rep.remove(template)
+        rep.insert(position, segment_base)
+        base_url = ET.Element(tag("BaseURL"))
+        base_url.text = name
+        rep.insert(0, base_url)
+        packed.append(files)
+
+    if not packed:
+        return {"representations": 0, "segments": 0}
+    write_json_atomic(output_dir / SEGMENT_INDEX_FILE, {"files": index})
+    ET.indent(tree, space="\t")
+    tmp_file = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    tree.write(tmp_file, xml_declaration=True, encoding="utf-8")
+    tmp_file.replace(manifest_path)
+    for files in packed:
+        for path in files:
+            path.unlink(missing_ok=True)
+    return {
+        "representations": len(packed),
+        "segments": sum(len(files) - 1 for files in packed),
+    }
+
+
+class SegmentIndex:
+    """
+    Server-side lookup of segment URLs into single-file renditions.
+
+    The ``segments.json`` of a directory is loaded on first use and kept
+    until the file changes, for the most recently used directories. Hosts
+    without a local copy read it from the storage backend instead, and
+    revalidate it every STORED_INDEX_TTL seconds.
+    """
+
+    def __init__(self, max_dirs: int = 256, stored_ttl: float = STORED_INDEX_TTL):
+        self.max_dirs = max_dirs
+        self.stored_ttl = stored_ttl
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._stored = OrderedDict()
+
+    def locate(self, path: str):
+        """
+        Byte range of a former segment file in its single file.
+
+        Args:
+            path: Path of the requested segment file, which doesn't exist
+
+        Returns:
+            tuple: (single file path, offset, length), or None if the
+                directory has no segment index or it doesn't list the file
+        """
+        directory, name = os.path.split(path)
+        index_path = os.path.join(directory, SEGMENT_INDEX_FILE)
+        try:
+            mtime = os.stat(index_path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._indexes.get(directory)
+            if cached is not None and cached[0] == mtime:
+                self._indexes.move_to_end(directory)
+                files = cached[1]
+            else:
+                files = None
+        if files is None:
+            try:
+                with open(index_path) as f:
+                    files = json.load(f)["files"]
+            except (OSError, ValueError, KeyError):
+                return None
+            with self._lock:
+                self._indexes[directory] = (mtime, files)
+                while len(self._indexes) > self.max_dirs:
+                    self._indexes.popitem(last=False)
+        entry = files.get(name)
+        if entry is None:
+            return None
+        single_file, offset, length = entry
+        return os.path.join(directory, single_file), offset, length
+
+    def locate_stored(self, storage, key: str):
+        """
+        Byte range of a former segment file in a single file of the storage backend.
+
+        Args:
+            storage: Storage backend holding the outputs
+            key: Storage key of the requested segment file
+
+        Returns:
+            tuple: (single file key, offset, length), or None if the stored
+                directory has no segment index or it doesn't list the file
+        """
+        directory, name = posixpath.split(key)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._stored.get(directory)
+        if cached is None or now - cached[0] >= self.stored_ttl:
+            etag, files = cached[1:] if cached else (None, None)
+            stored = storage.get(posixpath.join(directory, SEGMENT_INDEX_FILE), if_none_match=etag)
+            if stored is None:
+                etag, files = None, None
+            elif stored.status != 304:
+                try:
+                    files = json.loads(b"".join(stored.chunks))["files"]
+                    etag = stored.etag
+                except (ValueError, KeyError):
+                    etag, files = None, None
+                finally:
+                    stored.close()
+            cached = (now, etag, files)
+            with self._lock:
+                self._stored[directory] = cached
+                self._stored.move_to_end(directory)
+                while len(self._stored) > self.max_dirs:
+                    self._stored.popitem(last=False)
+        entry = (cached[2] or {}).get(name)
+        if entry is None:
+            return None
+        single_file, offset, length = entry
+        return posixpath.join(directory, single_file), offset, length
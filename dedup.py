@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from metrics import TIMELINE_FILE
+from resumable_upload import CHUNK_SIZE, UPLOAD_STATE_FILE
+
+# Per-video files that are never shared with a duplicate
+PRIVATE_FILES = {"meta.json", "processing.log", UPLOAD_STATE_FILE, TIMELINE_FILE}
+# Working directories of an encode in progress
+TEMP_DIRS = {"temp", "parts"}
+
+
+def save_and_hash(stream, path: Path) -> str:
+    """
+    Write a stream to a file while computing its SHA-256.
+
+    Returns:
+        str: Hex digest of the written bytes
+    """
+    hasher = hashlib.sha256()
+    with open(path, "wb") as f:
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            if not data:
+                break
+            f.write(data)
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def link_or_copy(source: Path, target: Path):
+    """
+    Atomically replace target with a hardlink to source.
+
+    Falls back to a copy when hardlinks are not possible (e.g. another
+    filesystem).
+    """
+    tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+
+
+def link_video_outputs(source_dir: Path, target_dir: Path) -> int:
+    """
+    Share the processed outputs of a video with a duplicate upload.
+
+    The DASH manifest, segments, thumbnail and other outputs are hardlinked
+    into target_dir, and the uploaded original is replaced by a link to the
+    source original, so the duplicate takes no extra space.
+
+    Args:
+        source_dir: Directory of the already processed video
+        target_dir: Directory of the duplicate upload
+
+    Returns:
+        int: Number of linked files
+
+    Raises:
+        FileNotFoundError: If the source has no manifest
+    """
+    if not (source_dir / "video.mpd").exists():
+        raise FileNotFoundError(f"No manifest in {source_dir}")
+
+    linked = 0
+    # Link the manifest last so a partially linked video is never playable
+    for source in sorted(source_dir.iterdir(), key=lambda p: p.name == "video.mpd"):
+        name = source.name
+        if name.startswith(".") or name.endswith(".tmp"):
+            continue
+        if source.is_dir():
+            if name not in TEMP_DIRS and (source / "video.mpd").exists():
+                # Published rendition of a background re-encode
+                (target_dir / name).mkdir(exist_ok=True)
+                linked += link_video_outputs(source, target_dir / name)
+            continue
+        if name in PRIVATE_FILES or name.startswith("original."):
+            continue
+        link_or_copy(source, target_dir / name)
+        linked += 1
+
+    source_original = next(source_dir.glob("original.*"), None)
+    target_original = next(target_dir.glob("original.*"), None)
+    if (
+        source_original is not None
+        and target_original is not None
+        and source_original.stat().st_size == target_original.stat().st_size
+    ):
+        link_or_copy(source_original, target_original)
+    return linked
@@ -0,0 +1,216 @@
+"""
+Async delivery of manifests, segments and previews for production deployments.
+
+Serves ``GET /videos/<video_id>/<file>`` with the same rules as the Flask
+``serve_video_file`` route (no ``.tmp`` files, cache headers, validators,
+ranges, segment URLs of single-file renditions, play counting, redirects to
+the storage backend and files only found there), on an
+asyncio event loop: files are sent with ``sendfile`` by aiohttp's
+FileResponse without blocking the loop, and catalog lookups and the other
+blocking calls run in a thread pool. A few event loop processes hold
+thousands of concurrent players, while the Flask API handles uploads and
+the rest of the API in its own workers, and transcoding runs in
+``transcode_worker.py``.
+
+Usage:
+    python delivery.py --port 8001
+    gunicorn 'delivery:create_app()' --bind :8001 --workers 4 --worker-class aiohttp.GunicornWebWorker
+"""
+import argparse
+import asyncio
+import os
+import time
+from functools import partial
+
+# Delivery processes never run transcode jobs
+os.environ["START_TRANSCODE_WORKERS"] = "false"
+
+from aiohttp import web  # noqa: E402
+from werkzeug.security import safe_join  # noqa: E402
+
+import app  # noqa: E402
+from metrics import PROMETHEUS_CONTENT_TYPE  # noqa: E402
+from segment_delivery import cache_control, file_etag, guess_mimetype  # noqa: E402
+from storage import is_stored_output  # noqa: E402
+
+ENDPOINT = "serve_video_file"
+
+
+async def _blocking(func, *args, **kwargs):
+    """Run a blocking call in the default thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+
+def _is_complete(video_id: str) -> bool:
+    meta = app.catalog.get(video_id)
+    return meta is not None and meta.get("status") == "done"
+
+
+def _read_range(path: str, offset: int, length: int):
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        f.seek(offset)
+        return f.read(length), stat
+
+
+def _next_chunk(chunks):
+    return next(chunks, b"")
+
+
+async def serve_stored_file(request: web.Request, video_id: str, filename: str, headers: dict):
+    """Stream a file this host only has in the storage backend."""
+    key = f"{video_id}/{filename}"
+    path = app.storage.path(key)
+    if path is not None:
+        if not await _blocking(path.is_file):
+            raise web.HTTPNotFound()
+        response = web.FileResponse(path, headers=headers)
+        response.content_type = guess_mimetype(filename) or response.content_type
+        return response
+
+    stored = await _blocking(
+        app.storage.get, key, request.headers.get("Range"), request.headers.get("If-None-Match")
+    )
+    if stored is None:
+        raise web.HTTPNotFound()
+    headers["Accept-Ranges"] = "bytes"
+    if stored.content_range:
+        headers["Content-Range"] = stored.content_range
+    if stored.etag:
+        headers["ETag"] = stored.etag
+    response = web.StreamResponse(status=stored.status, headers=headers)
+    if stored.status not in (200, 206):
+        return response
+    response.content_type = guess_mimetype(filename) or "application/octet-stream"
+    response.content_length = stored.length
+    if stored.last_modified:
+        response.last_modified = stored.last_modified
+    chunks = iter(stored.chunks)
+    try:
+        await response.prepare(request)
+        while chunk := await _blocking(_next_chunk, chunks):
+            await response.write(chunk)
+        await response.write_eof()
+    finally:
+        await _blocking(stored.close)
+    return response
+
+
+async def serve_video_file(request: web.Request) -> web.StreamResponse:
+    video_id = request.match_info["video_id"]
+    filename = request.match_info["filename"]
+    file_path = safe_join(str(app.UPLOADS_DIR), video_id, filename)
+    if file_path is None or filename.endswith(".tmp"):
+        raise web.HTTPNotFound()  # Files still being written by ffmpeg or write_json_atomic
+    complete = await _blocking(_is_complete, video_id)
+    headers = {"Cache-Control": cache_control(filename, complete)}
+    key = f"{video_id}/{filename}"
+    if (
+        complete
+        and app.STORAGE_REDIRECT
+        and is_stored_output(filename)
+        and not await _blocking(app.is_packed_segment, file_path, key)
+    ):
+        # Players fetch the bytes straight from the store or its CDN
+        url = await _blocking(app.storage.redirect_url, key)
+        if url:
+            if app.LAZY_RUNGS_ABOVE:
+                await _blocking(app.track_demand, video_id, filename)
+            if not app.storage.public_url:
+                headers["Cache-Control"] = f"private, max-age={app.STORAGE_URL_EXPIRY // 2}"
+            raise web.HTTPFound(url, headers=headers)
+
+    if await _blocking(os.path.isfile, file_path):
+        if app.LAZY_RUNGS_ABOVE:
+            await _blocking(app.track_demand, video_id, filename)
+        # FileResponse answers conditional and range requests, and sends with sendfile
+        response = web.FileResponse(file_path, headers=headers)
+        mimetype = guess_mimetype(filename)
+        if mimetype:
+            response.content_type = mimetype
+        return response
+
+    location = await _blocking(app.segment_index.locate, file_path)
+    if location is None:
+        if app.storage.in_place or not is_stored_output(filename):
+            raise web.HTTPNotFound()
+        if app.LAZY_RUNGS_ABOVE:
+            await _blocking(app.track_demand, video_id, filename)
+        # Not encoded on this host
+        location = await _blocking(app.segment_index.locate_stored, app.storage, key)
+        if location is None:
+            return await serve_stored_file(request, video_id, filename, headers)
+        segment = await _blocking(app.read_stored_segment, *location)
+        if segment is None:
+            raise web.HTTPNotFound()
+        data, etag, last_modified = segment
+    else:
+        single_file, offset, length = location
+        try:
+            data, stat = await _blocking(_read_range, single_file, offset, length)
+        except FileNotFoundError:
+            raise web.HTTPNotFound()
+        if app.LAZY_RUNGS_ABOVE:
+            await _blocking(app.track_demand, video_id, filename)
+        etag, last_modified = f"{file_etag(stat)}-{offset:x}", stat.st_mtime
+    if any(tag.value == etag for tag in request.if_none_match or ()):
+        return web.Response(status=304, headers={**headers, "ETag": f'"{etag}"'})
+    response = web.Response(body=data, content_type=guess_mimetype(filename), headers=headers)
+    response.etag = etag
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+async def prometheus_metrics(request: web.Request) -> web.Response:
+    """Metrics of this process in the Prometheus text format."""
+    return web.Response(
+        body=app.metrics.render().encode(), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE}
+    )
+
+
+@web.middleware
+async def record_request_metrics(request: web.Request, handler):
+    """Record latency and bytes served until the last byte is sent, like the API's hooks."""
+    started = time.perf_counter()
+    endpoint = ENDPOINT if request.match_info.route.name == ENDPOINT else "unmatched"
+    response = None
+    try:
+        response = await handler(request)
+        if not response.prepared:
+            # Sends the headers and the body, so the timing includes the transfer
+            await response.prepare(request)
+    except web.HTTPException as e:
+        response = e
+        raise
+    finally:
+        app.request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        app.response_bytes.inc(getattr(response, "content_length", None) or 0, endpoint=endpoint)
+    return response
+
+
+async def _cors(request: web.Request, response: web.StreamResponse):
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Expose-Headers"] = "ETag, Content-Range, Content-Length"
+
+
+def create_app() -> web.Application:
+    application = web.Application(middlewares=[record_request_metrics])
+    application.on_response_prepare.append(_cors)
+    application.router.add_get("/metrics", prometheus_metrics)
+    application.router.add_get(
+        "/videos/{video_id}/{filename:.+}", serve_video_file, name=ENDPOINT
+    )
+    return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+from dataclasses import dataclass, field
+
+from ffmpeg_streaming import Bitrate, Formats, Representation
+from ffmpeg_streaming._format import Format
+
+
+class AV1(Format):
+    """AV1 video (SVT-AV1 by default) with AAC audio for DASH outputs."""
+
+    def __init__(self, video: str = "libsvtav1", audio: str = "aac", **codec_options):
+        super().__init__(video, audio, **codec_options)
+
+    def multiply(self) -> int:
+        return 2
+
+    def get_codec_options(self) -> dict:
+        options = {"keyint_min": 25, "g": 250}
+        options.update(self.codec_options)
+        return options
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """
+    Named trade-off between encoding speed and compression efficiency.
+
+    Attributes:
+        name: Profile name used by the API and the configuration
+        description: Short human-readable description
+        codec: "h264", "hevc" or "av1"
+        encoder: ffmpeg video encoder
+        preset: Encoder preset (None keeps the encoder default)
+        crf: Constant quality used for single-file encodes (debug MP4)
+        bitrate_scale: Multiplier applied to the ladder bitrates, below 1
+            for codecs that reach the same quality with fewer bits
+        options: Additional ffmpeg output options
+        seg_duration: DASH segment duration in seconds
+        gop_duration: Seconds between regular keyframes, a divisor of
+            seg_duration (None for one closed GOP per segment)
+        scene_cuts: Move keyframes to scene cuts up to scene_cut_tolerance
+            seconds after their regular position, and add keyframes at
+            the other cuts
+        scene_cut_tolerance: Maximum shift of a keyframe towards a scene cut
+    """
+
+    name: str
+    description: str
+    codec: str = "h264"
+    encoder: str = "libx264"
+    preset: str = None
+    crf: int = 23
+    bitrate_scale: float = 1.0
+    options: dict = field(default_factory=dict)
+    seg_duration: int = 4
+    gop_duration: float = None
+    scene_cuts: bool = False
+    scene_cut_tolerance: float = 1.0
+
+    def __post_init__(self):
+        gop = self.gop
+        if gop <= 0 or abs(self.seg_duration / gop - round(self.seg_duration / gop)) > 1e-6:
+            raise ValueError(f"{self.name}: GOP of {gop}s doesn't divide {self.seg_duration}s segments")
+        if self.scene_cuts and not 0 < self.scene_cut_tolerance < gop:
+            raise ValueError(f"{self.name}: scene cut tolerance must be below the GOP duration")
+
+    @property
+    def gop(self) -> float:
+        """Seconds between regular keyframes."""
+        return self.gop_duration or self.seg_duration
+
+    def format(self) -> Format:
+        """ffmpeg_streaming format of the DASH output."""
+        if self.codec == "hevc":
+            return Formats.hevc(self.encoder)
+        if self.codec == "av1":
+            return AV1(self.encoder)
+        return Formats.h264(self.encoder)
+
+    def output_options(self) -> dict:
+        """ffmpeg output options of the DASH output."""
+        options = {"preset": self.preset} if self.preset else {}
+        options.update(self.options)
+        return options
+
+    def keyframe_options(self) -> dict:
+        """
+        Encoder options making forced keyframes the only, closed GOP boundaries.
+
+        Scene-cut keyframes of the encoder are disabled because they would
+        differ between rungs; cuts are placed explicitly instead.
+        """
+        options = {"sc_threshold": 0, "flags": "+cgop"}
+        if self.codec in ("h264", "hevc"):
+            options["forced-idr"] = 1
+        if self.codec == "hevc":
+            options["x265-params"] = "scenecut=0"
+        return options
+
+    def encoder_args(self) -> list:
+        """ffmpeg arguments of a constant quality encode with this profile."""
+        args = ["-c:v", self.encoder]
+        if self.preset:
+            args += ["-preset", self.preset]
+        args += ["-crf", str(self.crf)]
+        for key, value in self.options.items():
+            args += [f"-{key}", str(value)]
+        return args
+
+    def scale_representations(self, representations: list) -> list:
+        """Representations with the video bitrates scaled for this codec."""
+        if self.bitrate_scale == 1.0:
+            return representations
+        return [
+            Representation(
+                rep.size,
+                Bitrate(int(rep.bitrate.video_ * self.bitrate_scale), rep.bitrate.audio_),
+                **rep.options,
+            )
+            for rep in representations
+        ]
+
+    def summary(self) -> dict:
+        return {"name": self.name, "codec": self.codec, "encoder": self.encoder, "preset": self.preset}
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in (
+        EncodingProfile("default", "x264 with the encoder defaults (medium preset)"),
+        EncodingProfile(
+            "fast-ingest",
+            "x264 veryfast, for the quickest availability",
+            preset="veryfast",
+        ),
+        EncodingProfile(
+            "archive",
+            "x264 slow, smaller and better looking at the same compatibility",
+            preset="slow",
+            crf=21,
+            bitrate_scale=0.85,
+            scene_cuts=True,
+        ),
+        EncodingProfile(
+            "archive-hevc",
+            "HEVC (x265), about 40% fewer bytes, limited browser support",
+            codec="hevc",
+            encoder="libx265",
+            preset="medium",
+            crf=26,
+            bitrate_scale=0.6,
+            options={"tag:v": "hvc1"},
+            scene_cuts=True,
+        ),
+        EncodingProfile(
+            "archive-av1",
+            "AV1 (SVT-AV1), the smallest bytes, slowest to encode",
+            codec="av1",
+            encoder="libsvtav1",
+            preset="6",
+            crf=32,
+            bitrate_scale=0.5,
+            scene_cuts=True,
+        ),
+    )
+}
+
+
+def get_profile(name: str) -> EncodingProfile:
+    """
+    Look up a profile by name.
+
+    Raises:
+        ValueError: If there is no profile with this name
+    """
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown encoding profile: {name} (available: {', '.join(PROFILES)})")
@@ -0,0 +1,125 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+
+from job_queue import write_json_atomic
+
+SUBSCRIBER_QUEUE_SIZE = 100
+PROGRESS_FILE_NAME = ".progress.json"
+# Seconds between two writes of the progress file of an encode
+PROGRESS_FILE_INTERVAL = 1.0
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of per-video events.
+
+    The last event of each type is kept per video so that new subscribers
+    immediately receive the current state. Slow subscribers drop events
+    instead of blocking publishers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._last = {}
+
+    def publish(self, video_id: str, event: str, data: dict):
+        """
+        Publish an event to every subscriber of a video.
+
+        Args:
+            video_id: Id of the video the event belongs to
+            event: Event type (e.g. "status", "progress")
+            data: JSON-serializable payload
+        """
+        with self._lock:
+            self._last.setdefault(video_id, {})[event] = data
+            subscribers = list(self._subscribers.get(video_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                pass
+
+    def subscribe(self, video_id: str) -> queue.Queue:
+        """
+        Subscribe to the events of a video.
+
+        Returns:
+            queue.Queue: Receives (event, data) tuples, starting with the last known ones
+        """
+        subscriber = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            for event, data in self._last.get(video_id, {}).items():
+                subscriber.put_nowait((event, data))
+            self._subscribers.setdefault(video_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, video_id: str, subscriber: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(video_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(video_id, None)
+
+    def forget(self, video_id: str):
+        """Drop the last known events of a video."""
+        with self._lock:
+            self._last.pop(video_id, None)
+
+
+class ProgressFile:
+    """
+    Last encode progress of a video, shared with other processes through a file in its folder.
+
+    EventBus only reaches the subscribers of its own process. When jobs run
+    in transcode_worker.py, the event streams served by the API workers
+    watch this file instead. Writes are throttled and atomic, and readers
+    only parse the file when its mtime changed.
+    """
+
+    def __init__(self, video_dir: Path, interval: float = PROGRESS_FILE_INTERVAL):
+        self.path = Path(video_dir) / PROGRESS_FILE_NAME
+        self.interval = interval
+        self._written = 0.0
+        self._mtime = None
+
+    def write(self, data: dict):
+        """Write the progress, unless it was written less than interval seconds ago."""
+        now = time.monotonic()
+        if now - self._written < self.interval:
+            return
+        self._written = now
+        write_json_atomic(self.path, data)
+
+    def read_if_changed(self) -> dict:
+        """
+        Progress written since the last call.
+
+        Returns:
+            dict: The progress, or None if the file did not change or does not exist
+        """
+        try:
+            mtime = self.path.stat().st_mtime_ns
+            if mtime == self._mtime:
+                return None
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._mtime = mtime
+        return data
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Format an event as a Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,31 @@
+"""
+Gunicorn settings of the API in production (uploads, listing, events, metrics).
+
+    gunicorn app:app -c gunicorn.conf.py
+
+Transcoding runs in transcode_worker.py and manifests and segments are
+served by delivery.py, so these workers only handle API requests. Every
+setting can be overridden with the environment variables below.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("API_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("API_WORKERS", str(multiprocessing.cpu_count() + 1)))
+# Threads keep slow uploads and open event streams from blocking a worker
+worker_class = "gthread"
+threads = int(os.getenv("API_THREADS", "16"))
+# Chunks of large uploads may take a while on slow links
+timeout = int(os.getenv("API_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
+# Files served by the API (thumbnails, segments in development setups) use sendfile
+sendfile = True
+# Fresh interpreters: the server modules hold SQLite connections and threads
+preload_app = False
+# Recycle workers now and then, like any long-running Python service
+max_requests = int(os.getenv("API_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+# Jobs are only enqueued here and run by transcode_worker.py
+raw_env = ["START_TRANSCODE_WORKERS=false"]
@@ -0,0 +1,368 @@
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+JOB_STATES = ("pending", "running", "failed")
+# Identifies this process among the owners of running jobs, since a PID is
+# reused after a restart (containers often get PID 1 again)
+INSTANCE_ID = uuid.uuid4().hex
+OWNER_KEYS = ("owner", "instance", "owner_started")
+
+
+def write_json_atomic(path: Path, data: dict):
+    """
+    Write JSON to a file so readers never observe a partially written file.
+
+    Args:
+        path: Destination file path
+        data: JSON-serializable data
+    """
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def job_id(video_id: str, task: str = None) -> str:
+    """
+    Id of the job running a task for a video.
+
+    Processing an upload uses the video id; follow-up tasks (re-encodes,
+    cleanups, on-demand rungs) get ``<video_id>.<task>``, so that each can be
+    queued independently of the others.
+    """
+    return f"{video_id}.{task}" if task else video_id
+
+
+class JobDeferred(Exception):
+    """Raised by a handler to put its job back in the queue without using an attempt."""
+
+    def __init__(self, delay: float):
+        super().__init__(f"Deferred for {delay} seconds")
+        self.delay = delay
+
+
+def _pid_alive(pid: int) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_start(pid: int) -> str:
+    """Start time of a process in clock ticks since boot, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name, which may contain spaces, start at the 3rd
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def _owner() -> dict:
+    """Owner fields of a job claimed by this process."""
+    return {"owner": os.getpid(), "instance": INSTANCE_ID, "owner_started": _process_start(os.getpid())}
+
+
+def _owner_alive(owner: dict) -> bool:
+    """
+    Whether the process that claimed a job is still running.
+
+    A process with the same PID is only the owner if it is this instance,
+    or, for other PIDs, if it started at the recorded time.
+    """
+    pid = owner.get("owner", 0)
+    if pid == os.getpid():
+        return owner.get("instance") == INSTANCE_ID
+    if not _pid_alive(pid):
+        return False
+    started = owner.get("owner_started")
+    current = _process_start(pid)
+    return started is None or current is None or started == current
+
+
+class JobQueue:
+    """
+    Durable transcode job queue backed by one JSON file per job.
+
+    Jobs live in ``<jobs_dir>/<state>/<job_id>.json`` (see job_id). Moving a
+    job between states is an atomic rename, so several processes (e.g. the
+    Werkzeug reloader parent and child) can share the same queue without
+    running a job twice. A fixed pool of worker threads bounds the number of
+    concurrent encodes, and the jobs of one video run one at a time.
+    """
+
+    def __init__(
+        self,
+        jobs_dir: Path,
+        handler,
+        on_failure=None,
+        workers: int = 2,
+        max_attempts: int = 3,
+        retry_backoff: float = 30.0,
+        poll_interval: float = 1.0,
+    ):
+        """
+        Args:
+            jobs_dir: Directory holding the on-disk queue
+            handler: Callable receiving the job dict; raising marks the attempt failed
+            on_failure: Optional callable (job, error, will_retry) invoked after a failed attempt
+            workers: Maximum number of jobs processed concurrently
+            max_attempts: Attempts before a job is moved to the failed state
+            retry_backoff: Base delay in seconds, doubled on every retry
+            poll_interval: Seconds between scans for jobs queued by other processes
+        """
+        self.jobs_dir = Path(jobs_dir)
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._active = {}
+        self._stopping = False
+        for state in JOB_STATES:
+            (self.jobs_dir / state).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state: str, job_id: str) -> Path:
+        return self.jobs_dir / state / f"{job_id}.json"
+
+    def has_job(self, video_id: str, task: str = None) -> bool:
+        """Check whether a job for a task of the video (by default processing it) exists in any state."""
+        return any(self._path(state, job_id(video_id, task)).exists() for state in JOB_STATES)
+
+    def _video_running(self, video_id: str) -> bool:
+        running = self.jobs_dir / "running"
+        return (running / f"{video_id}.json").exists() or any(
+            running.glob(f"{glob.escape(video_id)}.*.json")
+        )
+
+    def enqueue(
+        self, video_id: str, priority: int = 0, payload: dict = None, delay: float = 0
+    ) -> dict:
+        """
+        Add a job to the queue. Higher priority jobs are picked first.
+
+        A job already waiting with the same id is merged rather than replaced:
+        it keeps its attempts and its place in the queue, takes the higher of
+        both priorities and the later start time, and the new payload keys are
+        added to its payload. A failed job is replaced by a fresh one.
+
+        Args:
+            video_id: Id of the video to process
+            priority: Scheduling priority, higher runs sooner
+            payload: Optional extra data handed to the handler, its ``task`` is part of the job id
+            delay: Seconds before the job may run
+
+        Returns:
+            dict: The stored job record
+        """
+        payload = payload or {}
+        job = {
+            "id": job_id(video_id, payload.get("task")),
+            "video_id": video_id,
+            "priority": int(priority),
+            "attempts": 0,
+            "enqueued": time.time(),
+            "not_before": time.time() + delay if delay else 0,
+            "payload": payload,
+        }
+        pending_path = self._path("pending", job["id"])
+        try:
+            with open(pending_path) as f:
+                waiting = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            waiting = None
+        if waiting:
+            waiting["priority"] = max(waiting.get("priority", 0), job["priority"])
+            waiting["not_before"] = max(waiting.get("not_before", 0), job["not_before"])
+            waiting["payload"] = {**waiting.get("payload", {}), **job["payload"]}
+            job = waiting
+        self._path("failed", job["id"]).unlink(missing_ok=True)
+        write_json_atomic(pending_path, job)
+        with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def _claim_path(self, job_id: str) -> Path:
+        """Name of a job between its claim and the write of its owner, found by recover."""
+        return self.jobs_dir / "running" / f".{job_id}.{os.getpid()}.{INSTANCE_ID}.claim"
+
+    def recover(self):
+        """
+        Requeue jobs whose owning process died while running them.
+
+        Returns:
+            list: Ids of the requeued jobs
+        """
+        recovered = []
+        running = self.jobs_dir / "running"
+        for path in [*running.glob("*.json"), *running.glob(".*.claim")]:
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if path.suffix == ".claim":
+                # Claimed by a process that died before writing itself as the owner
+                _, pid, instance = path.name[1 : -len(".claim")].rsplit(".", 2)
+                owner = {"owner": int(pid), "instance": instance}
+            else:
+                owner = job
+            if _owner_alive(owner):
+                continue
+            for key in OWNER_KEYS:
+                job.pop(key, None)
+            try:
+                write_json_atomic(path, job)
+                os.rename(path, self._path("pending", job["id"]))
+            except OSError:
+                continue
+            recovered.append(job["id"])
+        return recovered
+
+    def depth(self, min_priority: int = None) -> int:
+        """
+        Number of jobs waiting to run.
+
+        Args:
+            min_priority: Only count jobs with at least this priority (optional)
+        """
+        paths = (self.jobs_dir / "pending").glob("*.json")
+        if min_priority is None:
+            return sum(1 for _ in paths)
+        count = 0
+        for path in paths:
+            try:
+                with open(path) as f:
+                    count += json.load(f).get("priority", 0) >= min_priority
+            except (OSError, json.JSONDecodeError):
+                continue
+        return count
+
+    def running(self) -> int:
+        """Number of jobs claimed by any process."""
+        return sum(1 for _ in (self.jobs_dir / "running").glob("*.json"))
+
+    def active(self) -> list:
+        """Ids of the jobs this process is currently running."""
+        return list(self._active)
+
+    def _claim(self):
+        now = time.time()
+        candidates = []
+        for path in (self.jobs_dir / "pending").glob("*.json"):
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if job.get("not_before", 0) > now:
+                continue
+            candidates.append(job)
+        candidates.sort(key=lambda j: (-j.get("priority", 0), j.get("enqueued", 0)))
+
+        for job in candidates:
+            # Jobs queued before tasks had their own ids are keyed by the video
+            job.setdefault("video_id", job["id"])
+            if self._video_running(job["video_id"]):
+                continue  # Follow-up job of a video whose previous job is still running
+            running_path = self._path("running", job["id"])
+            # The job only appears under running/ with its owner, so recover()
+            # in another process never mistakes a fresh claim for an orphan
+            claim_path = self._claim_path(job["id"])
+            try:
+                os.rename(self._path("pending", job["id"]), claim_path)
+            except OSError:
+                continue  # Claimed by another worker
+            job.update(_owner())
+            job["attempts"] = job.get("attempts", 0) + 1
+            job["started"] = now
+            write_json_atomic(claim_path, job)
+            os.rename(claim_path, running_path)
+            return job
+        return None
+
+    def _finish(self, job: dict, error: Exception = None):
+        running_path = self._path("running", job["id"])
+        if error is None:
+            running_path.unlink(missing_ok=True)
+            return
+
+        for key in OWNER_KEYS:
+            job.pop(key, None)
+        if isinstance(error, JobDeferred):
+            job["attempts"] -= 1
+            job["not_before"] = time.time() + error.delay
+            write_json_atomic(running_path, job)
+            os.replace(running_path, self._path("pending", job["id"]))
+            return
+
+        job["last_error"] = str(error)
+        will_retry = job["attempts"] < self.max_attempts
+        if will_retry:
+            job["not_before"] = time.time() + self.retry_backoff * 2 ** (
+                job["attempts"] - 1
+            )
+            target = self._path("pending", job["id"])
+        else:
+            target = self._path("failed", job["id"])
+        write_json_atomic(running_path, job)
+        os.replace(running_path, target)
+
+        if self.on_failure:
+            try:
+                self.on_failure(job, error, will_retry)
+            except Exception:
+                pass
+
+    def _worker(self):
+        while not self._stopping:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            self._active[job["id"]] = job
+            try:
+                self.handler(job)
+            except Exception as e:
+                self._finish(job, e)
+            else:
+                self._finish(job)
+            finally:
+                self._active.pop(job["id"], None)
+
+    def start(self):
+        """Recover orphaned jobs and start the worker threads."""
+        if self._threads:
+            return
+        self.recover()
+        self._stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"transcode-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """Stop picking new jobs and wait for the workers to exit."""
+        self._stopping = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
@@ -0,0 +1,219 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from job_queue import write_json_atomic
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+TIMELINE_FILE = "timeline.json"
+
+# Histogram buckets in seconds
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Encode speed as a multiple of realtime
+SPEED_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        """(suffix, labels, value) tuples of the metric."""
+        with self._lock:
+            return [("", dict(key), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback=None):
+        """
+        Args:
+            callback: Optional callable returning the current value, read at scrape time
+        """
+        super().__init__(name, help)
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        if self.callback is not None:
+            return [("", {}, self.callback())]
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(("_bucket", {**labels, "le": _format_value(bound)}, count))
+                samples.append(("_sum", labels, total))
+                samples.append(("_count", labels, counts[-1]))
+        return samples
+
+
+class Metrics:
+    """
+    Minimal in-process registry of counters, gauges and histograms.
+
+    Values live in the memory of the process that records them, so every
+    process (web server, transcode workers) exposes its own series.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, callback=None) -> Gauge:
+        return self._register(Gauge(name, help, callback))
+
+    def histogram(self, name: str, help: str, buckets: tuple) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Timeline:
+    """
+    Structured JSON timeline of the processing stages of one video.
+
+    Every span is appended to ``<video_dir>/timeline.json`` as soon as it
+    ends, with its start time, duration, outcome and attributes.
+    """
+
+    _locks = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, video_dir: Path, on_span=None):
+        """
+        Args:
+            video_dir: Directory of the video
+            on_span: Optional callable receiving every finished span dict
+        """
+        self.path = Path(video_dir) / TIMELINE_FILE
+        self.on_span = on_span
+        with Timeline._locks_guard:
+            self._lock = Timeline._locks.setdefault(str(self.path), threading.Lock())
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Time a block as a named stage.
+
+        The yielded dict can be filled with more attributes inside the block.
+        A ``media_seconds`` attribute adds the ``speed`` of the stage as a
+        multiple of realtime.
+        """
+        span = {"name": name, "start": datetime.utcnow().isoformat(), **attributes}
+        started = time.perf_counter()
+        try:
+            yield span
+            span["status"] = "ok"
+        except BaseException as e:
+            span["status"] = "error"
+            span["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["duration_s"] = round(time.perf_counter() - started, 4)
+            if span.get("media_seconds") and span["duration_s"]:
+                span["speed"] = round(span["media_seconds"] / span["duration_s"], 3)
+            self.record(span)
+
+    def record(self, span: dict):
+        with self._lock:
+            spans = self.read()
+            spans.append(span)
+            write_json_atomic(self.path, {"spans": spans})
+        if self.on_span is not None:
+            self.on_span(span)
+
+    def read(self) -> list:
+        """Spans recorded so far."""
+        try:
+            return read_timeline(self.path.parent)["spans"]
+        except FileNotFoundError:
+            return []
+
+
+def read_timeline(video_dir: Path) -> dict:
+    """Timeline of a video, with the total time of every stage."""
+    with open(Path(video_dir) / TIMELINE_FILE) as f:
+        timeline = json.load(f)
+    totals = {}
+    for span in timeline["spans"]:
+        totals[span["name"]] = round(totals.get(span["name"], 0) + span["duration_s"], 4)
+    timeline["totals"] = totals
+    return timeline
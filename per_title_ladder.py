@@ -0,0 +1,162 @@
+from pathlib import Path
+
+from ffmpeg_streaming import Bitrate, Representation
+
+from cpu_budget import CpuLease, run_ffmpeg, thread_args
+
+# CRF of the probe encodes, roughly the quality the ladder should reach
+PROBE_CRF = 23
+PROBE_PRESET = "veryfast"
+# Short side of the probe encodes
+PROBE_SHORT_SIDE = 360
+PROBE_SAMPLES = 3
+PROBE_SAMPLE_SECONDS = 4
+# Bitrate grows sub-linearly with the number of pixels
+PIXEL_EXPONENT = 0.75
+# ABR encodes need some headroom over the CRF bitrate for the same quality
+ABR_HEADROOM = 1.2
+MIN_VIDEO_BITRATE = 150 * 1024
+# Consecutive rungs closer than this ratio are redundant
+MIN_RUNG_STEP = 1.4
+
+
+def measure_complexity(
+    input_path: Path,
+    duration: float,
+    display_width: int,
+    display_height: int,
+    cpu: CpuLease = None,
+) -> dict:
+    """
+    Measure source complexity with fast low resolution CRF probe encodes.
+
+    A few short samples spread over the source are encoded at a fixed CRF and
+    the resulting bitrate tells how hard the content is to compress: a static
+    screencast needs a fraction of the bits of a sports clip for the same
+    quality.
+
+    Args:
+        input_path: Path to the source video
+        duration: Source duration in seconds
+        display_width: Display width of the source (after rotation)
+        display_height: Display height of the source (after rotation)
+        cpu: CPU budget of the job (optional)
+
+    Returns:
+        dict: bps (bitrate of the most complex sample), samples (bitrate of
+            every sample) and pixels (pixel count of the probe resolution)
+    """
+    is_portrait = display_height > display_width
+    sample = min(PROBE_SAMPLE_SECONDS, duration)
+    starts = [
+        (duration - sample) * (i + 1) / (PROBE_SAMPLES + 1) for i in range(PROBE_SAMPLES)
+    ]
+    scale = (
+        f"scale={PROBE_SHORT_SIDE}:-2" if is_portrait else f"scale=-2:{PROBE_SHORT_SIDE}"
+    )
+
+    bitrates = []
+    for start in starts:
+        cmd = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-ss",
+            f"{start:.3f}",
+            "-t",
+            f"{sample:.3f}",
+            *thread_args(cpu),
+            "-i",
+            str(input_path),
+            "-an",
+            "-sn",
+            "-dn",
+            "-vf",
+            scale,
+            "-c:v",
+            "libx264",
+            "-preset",
+            PROBE_PRESET,
+            "-crf",
+            str(PROBE_CRF),
+            *thread_args(cpu),
+            "-f",
+            "h264",
+            "-",
+        ]
+        result = run_ffmpeg(cmd, cpu, text=False)
+        bitrates.append(len(result.stdout) * 8 / sample)
+
+    ratio = max(display_width, display_height) / min(display_width, display_height)
+    long_side = round(PROBE_SHORT_SIDE * ratio / 2) * 2
+    return {
+        "bps": max(bitrates),
+        "samples": bitrates,
+        "pixels": PROBE_SHORT_SIDE * long_side,
+    }
+
+
+def per_title_representations(
+    representations: list, complexity: dict, duration: float = None
+):
+    """
+    Fit the bitrate ladder to the measured complexity.
+
+    Each rung gets the probe bitrate scaled to its pixel count, capped by the
+    static ladder bitrate. Rungs whose bitrate ends up too close to the rung
+    above are dropped, always keeping the top and the bottom rungs. An empty
+    ladder (a source smaller than the lowest rung) stays empty.
+
+    Args:
+        representations: Static ladder from generate_representations (highest first)
+        complexity: Result of measure_complexity
+        duration: Source duration in seconds, for the bytes saved estimate
+
+    Returns:
+        tuple: (list of Representation objects, report dict)
+    """
+    fitted = []
+    for rep in representations:
+        pixels = rep.size.width * rep.size.height
+        estimate = complexity["bps"] * (pixels / complexity["pixels"]) ** PIXEL_EXPONENT
+        video_bps = int(min(rep.bitrate.video_, max(MIN_VIDEO_BITRATE, estimate * ABR_HEADROOM)))
+        fitted.append((rep, video_bps))
+
+    kept = fitted[:1]  # Empty for sources below the lowest rung
+    for index, (rep, video_bps) in enumerate(fitted[1:], start=1):
+        is_bottom = index == len(fitted) - 1
+        if is_bottom:
+            if len(kept) > 1 and kept[-1][1] < video_bps * MIN_RUNG_STEP:
+                kept.pop()  # Make room for the lowest rung
+            kept.append((rep, video_bps))
+        elif video_bps * MIN_RUNG_STEP <= kept[-1][1]:
+            kept.append((rep, video_bps))
+
+    chosen = [
+        Representation(rep.size, Bitrate(video_bps, rep.bitrate.audio_))
+        for rep, video_bps in kept
+    ]
+
+    static_bps = sum(rep.bitrate.video_ for rep in representations)
+    chosen_bps = sum(rep.bitrate.video_ for rep in chosen)
+    report = {
+        "complexity_bps": round(complexity["bps"]),
+        "complexity_samples_bps": [round(b) for b in complexity.get("samples", [])],
+        "rungs": [
+            {
+                "width": rep.size.width,
+                "height": rep.size.height,
+                "static_bps": rep.bitrate.video_,
+                "chosen_bps": video_bps,
+                "kept": any(rep is k for k, _ in kept),
+            }
+            for rep, video_bps in fitted
+        ],
+        "static_total_bps": static_bps,
+        "chosen_total_bps": chosen_bps,
+    }
+    if duration:
+        report["estimated_static_bytes"] = int(static_bps * duration / 8)
+        report["estimated_chosen_bytes"] = int(chosen_bps * duration / 8)
+        report["estimated_bytes_saved"] = int((static_bps - chosen_bps) * duration / 8)
+    return chosen, report
@@ -0,0 +1,155 @@
+import math
+from pathlib import Path
+
+from cpu_budget import CpuLease, run_ffmpeg, thread_args
+
+THUMBNAIL_NAME = "thumbnail.jpg"
+SPRITE_NAME = "sprites_%03d.jpg"
+SPRITE_VTT_NAME = "thumbnails.vtt"
+# Width of one seek-preview thumbnail in the sprite sheets
+SPRITE_WIDTH = 160
+SPRITE_COLUMNS = 10
+SPRITE_MAX_ROWS = 10
+# Seconds between seek-preview thumbnails, raised for long videos and
+# lowered to the duration of shorter ones
+SPRITE_INTERVAL = 5
+SPRITE_MAX_THUMBS = 600
+POSTER_TIME = 1.0
+
+
+def plan_previews(display_width: int, display_height: int, duration: float) -> dict:
+    """
+    Plan the poster thumbnail and the seek-preview sprite sheets of a video.
+
+    Args:
+        display_width: Display width of the source (after rotation)
+        display_height: Display height of the source (after rotation)
+        duration: Source duration in seconds (None if unknown)
+
+    Returns:
+        dict: poster_time, and when the duration is known the sprite interval,
+            count, width, height, columns and rows
+    """
+    plan = {"poster_time": POSTER_TIME}
+    if duration and POSTER_TIME >= duration:
+        plan["poster_time"] = duration / 2
+    if not duration:
+        return plan
+
+    interval = max(SPRITE_INTERVAL, math.ceil(duration / SPRITE_MAX_THUMBS))
+    # fps only emits a frame once the source reaches half an interval
+    interval = min(interval, duration)
+    count = math.ceil(duration / interval)
+    height = max(2, round(SPRITE_WIDTH * display_height / display_width / 2) * 2)
+    plan.update(
+        interval=interval,
+        count=count,
+        width=SPRITE_WIDTH,
+        height=height,
+        columns=SPRITE_COLUMNS,
+        rows=min(SPRITE_MAX_ROWS, math.ceil(count / SPRITE_COLUMNS)),
+        duration=duration,
+    )
+    return plan
+
+
+def preview_output_args(output_dir: Path, plan: dict, video_filter: str = None) -> list:
+    """
+    ffmpeg output arguments writing the poster and the sprite sheets.
+
+    They are appended after another output (or a bare ``-i``) so the previews
+    are fed by the same decode as the rest of the command. Images are written
+    under temporary names and renamed, so they are never served half written.
+
+    Args:
+        output_dir: Directory of the video
+        plan: Plan from plan_previews
+        video_filter: Filter applied to the decoded frames first, e.g. the
+            transpose of a rotated source whose input is not autorotated
+    """
+    poster_filter = ["-vf", video_filter] if video_filter else []
+    args = [
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-dn",
+        "-ss",
+        f"{plan['poster_time']:.3f}",
+        *poster_filter,
+        "-frames:v",
+        "1",
+        "-update",
+        "1",
+        "-atomic_writing",
+        "1",
+        str(output_dir / THUMBNAIL_NAME),
+    ]
+    if "interval" in plan:
+        sprite_filter = (
+            f"fps=1/{plan['interval']},"
+            f"scale={plan['width']}:{plan['height']},"
+            f"tile={plan['columns']}x{plan['rows']}"
+        )
+        if video_filter:
+            sprite_filter = f"{video_filter},{sprite_filter}"
+        args += [
+            "-map",
+            "0:v:0",
+            "-an",
+            "-sn",
+            "-dn",
+            "-vf",
+            sprite_filter,
+            "-q:v",
+            "5",
+            "-atomic_writing",
+            "1",
+            str(output_dir / SPRITE_NAME),
+        ]
+    return args
+
+
+def _vtt_time(seconds: float) -> str:
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def write_sprite_vtt(output_dir: Path, plan: dict):
+    """
+    Write the WebVTT thumbnail track pointing into the sprite sheets.
+
+    Every cue covers one interval and references its tile with a
+    ``#xywh=x,y,w,h`` media fragment.
+    """
+    if "interval" not in plan:
+        return
+    per_sheet = plan["columns"] * plan["rows"]
+    lines = ["WEBVTT", ""]
+    for index in range(plan["count"]):
+        start = index * plan["interval"]
+        end = min(start + plan["interval"], plan["duration"])
+        sheet, position = divmod(index, per_sheet)
+        x = position % plan["columns"] * plan["width"]
+        y = position // plan["columns"] * plan["height"]
+        lines.append(f"{_vtt_time(start)} --> {_vtt_time(end)}")
+        lines.append(
+            f"{SPRITE_NAME % (sheet + 1)}#xywh={x},{y},{plan['width']},{plan['height']}"
+        )
+        lines.append("")
+    tmp_path = output_dir / f".{SPRITE_VTT_NAME}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines))
+    tmp_path.replace(output_dir / SPRITE_VTT_NAME)
+
+
+def extract_previews(input_path: Path, output_dir: Path, plan: dict, cpu: CpuLease = None):
+    """
+    Write the poster and the sprite sheets in a standalone pass.
+
+    Used when no single ffmpeg process decodes the whole source (chunked
+    encoding).
+    """
+    cmd = ["ffmpeg", "-y", *thread_args(cpu), "-i", str(input_path)]
+    run_ffmpeg(cmd + preview_output_args(output_dir, plan), cpu)
@@ -0,0 +1,216 @@
+import threading
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+# Subdirectory of a rendition holding its on-demand rungs, suffixed with the
+# generation of the tier (see tier_dir_name)
+LAZY_TIER_DIR = "lazy"
+# Prefix of the ids of on-demand representations in the served manifest
+LAZY_REP_PREFIX = "lazy-"
+
+
+def rung_quality(rep) -> int:
+    """Quality of a rung as named by the ladder (height, or width of portrait rungs)."""
+    return min(rep.size.width, rep.size.height)
+
+
+def tier_dir_name(generation: int) -> str:
+    """
+    Directory of one encode of an on-demand tier.
+
+    Segments are served as immutable, but a tier encoded again after an
+    eviction does not reproduce the same bytes, so every encode gets new
+    URLs (``lazy-1/``, ``lazy-2/``...) that caches cannot mix with the old
+    ones. Generation 0 is the unversioned directory of older tiers.
+    """
+    return f"{LAZY_TIER_DIR}-{generation}" if generation else LAZY_TIER_DIR
+
+
+def is_tier_dir(name: str) -> bool:
+    """Whether a directory name is the one of an on-demand tier, of any generation."""
+    return name == LAZY_TIER_DIR or (
+        name.startswith(f"{LAZY_TIER_DIR}-") and name[len(LAZY_TIER_DIR) + 1 :].isdigit()
+    )
+
+
+def tier_bytes(tier_dir: Path) -> int:
+    """Disk space used by the files of a tier."""
+    return sum(path.stat().st_size for path in Path(tier_dir).rglob("*") if path.is_file())
+
+
+def _write_manifest(tree: ET.ElementTree, manifest_path: Path):
+    ET.indent(tree, space="\t")
+    tmp_file = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    tree.write(tmp_file, xml_declaration=True, encoding="utf-8")
+    tmp_file.replace(manifest_path)
+
+
+def _parse(manifest_path: Path):
+    """Manifest tree and a function qualifying tag names with its namespace."""
+    tree = ET.parse(manifest_path)
+    root = tree.getroot()
+    namespace = root.tag[1:].split("}")[0] if root.tag.startswith("{") else ""
+    ET.register_namespace("", namespace)
+    return tree, (lambda name: f"{{{namespace}}}{name}") if namespace else (lambda name: name)
+
+
+def _video_set(root, tag):
+    for adaptation_set in root.iter(tag("AdaptationSet")):
+        if adaptation_set.get("contentType") == "video" or adaptation_set.find(
+            f"{tag('Representation')}[@width]"
+        ) is not None:
+            return adaptation_set
+    return None
+
+
+def attach_tier(manifest_path: Path, tier_dir: Path) -> int:
+    """
+    Add the video representations of an encoded tier to a served manifest.
+
+    The tier's representations get ids with LAZY_REP_PREFIX and a BaseURL
+    into the tier directory (relative to the manifest's BaseURL, if any),
+    and template ids are resolved to the tier's own ids so its segment files
+    keep their names. The tier must have been encoded with the same profile
+    and keyframe plan as the served rungs, so segments stay aligned for
+    switching.
+
+    Args:
+        manifest_path: Served ``video.mpd``, rewritten atomically
+        tier_dir: Directory of the tier's ``video.mpd`` and segments,
+            directly under the directory the manifest's segments are in
+
+    Returns:
+        int: Number of representations added
+    """
+    detach_tier(manifest_path)
+    tree, tag = _parse(manifest_path)
+    target = _video_set(tree.getroot(), tag)
+    tier_tree, tier_tag = _parse(tier_dir / "video.mpd")
+    source = _video_set(tier_tree.getroot(), tier_tag)
+    if target is None or source is None:
+        raise ValueError(f"No video adaptation set to attach {tier_dir.name} to")
+
+    added = []
+    for rep in source.findall(tier_tag("Representation")):
+        rep_id = rep.get("id")
+        for template in rep.iter(tier_tag("SegmentTemplate")):
+            for attr in ("initialization", "media"):
+                if template.get(attr):
+                    template.set(attr, template.get(attr).replace("$RepresentationID$", rep_id))
+        base_url = rep.find(tier_tag("BaseURL"))
+        if base_url is None:
+            base_url = ET.Element(tier_tag("BaseURL"))
+            base_url.text = ""
+            rep.insert(0, base_url)
+        base_url.text = f"{tier_dir.name}/{base_url.text}"
+        rep.set("id", f"{LAZY_REP_PREFIX}{rep_id}")
+        added.append(rep)
+
+    # Highest bandwidth first, like the rest of the ladder
+    first = list(target).index(target.find(tag("Representation")))
+    for position, rep in enumerate(added):
+        target.insert(first + position, rep)
+    for attr in ("maxWidth", "maxHeight"):
+        values = [int(rep.get(attr[3:].lower(), 0)) for rep in added]
+        if target.get(attr) and values:
+            target.set(attr, str(max([int(target.get(attr))] + values)))
+    _write_manifest(tree, manifest_path)
+    return len(added)
+
+
+def detach_tier(manifest_path: Path) -> int:
+    """
+    Remove the on-demand representations from a served manifest.
+
+    Returns:
+        int: Number of representations removed
+    """
+    tree, tag = _parse(manifest_path)
+    removed = 0
+    for adaptation_set in tree.getroot().iter(tag("AdaptationSet")):
+        reps = adaptation_set.findall(tag("Representation"))
+        kept = [rep for rep in reps if not rep.get("id", "").startswith(LAZY_REP_PREFIX)]
+        if len(kept) == len(reps):
+            continue
+        for rep in reps:
+            if rep not in kept:
+                adaptation_set.remove(rep)
+                removed += 1
+        if kept:
+            for attr in ("maxWidth", "maxHeight"):
+                if adaptation_set.get(attr):
+                    largest = max(int(rep.get(attr[3:].lower(), 0)) for rep in kept)
+                    adaptation_set.set(attr, str(largest))
+    if removed:
+        _write_manifest(tree, manifest_path)
+    return removed
+
+
+def plan_evictions(tiers: list, budget: int, min_idle: float, now: float = None) -> list:
+    """
+    Choose the tiers to evict to fit a disk budget, least recently used first.
+
+    Args:
+        tiers: Dicts with the ``id``, ``bytes`` and ``last_access`` (epoch
+            seconds or None) of every encoded tier
+        budget: Bytes the tiers may use together
+        min_idle: Tiers accessed within this many seconds are kept, since
+            players may still be fetching their segments
+        now: Current time (defaults to time.time())
+
+    Returns:
+        list: Ids of the tiers to evict
+    """
+    now = time.time() if now is None else now
+    total = sum(tier["bytes"] for tier in tiers)
+    evicted = []
+    for tier in sorted(tiers, key=lambda tier: tier["last_access"] or 0):
+        if total <= budget:
+            break
+        if tier["last_access"] and now - tier["last_access"] < min_idle:
+            break  # Every other tier was used even more recently
+        evicted.append(tier["id"])
+        total -= tier["bytes"]
+    return evicted
+
+
+class DemandCounter:
+    """
+    Per-video request counts accumulated in memory between catalog writes.
+
+    Manifest loads count as plays, requests of on-demand segments update the
+    last access time of the tier. Counts are drained every flush_interval
+    seconds by the request that finds them due.
+    """
+
+    def __init__(self, flush_interval: float = 10.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._last_flush = time.monotonic()
+
+    def hit(self, video_id: str, play: bool = False, tier: bool = False):
+        with self._lock:
+            plays, last_access = self._counts.get(video_id, (0, None))
+            self._counts[video_id] = (plays + play, time.time() if tier else last_access)
+
+    def drain(self, force: bool = False) -> dict:
+        """
+        Counts since the last drain, if the flush interval elapsed.
+
+        Returns:
+            dict: (plays, tier last access) by video id, empty if not due
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._counts or (not force and now - self._last_flush < self.flush_interval):
+                return {}
+            self._last_flush = now
+            counts, self._counts = self._counts, {}
+        return counts
+
+
+def is_tier_path(filename: str) -> bool:
+    """Whether a path served from a video folder is in an on-demand tier."""
+    return any(is_tier_dir(part) for part in filename.split("/")[:-1])
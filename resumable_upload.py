@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from job_queue import write_json_atomic
+
+UPLOAD_STATE_FILE = "upload.json"
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadConflict(ValueError):
+    """The client offset does not match the number of bytes already received."""
+
+
+class ChecksumMismatch(ValueError):
+    """The checksum sent with a chunk does not match the received bytes."""
+
+
+class ResumableUploads:
+    """
+    Resumable uploads appended directly to ``<video_dir>/original.<ext>``.
+
+    The number of bytes on disk is the upload offset, so an interrupted upload
+    resumes from whatever reached the file. A SHA-256 of the whole file is
+    computed incrementally while chunks arrive; if the process restarted in
+    between, the hash is rebuilt once from the bytes already on disk.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+        self._hashers = {}
+
+    def lock(self, video_dir: Path) -> threading.Lock:
+        """Lock serializing the chunks of one upload."""
+        with self._guard:
+            return self._locks.setdefault(str(video_dir), threading.Lock())
+
+    def create(self, video_dir: Path, filename: str, length: int, **extra) -> dict:
+        """
+        Start a new upload in an existing video directory.
+
+        Args:
+            video_dir: Directory of the video
+            filename: Original client file name (used for the extension)
+            length: Total upload size in bytes
+            **extra: Additional values stored with the upload state
+
+        Returns:
+            dict: The upload state
+        """
+        if length <= 0:
+            raise ValueError("Upload length must be positive")
+        state = {
+            "filename": f"original{Path(filename).suffix}",
+            "length": length,
+            "complete": False,
+            **extra,
+        }
+        (video_dir / state["filename"]).touch()
+        write_json_atomic(video_dir / UPLOAD_STATE_FILE, state)
+        self._hashers[str(video_dir)] = (0, hashlib.sha256())
+        return state
+
+    def state(self, video_dir: Path) -> dict:
+        """
+        Upload state including the current offset, or None if there is no upload.
+        """
+        state_file = video_dir / UPLOAD_STATE_FILE
+        if not state_file.exists():
+            return None
+        with open(state_file) as f:
+            state = json.load(f)
+        state["offset"] = (video_dir / state["filename"]).stat().st_size
+        return state
+
+    def _hasher(self, video_dir: Path, offset: int):
+        cached = self._hashers.get(str(video_dir))
+        if cached and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        with open(video_dir / self.state(video_dir)["filename"], "rb") as f:
+            remaining = offset
+            while remaining > 0:
+                data = f.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                hasher.update(data)
+                remaining -= len(data)
+        return hasher
+
+    def append(self, video_dir: Path, offset: int, stream, checksum: str = None) -> dict:
+        """
+        Append a chunk read from a stream at the given offset.
+
+        Call while holding lock(video_dir).
+
+        Args:
+            video_dir: Directory of the video
+            offset: Offset the client believes the upload is at
+            stream: File-like object with the chunk bytes
+            checksum: Optional ``"sha256 <base64 digest>"`` of the chunk
+
+        Returns:
+            dict: The updated upload state, with ``sha256`` once complete
+
+        Raises:
+            UploadConflict: If offset does not match the received bytes
+            ChecksumMismatch: If the chunk does not match checksum (the chunk is discarded)
+            ValueError: If the upload is complete or the chunk exceeds its length
+        """
+        state = self.state(video_dir)
+        if state is None:
+            raise ValueError("Upload not found")
+        if state["complete"]:
+            raise ValueError("Upload already complete")
+        if offset != state["offset"]:
+            raise UploadConflict(f"Expected offset {state['offset']}")
+
+        expected_digest = None
+        if checksum:
+            algorithm, _, encoded = checksum.partition(" ")
+            if algorithm.lower() != "sha256":
+                raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+            expected_digest = base64.b64decode(encoded)
+
+        hasher = self._hasher(video_dir, offset).copy()
+        chunk_hasher = hashlib.sha256()
+        path = video_dir / state["filename"]
+        written = 0
+        with open(path, "r+b") as f:
+            f.seek(offset)
+            try:
+                while True:
+                    data = stream.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    written += len(data)
+                    if offset + written > state["length"]:
+                        raise ValueError("Chunk exceeds the upload length")
+                    f.write(data)
+                    hasher.update(data)
+                    chunk_hasher.update(data)
+                if expected_digest is not None and chunk_hasher.digest() != expected_digest:
+                    raise ChecksumMismatch("Chunk checksum mismatch")
+            except ValueError:
+                # Drop the rejected chunk so the client can retry from the same offset
+                f.truncate(offset)
+                raise
+            except Exception:
+                # Connection dropped: keep the received bytes unless they can't be verified
+                if expected_digest is not None:
+                    f.truncate(offset)
+                else:
+                    f.flush()
+                    self._hashers[str(video_dir)] = (offset + written, hasher)
+                raise
+            f.flush()
+            os.fsync(f.fileno())
+
+        state["offset"] = offset + written
+        self._hashers[str(video_dir)] = (state["offset"], hasher)
+        if state["offset"] == state["length"]:
+            state["complete"] = True
+            state["sha256"] = hasher.hexdigest()
+            self._hashers.pop(str(video_dir), None)
+            stored = {k: v for k, v in state.items() if k != "offset"}
+            write_json_atomic(video_dir / UPLOAD_STATE_FILE, stored)
+        return state
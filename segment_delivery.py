@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+
+SEGMENT_MAX_AGE = 31536000
+MANIFEST_MAX_AGE = 2
+
+MIMETYPES = {
+    ".mpd": "application/dash+xml",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".vtt": "text/vtt",
+}
+
+
+def guess_mimetype(filename: str) -> str:
+    """Mimetype of a file served from a video folder, or None to let Flask guess."""
+    return MIMETYPES.get(os.path.splitext(filename)[1].lower())
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """Strong ETag of a file that only changes when the file is rewritten."""
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def cache_control(filename: str, complete: bool) -> str:
+    """
+    Cache-Control header for a file of a video.
+
+    Segments, init files and single-file renditions never change once the
+    video is processed, so they are cached for a year. Manifests get a short TTL. Nothing is cached while
+    the video is still being processed.
+
+    Args:
+        filename: Name of the served file
+        complete: Whether the video finished processing
+    """
+    if not complete:
+        return "no-cache"
+    if filename.endswith((".m4s", ".mp4")):
+        return f"public, max-age={SEGMENT_MAX_AGE}, immutable"
+    if filename.endswith(".mpd"):
+        return f"public, max-age={MANIFEST_MAX_AGE}"
+    return "public, max-age=3600"
+
+
+class SegmentCache:
+    """
+    In-memory LRU cache of small, frequently requested files.
+
+    Entries are keyed by path and validated against the file size and mtime,
+    so a rewritten file is never served from the cache. Init segments are
+    admitted on first use, media segments once they are requested a second
+    time so that a single sequential viewer doesn't flush the hot set.
+    Entries are evicted least recently used first once the cached bytes exceed
+    max_bytes.
+    """
+
+    def __init__(self, max_bytes: int, max_item_bytes: int, seen_size: int = 4096):
+        """
+        Args:
+            max_bytes: Total size budget of the cache
+            max_item_bytes: Files larger than this are never cached
+            seen_size: Number of recently requested, not yet cached files remembered
+        """
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.seen_size = seen_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._seen = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, stat: os.stat_result) -> bytes:
+        """Cached content of a file, or None if missing or stale."""
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def should_cache(self, path: str, stat: os.stat_result) -> bool:
+        """Whether a file that missed the cache should be read into it."""
+        if self.max_bytes <= 0 or stat.st_size > self.max_item_bytes:
+            return False
+        if os.path.basename(path).startswith("init_"):
+            return True
+        with self._lock:
+            if path in self._seen:
+                del self._seen[path]
+                return True
+            self._seen[path] = None
+            while len(self._seen) > self.seen_size:
+                self._seen.popitem(last=False)
+        return False
+
+    def put(self, path: str, stat: os.stat_result, data: bytes):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[path] = ((stat.st_size, stat.st_mtime_ns), data)
+            self.size += len(data)
+            while self.size > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
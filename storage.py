@@ -0,0 +1,437 @@
+import os
+import shutil
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+from dash_packaging import SEGMENT_INDEX_FILE
+from dedup import TEMP_DIRS, link_or_copy
+from segment_delivery import MIMETYPES, cache_control, file_etag, guess_mimetype
+
+STORAGE_BACKENDS = ("local", "s3")
+# Files larger than this are sent in parts of this size, several at a time
+MULTIPART_CHUNK_BYTES = 8 * 1024 * 1024
+# Chunks of stored objects streamed through the API
+STREAM_CHUNK_BYTES = 256 * 1024
+
+
+def is_stored_output(name: str) -> bool:
+    """
+    Whether a file of a video folder is kept in the store.
+
+    These are the files served to players, and the segment index of
+    single-file renditions, which hosts without a local copy need to serve
+    their segment URLs.
+    """
+    if name == SEGMENT_INDEX_FILE:
+        return True
+    return os.path.splitext(name)[1].lower() in MIMETYPES and not name.startswith((".", "original."))
+
+
+def parse_byte_range(byte_range: str, size: int):
+    """
+    Bounds of a ``Range: bytes=`` header in a file.
+
+    Args:
+        byte_range: Header value, with a single range
+        size: File size in bytes
+
+    Returns:
+        tuple: (start, end) with the end excluded, or None for headers
+            that are ignored (several ranges, other units, bad syntax)
+
+    Raises:
+        ValueError: If the range is not satisfiable
+    """
+    unit, _, spec = byte_range.partition("=")
+    first, dash, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or not dash or "," in spec:
+        return None
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size
+        else:
+            start, end = int(first), min(size, int(last) + 1) if last else size
+    except ValueError:
+        return None
+    if start >= end:
+        raise ValueError(f"Range {byte_range} not satisfiable for {size} bytes")
+    return start, end
+
+
+def _file_chunks(f, length: int):
+    """Yield length bytes of an open file in chunks."""
+    while length > 0:
+        chunk = f.read(min(STREAM_CHUNK_BYTES, length))
+        if not chunk:
+            return
+        length -= len(chunk)
+        yield chunk
+
+
+def output_files(local_dir: Path) -> list:
+    """
+    Stored files under a directory, in upload order.
+
+    Segments and previews come first, then manifests from the deepest
+    directory up, so a stored manifest never references a file that is not
+    stored yet. Working directories of encodes are skipped.
+    """
+    local_dir = Path(local_dir)
+    files = []
+    for root, dirs, names in os.walk(local_dir):
+        dirs[:] = [name for name in dirs if name not in TEMP_DIRS and not name.startswith(".")]
+        files += [Path(root) / name for name in names if is_stored_output(name)]
+    return sorted(
+        files, key=lambda path: (path.suffix == ".mpd", -len(path.relative_to(local_dir).parts))
+    )
+
+
+@dataclass
+class StoredObject:
+    """Body and headers of a stored file (or of a byte range of it)."""
+
+    status: int
+    length: int = 0
+    chunks: object = ()
+    etag: str = None
+    last_modified: object = None
+    content_range: str = None
+    close: object = field(default=lambda: None)
+
+
+class Storage(ABC):
+    """
+    Where the served outputs of the videos are kept.
+
+    Videos are encoded in their folder under UPLOADS_DIR, which stays the
+    working copy of the transcode host. A backend receives the finished
+    files under keys ``<video_id>/<path in the folder>``, from which any
+    delivery host can serve them, and may give players direct URLs to them.
+    """
+
+    # Whether the store is the uploads directory itself, so nothing is copied
+    in_place = False
+
+    def __init__(self, public_url: str = "", upload_workers: int = 8):
+        self.public_url = public_url.rstrip("/")
+        self.upload_workers = max(1, upload_workers)
+
+    @abstractmethod
+    def put_file(self, key: str, path: Path) -> int:
+        """
+        Store a local file.
+
+        Returns:
+            int: Bytes sent to the store
+        """
+
+    @abstractmethod
+    def get_file(self, key: str, path: Path):
+        """Copy a stored file to a local path."""
+
+    @abstractmethod
+    def delete(self, keys: list):
+        """Remove stored files, ignoring missing ones."""
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str):
+        """Remove the stored files of a directory, given by its key ending with ``/`` (e.g. ``<video_id>/lazy-1/``)."""
+
+    def path(self, key: str) -> Path:
+        """Local path of a stored file, or None if the backend is not a filesystem."""
+        return None
+
+    @abstractmethod
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None) -> StoredObject:
+        """
+        Stored file, or a byte range of it.
+
+        Args:
+            key: Key of the file
+            byte_range: ``Range`` header of the request, if any
+            if_none_match: ``If-None-Match`` header of the request, if any
+
+        Returns:
+            StoredObject: The body and headers (status 200, 206, 304 or
+                416), or None if the file does not exist
+        """
+
+    def url(self, key: str) -> str:
+        """URL of a stored file for clients, or None if only the API serves it."""
+        if self.public_url:
+            return f"{self.public_url}/{quote(key)}"
+        return None
+
+    def redirect_url(self, key: str) -> str:
+        """
+        URL players can be redirected to for a stored file, or None to serve it from the API.
+
+        Manifests are only redirected to public URLs: a player resolves the
+        segment URLs against the manifest's URL, which would drop the
+        signature of a pre-signed one.
+        """
+        if key.endswith(".mpd") and not self.public_url:
+            return None
+        return self.url(key)
+
+    def upload_dir(self, local_dir: Path, prefix: str) -> dict:
+        """
+        Store the served files under a local directory, several at a time.
+
+        Segments and previews are uploaded in parallel, then the manifests,
+        so players never load a manifest before its segments are stored.
+
+        Args:
+            local_dir: Directory of a video, rendition or tier
+            prefix: Key of the directory, ending with ``/``
+
+        Returns:
+            dict: Number of files and bytes stored
+        """
+        if self.in_place:
+            return {"files": 0, "bytes": 0}
+        local_dir = Path(local_dir)
+        files = output_files(local_dir)
+        segments = [path for path in files if path.suffix != ".mpd"]
+        manifests = [path for path in files if path.suffix == ".mpd"]
+
+        def put(path):
+            return self.put_file(prefix + path.relative_to(local_dir).as_posix(), path)
+
+        with ThreadPoolExecutor(self.upload_workers) as pool:
+            sizes = list(pool.map(put, segments))
+        sizes += [put(path) for path in manifests]
+        return {"files": len(files), "bytes": sum(sizes)}
+
+
+class LocalStorage(Storage):
+    """
+    Files in a local directory, the uploads directory itself or e.g. a volume
+    shared with the delivery hosts.
+    """
+
+    def __init__(self, root: Path, uploads_dir: Path, **options):
+        super().__init__(**options)
+        self.root = Path(root)
+        self.in_place = self.root.resolve() == Path(uploads_dir).resolve()
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def put_file(self, key: str, path: Path) -> int:
+        target = self.path(key)
+        if self.in_place and target.resolve() == Path(path).resolve():
+            return 0
+        target.parent.mkdir(parents=True, exist_ok=True)
+        link_or_copy(path, target)
+        return target.stat().st_size
+
+    def get_file(self, key: str, path: Path):
+        if self.path(key).resolve() != Path(path).resolve():
+            link_or_copy(self.path(key), path)
+
+    def delete(self, keys: list):
+        for key in keys:
+            self.path(key).unlink(missing_ok=True)
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self.path(prefix), ignore_errors=True)
+
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None) -> StoredObject:
+        try:
+            f = open(self.path(key), "rb")
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return None
+        stat = os.fstat(f.fileno())
+        etag = f'"{file_etag(stat)}"'
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            f.close()
+            return StoredObject(304, etag=etag)
+        try:
+            bounds = parse_byte_range(byte_range, stat.st_size) if byte_range else None
+        except ValueError:
+            f.close()
+            return StoredObject(416)
+        start, end = bounds or (0, stat.st_size)
+        f.seek(start)
+        return StoredObject(
+            206 if bounds else 200,
+            length=end - start,
+            chunks=_file_chunks(f, end - start),
+            etag=etag,
+            last_modified=datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            content_range=f"bytes {start}-{end - 1}/{stat.st_size}" if bounds else None,
+            close=f.close,
+        )
+
+
+class S3Storage(Storage):
+    """
+    Files in a bucket of an S3-compatible object store (AWS S3, MinIO, Ceph...).
+
+    Uses boto3, only imported when this backend is configured. Credentials
+    come from the usual AWS environment variables or configuration files.
+    Large files are uploaded in parts, up to upload_workers at a time, and
+    are stored with the mimetype and Cache-Control of the API's responses,
+    so a CDN or a player fetching them directly caches them the same way.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: str = "",
+        region: str = "",
+        prefix: str = "",
+        url_expiry: int = 3600,
+        **options,
+    ):
+        super().__init__(**options)
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError("The s3 storage backend needs boto3 (see requirements-production.txt)") from e
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expiry = url_expiry
+        self._client_error = ClientError
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=Config(
+                signature_version="s3v4",
+                # Self-hosted stores rarely have a DNS name per bucket
+                s3={"addressing_style": "path"} if endpoint_url else None,
+                max_pool_connections=self.upload_workers * 4,
+            ),
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=MULTIPART_CHUNK_BYTES,
+            multipart_chunksize=MULTIPART_CHUNK_BYTES,
+            max_concurrency=self.upload_workers,
+        )
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return super().url(self.prefix + key)
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.prefix + key},
+            ExpiresIn=self.url_expiry,
+        )
+
+    def put_file(self, key: str, path: Path) -> int:
+        name = Path(key).name
+        self.client.upload_file(
+            str(path),
+            self.bucket,
+            self.prefix + key,
+            ExtraArgs={
+                "ContentType": guess_mimetype(name) or "application/octet-stream",
+                "CacheControl": cache_control(name, True),
+            },
+            Config=self.transfer,
+        )
+        return Path(path).stat().st_size
+
+    def get_file(self, key: str, path: Path):
+        tmp = Path(path).with_name(f".{Path(path).name}.tmp")
+        self.client.download_file(self.bucket, self.prefix + key, str(tmp), Config=self.transfer)
+        tmp.replace(path)
+
+    def delete(self, keys: list):
+        keys = list(keys)
+        # Up to 1000 keys per request
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": self.prefix + key} for key in keys[start : start + 1000]],
+                    "Quiet": True,
+                },
+            )
+
+    def delete_prefix(self, prefix: str):
+        paginator = self.client.get_paginator("list_objects_v2")
+        keys = [
+            item["Key"][len(self.prefix) :]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix)
+            for item in page.get("Contents", ())
+        ]
+        self.delete(keys)
+
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None) -> StoredObject:
+        args = {"Bucket": self.bucket, "Key": self.prefix + key}
+        if byte_range:
+            args["Range"] = byte_range
+        if if_none_match:
+            args["IfNoneMatch"] = if_none_match
+        try:
+            obj = self.client.get_object(**args)
+        except self._client_error as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("NoSuchKey", "404"):
+                return None
+            if code == "304":
+                return StoredObject(304, etag=if_none_match)
+            if code == "InvalidRange":
+                return StoredObject(416)
+            raise
+        body = obj["Body"]
+        return StoredObject(
+            206 if obj.get("ContentRange") else 200,
+            length=obj["ContentLength"],
+            chunks=body.iter_chunks(STREAM_CHUNK_BYTES),
+            etag=obj.get("ETag"),
+            last_modified=obj.get("LastModified"),
+            content_range=obj.get("ContentRange"),
+            close=body.close,
+        )
+
+
+def create_storage(
+    backend: str,
+    uploads_dir: Path,
+    root: Path = None,
+    bucket: str = "",
+    endpoint_url: str = "",
+    region: str = "",
+    prefix: str = "",
+    public_url: str = "",
+    url_expiry: int = 3600,
+    upload_workers: int = 8,
+) -> Storage:
+    """
+    Storage backend by name.
+
+    Args:
+        backend: "local" or "s3"
+        uploads_dir: Directory the videos are encoded in
+        root: Directory of the local backend (defaults to uploads_dir)
+        bucket: Bucket of the s3 backend
+        endpoint_url: Endpoint of an S3-compatible store, e.g. MinIO
+        region: Region of the bucket
+        prefix: Prefix of the keys in the bucket
+        public_url: Base URL the stored files are publicly served from (CDN,
+            public bucket, web server of the local directory), for redirects
+        url_expiry: Validity in seconds of pre-signed URLs
+        upload_workers: Files, or parts of a large file, uploaded at a time
+
+    Raises:
+        ValueError: If the backend is unknown or misconfigured
+    """
+    options = {"public_url": public_url, "upload_workers": upload_workers}
+    if backend == "local":
+        return LocalStorage(root or uploads_dir, uploads_dir, **options)
+    if backend == "s3":
+        if not bucket:
+            raise ValueError("The s3 storage backend needs a bucket")
+        return S3Storage(bucket, endpoint_url, region, prefix, url_expiry, **options)
+    raise ValueError(f"Unknown storage backend {backend!r}, available: {', '.join(STORAGE_BACKENDS)}")
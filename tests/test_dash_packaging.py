@@ -0,0 +1,314 @@
+"""
+Single-file renditions: the sidx written by pack_representation, and the
+lookup of former segment URLs through segments.json.
+
+Packages a short ffmpeg DASH output (a video and an audio representation)
+and parses the result independently of dash_packaging's own box reader.
+Skipped when ffmpeg is not installed; the tests going through app.py also
+need its dependencies.
+
+Usage:
+    python -m pytest tests
+"""
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+from dash_packaging import (  # noqa: E402
+    SEGMENT_INDEX_FILE,
+    SegmentIndex,
+    pack_representation,
+    package_single_file,
+    retime_segments,
+    segment_timeline,
+)
+from storage import LocalStorage  # noqa: E402
+
+DURATION = 10
+# One video frame, and two AAC frames of priming and padding at 48 kHz
+TOLERANCE = {"0": 1 / 30, "1": 2048 / 48000}
+
+
+def boxes(data: bytes, start: int = 0, end: int = None):
+    """Yield (type, offset, size) of the boxes in a range."""
+    end = len(data) if end is None else end
+    while start < end:
+        size, box_type = struct.unpack_from(">I4s", data, start)
+        yield box_type.decode(), start, size
+        start += size
+
+
+def child(data: bytes, offset: int, box_type: str) -> int:
+    """Offset of the first child box of a type of the (plain, 8-byte header) box at an offset."""
+    size = struct.unpack_from(">I", data, offset)[0]
+    return next(start for kind, start, _ in boxes(data, offset + 8, offset + size) if kind == box_type)
+
+
+def decode_time(data: bytes, moof: int) -> int:
+    tfdt = child(data, child(data, moof, "traf"), "tfdt")
+    if data[tfdt + 8] == 1:
+        return struct.unpack_from(">Q", data, tfdt + 12)[0]
+    return struct.unpack_from(">I", data, tfdt + 12)[0]
+
+
+def parse_sidx(data: bytes, offset: int) -> dict:
+    version = data[offset + 8]
+    timescale = struct.unpack_from(">I", data, offset + 16)[0]
+    if version == 1:
+        earliest, first_offset = struct.unpack_from(">QQ", data, offset + 20)
+        position = offset + 36
+    else:
+        earliest, first_offset = struct.unpack_from(">II", data, offset + 20)
+        position = offset + 28
+    count = struct.unpack_from(">H", data, position + 2)[0]
+    references = []
+    for i in range(count):
+        size, duration, sap = struct.unpack_from(">III", data, position + 4 + 12 * i)
+        references.append(
+            {"type": size >> 31, "size": size & 0x7FFFFFFF, "duration": duration, "sap": sap >> 31}
+        )
+    return {"timescale": timescale, "earliest": earliest, "first_offset": first_offset, "references": references}
+
+
+def fragments(path: Path) -> bytes:
+    """The moof and mdat boxes of a media segment, without its styp and sidx."""
+    data = path.read_bytes()
+    return b"".join(data[start : start + size] for kind, start, size in boxes(data) if kind in ("moof", "mdat"))
+
+
+def representation_files(output_dir: Path, rep_id: str) -> list:
+    return [output_dir / f"init_{rep_id}.m4s", *sorted(output_dir.glob(f"chunk_{rep_id}_*.m4s"))]
+
+
+@pytest.fixture(scope="module")
+def dash_output(tmp_path_factory) -> Path:
+    output_dir = tmp_path_factory.mktemp("dash")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size=320x180:rate=30:duration={DURATION}",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:sample_rate=48000:duration={DURATION}",
+            "-map",
+            "0:v",
+            "-map",
+            "1:a",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-g",
+            "60",
+            "-sc_threshold",
+            "0",
+            "-c:a",
+            "aac",
+            "-f",
+            "dash",
+            "-seg_duration",
+            "4",
+            "-init_seg_name",
+            "init_$RepresentationID$.m4s",
+            "-media_seg_name",
+            "chunk_$RepresentationID$_$Number%03d$.m4s",
+            str(output_dir / "video.mpd"),
+        ],
+        check=True,
+    )
+    return output_dir
+
+
+@pytest.fixture
+def output_dir(dash_output, tmp_path) -> Path:
+    return Path(shutil.copytree(dash_output, tmp_path / "clip"))
+
+
+@pytest.fixture
+def packaged(output_dir) -> dict:
+    """Fragments of the former segment files by name, after packaging the output."""
+    files = {
+        path.name: path.read_bytes() if path.name.startswith("init_") else fragments(path)
+        for rep_id in ("0", "1")
+        for path in representation_files(output_dir, rep_id)
+    }
+    package_single_file(output_dir / "video.mpd", lambda rep_id: representation_files(output_dir, rep_id))
+    return files
+
+
+@pytest.mark.parametrize("rep_id", ["0", "1"])
+def test_sidx_references_the_fragments_of_every_segment(output_dir, rep_id):
+    init, *media = representation_files(output_dir, rep_id)
+    timeline = segment_timeline(init, media)
+    layout = pack_representation(init, media, output_dir / "stream.mp4")
+    data = (output_dir / "stream.mp4").read_bytes()
+
+    index_offset, index_size = layout["index"]
+    assert [(kind, start) for kind, start, _ in boxes(data)][:3] == [
+        ("ftyp", 0),
+        ("moov", next(start for kind, start, _ in boxes(data) if kind == "moov")),
+        ("sidx", index_offset),
+    ]
+    assert layout["init"] == [0, init.stat().st_size]
+    assert struct.unpack_from(">I", data, index_offset)[0] == index_size
+    sidx = parse_sidx(data, index_offset)
+    assert sidx["timescale"] == layout["timescale"]
+    assert len(sidx["references"]) == len(media)
+
+    offset = index_offset + index_size + sidx["first_offset"]
+    decode_times = []
+    for reference, (start, length), path in zip(sidx["references"], layout["segments"], media):
+        assert (reference["type"], reference["sap"]) == (0, 1)
+        assert (offset, reference["size"]) == (start, length)
+        # A reference covers whole moof and mdat boxes, copied unchanged
+        kinds = [kind for kind, _, _ in boxes(data, offset, offset + reference["size"])]
+        assert kinds[0] == "moof" and set(kinds) == {"moof", "mdat"}
+        assert data[offset : offset + reference["size"]] == fragments(path)
+        decode_times.append(decode_time(data, offset))
+        offset += reference["size"]
+    assert offset == len(data)
+
+    timescale = sidx["timescale"]
+    assert sidx["earliest"] == decode_times[0]
+    durations = [reference["duration"] for reference in sidx["references"]]
+    assert durations[:-1] == [b - a for a, b in zip(decode_times, decode_times[1:])]
+    assert durations == pytest.approx([round(length * timescale) for _, length in timeline], abs=1)
+    assert all(durations)
+    assert sum(durations) / timescale == pytest.approx(DURATION, abs=TOLERANCE[rep_id])
+
+
+def test_sidx_starts_at_the_retimed_decode_time(output_dir):
+    init, *media = representation_files(output_dir, "0")
+    original = pack_representation(init, media, output_dir / "original.mp4")
+    retime_segments(init, media, 8.0)
+    layout = pack_representation(init, media, output_dir / "stream.mp4")
+
+    before = parse_sidx((output_dir / "original.mp4").read_bytes(), original["index"][0])
+    after = parse_sidx((output_dir / "stream.mp4").read_bytes(), layout["index"][0])
+    assert after["earliest"] == 8 * layout["timescale"]
+    assert after["references"] == before["references"]
+
+
+def test_sidx_of_segments_encoded_separately(output_dir):
+    init, *media = representation_files(output_dir, "0")
+    timeline = segment_timeline(init, media)
+    original = pack_representation(init, media, output_dir / "original.mp4")
+    # Every chunk encode starts its decode times at 0, stitching retimes them to the chunk start
+    for path, (start, _) in zip(media, timeline):
+        retime_segments(init, [path], 0.0)
+        retime_segments(init, [path], start)
+    layout = pack_representation(init, media, output_dir / "stream.mp4")
+
+    before = parse_sidx((output_dir / "original.mp4").read_bytes(), original["index"][0])
+    after = parse_sidx((output_dir / "stream.mp4").read_bytes(), layout["index"][0])
+    assert after == before
+
+
+def test_manifest_points_at_the_index_and_init_ranges(output_dir, packaged):
+    root = ET.parse(output_dir / "video.mpd").getroot()
+    namespace = {"mpd": root.tag[1:].split("}")[0]}
+    representations = root.findall(".//mpd:Representation", namespace)
+    assert len(representations) == 2
+    for rep in representations:
+        name = rep.find("mpd:BaseURL", namespace).text
+        segment_base = rep.find("mpd:SegmentBase", namespace)
+        assert rep.find("mpd:SegmentTemplate", namespace) is None
+        data = (output_dir / name).read_bytes()
+        index_start, index_end = map(int, segment_base.get("indexRange").split("-"))
+        assert data[index_start + 4 : index_start + 8] == b"sidx"
+        assert struct.unpack_from(">I", data, index_start)[0] == index_end - index_start + 1
+        init_end = int(segment_base.find("mpd:Initialization", namespace).get("range").split("-")[1])
+        assert data[: init_end + 1] == packaged[f"init_{rep.get('id')}.m4s"]
+    assert not list(output_dir.glob("chunk_*.m4s"))
+
+
+def test_former_segment_files_are_located_in_the_single_files(output_dir, packaged):
+    index = SegmentIndex()
+
+    for name, content in packaged.items():
+        single_file, offset, length = index.locate(str(output_dir / name))
+        assert Path(single_file).parent == output_dir
+        with open(single_file, "rb") as f:
+            f.seek(offset)
+            assert f.read(length) == content
+    assert index.locate(str(output_dir / "chunk_0_099.m4s")) is None
+    assert index.locate(str(output_dir.parent / "chunk_0_001.m4s")) is None
+
+
+def test_a_rewritten_segment_index_is_reloaded(output_dir, packaged):
+    index = SegmentIndex()
+    assert index.locate(str(output_dir / "chunk_0_001.m4s")) is not None
+
+    index_path = output_dir / SEGMENT_INDEX_FILE
+    index_path.write_text('{"files": {}}')
+    os.utime(index_path, ns=(0, 0))
+
+    assert index.locate(str(output_dir / "chunk_0_001.m4s")) is None
+
+
+def test_former_segment_files_are_located_in_the_storage(output_dir, packaged, tmp_path):
+    storage = LocalStorage(tmp_path, tmp_path / "uploads")
+    index = SegmentIndex()
+    local = SegmentIndex().locate(str(output_dir / "chunk_1_002.m4s"))
+
+    assert index.locate_stored(storage, "clip/chunk_1_002.m4s") == ("clip/stream_1.mp4", *local[1:])
+    assert index.locate_stored(storage, "clip/chunk_1_099.m4s") is None
+    assert index.locate_stored(storage, "other/chunk_1_002.m4s") is None
+
+    (output_dir / SEGMENT_INDEX_FILE).unlink()
+    # Cached for STORED_INDEX_TTL seconds
+    assert index.locate_stored(storage, "clip/chunk_1_002.m4s") is not None
+    assert SegmentIndex(stored_ttl=0).locate_stored(storage, "clip/chunk_1_002.m4s") is None
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    pytest.importorskip("ffmpeg_streaming")
+    pytest.importorskip("flask")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # uploads/, jobs/ and the catalog are created next to the working directory
+        monkeypatch.chdir(tmp_path_factory.mktemp("app"))
+        monkeypatch.setenv("START_TRANSCODE_WORKERS", "false")
+        import app
+
+        yield app
+
+
+def test_packed_segments_are_recognized_and_served(app_module, dash_output, monkeypatch):
+    video_dir = app_module.UPLOADS_DIR / "clip"
+    shutil.copytree(dash_output, video_dir, dirs_exist_ok=True)
+    first = fragments(video_dir / "chunk_0_002.m4s")
+    package_single_file(video_dir / "video.mpd", lambda rep_id: representation_files(video_dir, rep_id))
+
+    assert app_module.is_packed_segment(str(video_dir / "chunk_0_002.m4s"), "clip/chunk_0_002.m4s")
+    assert not app_module.is_packed_segment(str(video_dir / "chunk_0_099.m4s"), "clip/chunk_0_099.m4s")
+    assert not app_module.is_packed_segment(str(video_dir / "video.mpd"), "clip/video.mpd")
+    response = app_module.app.test_client().get("/videos/clip/chunk_0_002.m4s")
+    assert response.status_code == 200
+    assert response.data == first
+
+    # A host without the local copy finds the index in the storage backend
+    store = video_dir.parent.parent / "store"
+    store.mkdir()
+    shutil.move(str(video_dir), str(store / "clip"))
+    monkeypatch.setattr(
+        app_module, "storage", LocalStorage(store, app_module.UPLOADS_DIR.resolve())
+    )
+    assert app_module.is_packed_segment(str(video_dir / "chunk_0_002.m4s"), "clip/chunk_0_002.m4s")
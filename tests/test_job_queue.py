@@ -0,0 +1,234 @@
+"""
+Claiming, recovering, retrying and merging jobs of the on-disk job queue.
+
+Jobs are claimed and finished by calling the queue directly, without worker
+threads, except for the end-to-end test of start().
+
+Usage:
+    python -m pytest tests
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from job_queue import INSTANCE_ID, JobDeferred, JobQueue, write_json_atomic  # noqa: E402
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "jobs", handler=None, max_attempts=3, retry_backoff=10)
+
+
+@pytest.fixture(scope="module")
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+def files(queue, state: str) -> list:
+    return sorted(path.name for path in (queue.jobs_dir / state).iterdir())
+
+
+def read_job(queue, state: str, job_id: str) -> dict:
+    with open(queue._path(state, job_id)) as f:
+        return json.load(f)
+
+
+def make_due(queue, job_id: str):
+    job = read_job(queue, "pending", job_id)
+    job["not_before"] = 0
+    write_json_atomic(queue._path("pending", job_id), job)
+
+
+def test_a_job_is_claimed_once(queue):
+    queue.enqueue("clip")
+    claimers = [JobQueue(queue.jobs_dir, handler=None) for _ in range(8)]
+    barrier = threading.Barrier(len(claimers))
+    claimed = []
+
+    def claim(claimer):
+        barrier.wait()
+        claimed.append(claimer._claim())
+
+    threads = [threading.Thread(target=claim, args=(claimer,)) for claimer in claimers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [job["id"] for job in claimed if job] == ["clip"]
+    assert files(queue, "pending") == []
+    assert files(queue, "running") == ["clip.json"]
+    job = read_job(queue, "running", "clip")
+    assert job["owner"] == os.getpid()
+    assert job["instance"] == INSTANCE_ID
+    assert job["attempts"] == 1
+
+
+def test_higher_priority_runs_first(queue):
+    queue.enqueue("later", priority=0)
+    queue.enqueue("sooner", priority=5)
+    queue.enqueue("delayed", priority=9, delay=60)
+
+    assert queue._claim()["id"] == "sooner"
+    assert queue._claim()["id"] == "later"
+    assert queue._claim() is None
+
+
+def test_jobs_of_dead_owners_are_recovered(queue, dead_pid):
+    queue.enqueue("orphan")
+    queue.enqueue("alive")
+    queue.enqueue("restarted")
+    for _ in range(3):
+        queue._claim()
+    for job_id, owner in (
+        ("orphan", {"owner": dead_pid, "instance": "gone"}),
+        # Same PID as this process after a container restart, another instance
+        ("restarted", {"owner": os.getpid(), "instance": "previous"}),
+    ):
+        job = read_job(queue, "running", job_id)
+        job.update(owner)
+        write_json_atomic(queue._path("running", job_id), job)
+
+    assert sorted(queue.recover()) == ["orphan", "restarted"]
+    assert files(queue, "running") == ["alive.json"]
+    recovered = read_job(queue, "pending", "orphan")
+    assert not {"owner", "instance", "owner_started"} & recovered.keys()
+    assert recovered["attempts"] == 1
+
+
+def test_orphaned_claims_are_recovered(queue, dead_pid):
+    job = queue.enqueue("clip")
+    # Claimed by a process that died before writing itself as the owner
+    os.rename(queue._path("pending", "clip"), queue.jobs_dir / "running" / f".clip.{dead_pid}.gone.claim")
+    live_claim = queue._claim_path("other")
+    write_json_atomic(live_claim, {**job, "id": "other"})
+
+    assert queue.recover() == ["clip"]
+    assert files(queue, "pending") == ["clip.json"]
+    assert live_claim.exists()
+
+
+def test_failed_attempts_are_retried_with_backoff_then_fail(queue):
+    failures = []
+    queue.on_failure = lambda job, error, will_retry: failures.append((job["attempts"], will_retry))
+    queue.enqueue("clip")
+
+    for attempt, backoff in ((1, 10), (2, 20)):
+        job = queue._claim()
+        queue._finish(job, RuntimeError("ffmpeg failed"))
+        job = read_job(queue, "pending", "clip")
+        assert job["attempts"] == attempt
+        assert job["not_before"] == pytest.approx(time.time() + backoff, abs=1)
+        assert job["last_error"] == "ffmpeg failed"
+        assert queue._claim() is None
+        make_due(queue, "clip")
+
+    queue._finish(queue._claim(), RuntimeError("ffmpeg failed"))
+
+    assert failures == [(1, True), (2, True), (3, False)]
+    assert files(queue, "pending") == files(queue, "running") == []
+    assert read_job(queue, "failed", "clip")["attempts"] == 3
+
+
+def test_deferred_jobs_keep_their_attempts(queue):
+    queue.enqueue("clip")
+    queue._finish(queue._claim(), JobDeferred(30))
+
+    job = read_job(queue, "pending", "clip")
+    assert job["attempts"] == 0
+    assert job["not_before"] == pytest.approx(time.time() + 30, abs=1)
+    assert "last_error" not in job
+
+
+def test_enqueue_merges_into_a_waiting_job(queue):
+    queue.enqueue("clip", priority=1, payload={"task": "reencode", "profile": "fast-ingest"})
+    queue._finish(queue._claim(), RuntimeError("ffmpeg failed"))
+    retry = read_job(queue, "pending", "clip.reencode")
+
+    queue.enqueue("clip", priority=3, payload={"task": "reencode", "profile": "archive"})
+
+    job = read_job(queue, "pending", "clip.reencode")
+    assert job["attempts"] == 1
+    assert job["enqueued"] == retry["enqueued"]
+    assert job["not_before"] == retry["not_before"]
+    assert job["priority"] == 3
+    assert job["payload"] == {"task": "reencode", "profile": "archive"}
+
+    queue.enqueue("clip", payload={"task": "reencode"}, delay=60)
+
+    job = read_job(queue, "pending", "clip.reencode")
+    assert job["not_before"] == pytest.approx(time.time() + 60, abs=1)
+    assert job["priority"] == 3
+    assert job["payload"] == {"task": "reencode", "profile": "archive"}
+
+
+def test_enqueue_replaces_a_failed_job(queue):
+    queue.max_attempts = 1
+    queue.enqueue("clip")
+    queue._finish(queue._claim(), RuntimeError("ffmpeg failed"))
+
+    queue.enqueue("clip")
+
+    assert files(queue, "failed") == []
+    assert read_job(queue, "pending", "clip")["attempts"] == 0
+
+
+def test_tasks_of_a_video_are_separate_jobs(queue):
+    queue.enqueue("clip", payload={"task": "remove_replaced"}, delay=3600)
+    queue.enqueue("clip", payload={"task": "lazy_tier"})
+    queue.enqueue("clip")
+
+    assert files(queue, "pending") == ["clip.json", "clip.lazy_tier.json", "clip.remove_replaced.json"]
+    assert queue.has_job("clip", "remove_replaced")
+    assert not queue.has_job("clip", "evict_tier")
+    cleanup = read_job(queue, "pending", "clip.remove_replaced")
+    assert cleanup["video_id"] == "clip"
+    assert cleanup["payload"] == {"task": "remove_replaced"}
+    assert cleanup["not_before"] == pytest.approx(time.time() + 3600, abs=1)
+
+
+def test_jobs_of_a_video_run_one_at_a_time(queue):
+    queue.enqueue("clip", priority=1)
+    queue.enqueue("clip", payload={"task": "lazy_tier"})
+    queue.enqueue("other")
+
+    first = queue._claim()
+    assert first["id"] == "clip"
+    assert queue._claim()["id"] == "other"
+    assert queue._claim() is None
+
+    queue._finish(first)
+    job = queue._claim()
+    assert (job["id"], job["video_id"]) == ("clip.lazy_tier", "clip")
+
+
+def test_jobs_queued_before_task_ids_are_claimed(queue):
+    write_json_atomic(
+        queue._path("pending", "clip"),
+        {"id": "clip", "priority": 0, "attempts": 0, "enqueued": 0, "payload": {"task": "remove_replaced"}},
+    )
+
+    assert queue._claim()["video_id"] == "clip"
+
+
+def test_workers_run_queued_jobs(tmp_path):
+    done = threading.Event()
+    queue = JobQueue(tmp_path / "jobs", handler=lambda job: done.set(), poll_interval=0.05)
+    queue.start()
+    try:
+        queue.enqueue("clip")
+        assert done.wait(5)
+    finally:
+        queue.stop(timeout=5)
+
+    assert files(queue, "pending") == files(queue, "running") == []
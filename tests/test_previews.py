@@ -0,0 +1,82 @@
+"""
+Seek-preview plans, and the sprite sheets ffmpeg writes for them.
+
+The sheet test runs ffmpeg on short lavfi sources and is skipped when
+ffmpeg is not installed.
+
+Usage:
+    python -m pytest tests
+"""
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from previews import (  # noqa: E402
+    SPRITE_VTT_NAME,
+    plan_previews,
+    preview_output_args,
+    write_sprite_vtt,
+)
+
+
+@pytest.mark.parametrize(
+    "duration, interval, count, rows",
+    [
+        (0.5, 0.5, 1, 1),
+        (3, 3, 1, 1),
+        (5, 5, 1, 1),
+        (12, 5, 3, 1),
+        (600, 5, 120, 10),
+        (7200, 12, 600, 10),
+    ],
+)
+def test_sprite_plan(duration, interval, count, rows):
+    plan = plan_previews(1920, 1080, duration)
+
+    assert plan["interval"] == interval
+    assert plan["count"] == count
+    assert plan["rows"] == rows
+    assert (plan["width"], plan["height"]) == (160, 90)
+
+
+def test_unknown_duration_only_plans_the_poster():
+    assert plan_previews(1920, 1080, None) == {"poster_time": 1.0}
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+@pytest.mark.parametrize("duration", [0.5, 3, 12])
+def test_every_cue_points_into_a_written_sheet(tmp_path, duration):
+    source = tmp_path / "source.mp4"
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size=320x180:rate=30:duration={duration}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            str(source),
+        ],
+        check=True,
+    )
+    plan = plan_previews(320, 180, duration)
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(source), *preview_output_args(tmp_path, plan)],
+        check=True,
+    )
+    write_sprite_vtt(tmp_path, plan)
+
+    cues = re.findall(r"^(\S+)#xywh=", (tmp_path / SPRITE_VTT_NAME).read_text(), re.MULTILINE)
+    assert len(cues) == plan["count"]
+    assert all((tmp_path / sheet).exists() for sheet in cues)
@@ -0,0 +1,119 @@
+"""
+Resuming an interrupted encode from its checkpoint.
+
+Encodes a short lavfi source, kills ffmpeg once it starts writing a given
+segment, resumes the part and checks that the decode times of the kept and
+the resumed segments form one timeline.
+
+Usage:
+    python -m pytest tests
+"""
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pytest.importorskip("ffmpeg_streaming")
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+from checkpoint import EncodeCheckpoint  # noqa: E402
+from dash_packaging import segment_timeline  # noqa: E402
+from ffmpeg_streaming import Bitrate, Representation, Size  # noqa: E402
+from video_processor import _encode_part, _segment_files  # noqa: E402
+
+DURATION = 16
+FRAME = 1 / 30
+LADDER = [
+    Representation(Size(320, 180), Bitrate(400 * 1024, None)),
+    Representation(Size(256, 144), Bitrate(200 * 1024, None)),
+]
+
+
+class KillAt:
+    """Progress stand-in killing ffmpeg when it opens the given segment file.
+
+    Pass a segment of the last representation so that every representation
+    has completed the segments before it.
+    """
+
+    def __init__(self, segment: str):
+        self.segment = segment
+
+    def monitor(self, key, span=None, offset=0.0):
+        def hook(line, *args):
+            # dashenc logs "Opening '<path>.tmp' for writing" for every segment,
+            # and the last argument of ffmpeg_streaming's monitor is the process
+            if "Opening" in line and self.segment in line:
+                args[-1].kill()
+
+        return hook
+
+
+@pytest.fixture(scope="module")
+def source(tmp_path_factory) -> Path:
+    path = tmp_path_factory.mktemp("source") / "source.mp4"
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size=320x180:rate=30:duration={DURATION}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            str(path),
+        ],
+        check=True,
+    )
+    return path
+
+
+def encode(source: Path, output_dir: Path, progress=None) -> bool:
+    checkpoint = EncodeCheckpoint(output_dir, "test")
+    return _encode_part(
+        source,
+        output_dir / "part",
+        LADDER,
+        duration=DURATION,
+        progress=progress,
+        checkpoint=checkpoint,
+    )
+
+
+def assert_one_timeline(part_dir: Path):
+    for rep_id in ("0", "1"):
+        init, *media = _segment_files(part_dir, rep_id)
+        timeline = segment_timeline(init, media)
+        assert len(timeline) == DURATION // 4
+        assert timeline[0][0] == pytest.approx(0, abs=FRAME / 2)
+        for (start, length), (next_start, _) in zip(timeline, timeline[1:]):
+            assert next_start == pytest.approx(start + length, abs=FRAME / 2)
+        assert timeline[-1][0] + timeline[-1][1] == pytest.approx(DURATION, abs=FRAME / 2)
+
+
+def test_resumed_segments_continue_the_timeline(source, tmp_path):
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        encode(source, tmp_path, KillAt("part/chunk_1_003.m4s"))
+
+    assert encode(source, tmp_path) is True
+    assert_one_timeline(tmp_path / "part")
+
+
+def test_interrupted_resume_continues_the_timeline(source, tmp_path):
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        encode(source, tmp_path, KillAt("part/chunk_1_003.m4s"))
+    # The resume covers 8-16 s and is killed after its first segment
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        encode(source, tmp_path, KillAt("resume/chunk_1_002.m4s"))
+
+    assert encode(source, tmp_path) is True
+    assert_one_timeline(tmp_path / "part")
@@ -0,0 +1,118 @@
+"""
+Command lines built by _dash_output for rotated sources.
+
+Only builds the ffmpeg arguments, without running ffmpeg or rendering
+fixtures (benchmarks/transcode_suite.py encodes rotated fixtures).
+
+Usage:
+    python -m pytest tests
+"""
+import shlex
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pytest.importorskip("ffmpeg_streaming")
+
+import video_processor  # noqa: E402
+from ffmpeg_streaming import Bitrate, Representation, Size  # noqa: E402
+
+# Ladders of a 1920x1080 recording rotated by 90° or 270° (portrait), and by 180°
+PORTRAIT_LADDER = [
+    Representation(Size(1080, 1920), Bitrate(8192 * 1024, None)),
+    Representation(Size(720, 1280), Bitrate(5120 * 1024, None)),
+    Representation(Size(144, 256), Bitrate(340 * 1024, None)),
+]
+LANDSCAPE_LADDER = [
+    Representation(Size(1920, 1080), Bitrate(8192 * 1024, None)),
+    Representation(Size(256, 144), Bitrate(340 * 1024, None)),
+]
+
+
+def build_args(tmp_path, representations, rotation, **kwargs) -> list:
+    dash = video_processor._dash_output(
+        tmp_path / "original.mp4", representations, rotation=rotation, **kwargs
+    )
+    dash.output(str(tmp_path / "video.mpd"), run_command=False)
+    return shlex.split(video_processor.command_builder("ffmpeg", dash))
+
+
+def option(args: list, name: str) -> str:
+    """Value following an option, or None if it is missing."""
+    return args[args.index(name) + 1] if name in args else None
+
+
+def input_args(args: list) -> list:
+    return args[: args.index("-i")]
+
+
+@pytest.fixture
+def ffmpeg_release(monkeypatch):
+    def set_release(version):
+        monkeypatch.setattr(video_processor, "ffmpeg_version", lambda: version)
+
+    set_release((7, 0))
+    return set_release
+
+
+@pytest.mark.parametrize(
+    "rotation, representations, expected",
+    [
+        (90, PORTRAIT_LADDER, "transpose=cclock"),
+        (-90, PORTRAIT_LADDER, "transpose=clock"),
+        (270, PORTRAIT_LADDER, "transpose=clock"),
+        (180, LANDSCAPE_LADDER, "hflip,vflip"),
+        (-180, LANDSCAPE_LADDER, "hflip,vflip"),
+    ],
+)
+def test_every_rung_is_transposed_before_its_scale(
+    tmp_path, ffmpeg_release, rotation, representations, expected
+):
+    args = build_args(tmp_path, representations, rotation)
+
+    for i, rep in enumerate(representations):
+        assert option(args, f"-filter:v:{i}") == expected
+        assert option(args, f"-s:v:{i}") == f"{rep.size.width}x{rep.size.height}"
+    assert args.count("0:v:0") == len(representations)
+    assert option(input_args(args), "-display_rotation:v:0") == "0"
+    assert "-noautorotate" not in args
+
+
+@pytest.mark.parametrize("rotation", [0, 360, None])
+def test_upright_sources_are_not_filtered(tmp_path, ffmpeg_release, rotation):
+    args = build_args(tmp_path, LANDSCAPE_LADDER, rotation)
+
+    assert not any(arg.startswith(("-filter", "-display_rotation")) for arg in args)
+    assert "-noautorotate" not in args
+
+
+def test_older_ffmpeg_skips_autorotate_and_resets_the_matrix(tmp_path, ffmpeg_release):
+    ffmpeg_release((5, 1))
+    args = build_args(tmp_path, PORTRAIT_LADDER, 90)
+
+    assert "-noautorotate" in input_args(args)
+    assert "-display_rotation:v:0" not in args
+    assert option(args, "-metadata:s:v") == "rotate=0"
+    assert option(args, "-filter:v:2") == "transpose=cclock"
+
+
+def test_development_builds_use_display_rotation(tmp_path, ffmpeg_release):
+    ffmpeg_release(None)
+    args = build_args(tmp_path, PORTRAIT_LADDER, 270)
+
+    assert option(input_args(args), "-display_rotation:v:0") == "0"
+
+
+def test_input_options_precede_the_input(tmp_path, ffmpeg_release):
+    args = build_args(
+        tmp_path, PORTRAIT_LADDER, 90, input_options={"ss": 8, "t": 4}, output_ts_offset=8
+    )
+
+    inputs = input_args(args)
+    assert option(inputs, "-ss") == "8"
+    assert option(inputs, "-t") == "4"
+    assert option(inputs, "-display_rotation:v:0") == "0"
+    assert option(args, "-output_ts_offset") == "8"
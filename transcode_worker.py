@@ -0,0 +1,91 @@
+"""
+Run the transcode job queue in its own process, outside the request workers.
+
+In production, the API and delivery servers run with
+``START_TRANSCODE_WORKERS=false`` and only enqueue jobs into ``JOBS_DIR``;
+this process picks them up (the queue is shared through the filesystem),
+so encodes neither share a GIL with request handling nor die with a
+recycled web worker. Several worker processes, on one or more hosts sharing
+``uploads/`` and ``JOBS_DIR``, can run side by side.
+
+Usage:
+    python transcode_worker.py
+    python transcode_worker.py --metrics-port 9100
+
+SIGTERM and SIGINT stop picking new jobs and wait for the running ones; an
+encode interrupted anyway resumes from its checkpoint when it is requeued.
+"""
+import argparse
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Started below, after the signal handlers
+os.environ["START_TRANSCODE_WORKERS"] = "false"
+
+import app  # noqa: E402
+from metrics import PROMETHEUS_CONTENT_TYPE  # noqa: E402
+from video_processor import DISPLAY_ROTATION_VERSION, ffmpeg_version  # noqa: E402
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the stage and encode metrics of this process on ``/metrics``."""
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = app.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=app.TRANSCODE_WORKERS,
+        help="Videos processed concurrently (default TRANSCODE_WORKERS)",
+    )
+    parser.add_argument("--metrics-port", type=int, help="Serve /metrics on this port")
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        help="Seconds to wait for running jobs on shutdown (default: until they finish)",
+    )
+    args = parser.parse_args()
+
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    if args.metrics_port:
+        server = ThreadingHTTPServer(("0.0.0.0", args.metrics_port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+
+    version = ffmpeg_version()
+    if version and version < DISPLAY_ROTATION_VERSION:
+        print(
+            f"ffmpeg {version[0]}.{version[1]} has no -display_rotation, "
+            "rotated sources are encoded with -noautorotate"
+        )
+
+    app.job_queue.workers = max(1, args.workers)
+    app.recover_orphaned_videos()
+    app.job_queue.start()
+    print(f"Processing jobs from {app.JOBS_DIR} with {app.job_queue.workers} workers")
+    stopping.wait()
+    print("Stopping, waiting for the running jobs")
+    app.job_queue.stop(args.drain_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,136 @@
 import json
+import math
+import re
+import shlex
+import shutil
 import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
+from functools import lru_cache
 from pathlib import Path
 from fractions import Fraction
-from ffmpeg_streaming import Formats, Bitrate, Representation, Size
+from ffmpeg_streaming import Bitrate, Representation, Size
 import ffmpeg_streaming
+from ffmpeg_streaming._command_builder import command_builder
+from ffmpeg_streaming._process import Process
+from checkpoint import PARTS_DIR, EncodeCheckpoint, encode_fingerprint
+from cpu_budget import CpuLease, run_ffmpeg, thread_args
+from dash_packaging import package_single_file, retime_segments
+from encoding_profiles import PROFILES, EncodingProfile
+from job_queue import write_json_atomic
+from per_title_ladder import measure_complexity, per_title_representations
+from previews import extract_previews, plan_previews, preview_output_args, write_sprite_vtt
+from rendition_tiers import rung_quality
+from storage import Storage
 
 
-def get_video_properties(video_path: Path):
-    """
-    Get video properties including width, height, aspect ratio, and rotation.
+PROBE_CACHE_SIZE = 128
 
-    Args:
-        video_path: Path to the video file
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
 
-    Returns:
-        dict: Video properties including width, height, aspect_ratio, rotation
+
+@dataclass(frozen=True, eq=False)
+class VideoProbe:
+    """
+    Result of a single ffprobe call (streams, format and side data) for a file.
     """
-    cmd = [
-        "ffprobe",
-        "-v",
-        "quiet",
-        "-print_format",
-        "json",
-        "-show_streams",
-        "-select_streams",
-        "v:0",
-        str(video_path),
-    ]
 
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
+    path: Path
+    streams: list
+    format: dict
+
+    @property
+    def video_stream(self) -> dict:
+        """First video stream, or None if the file has no video."""
+        return next((s for s in self.streams if s.get("codec_type") == "video"), None)
+
+    @property
+    def audio_stream(self) -> dict:
+        """First audio stream, or None if the file has no audio."""
+        return next((s for s in self.streams if s.get("codec_type") == "audio"), None)
+
+    @property
+    def has_audio(self) -> bool:
+        return self.audio_stream is not None
+
+    @property
+    def has_metadata_streams(self) -> bool:
+        """Whether the file has iPhone-style ``mebx`` data streams."""
+        return any(
+            s.get("codec_type") == "data" and s.get("codec_tag_string") == "mebx"
+            for s in self.streams
+        )
 
-        if not data.get("streams"):
+    @property
+    def duration(self) -> float:
+        """Duration in seconds, or None if unknown."""
+        duration = self.format.get("duration")
+        if not duration and self.video_stream:
+            duration = self.video_stream.get("duration")
+        return float(duration) if duration else None
+
+    @property
+    def frame_rate(self) -> float:
+        """Average frame rate of the video stream, or None if unknown."""
+        rate = (self.video_stream or {}).get("avg_frame_rate", "0/0")
+        try:
+            rate = Fraction(rate)
+        except (ValueError, ZeroDivisionError):
+            return None
+        return float(rate) or None
+
+    @property
+    def video_codec(self) -> str:
+        return self.video_stream.get("codec_name") if self.video_stream else None
+
+    @property
+    def audio_codec(self) -> str:
+        return self.audio_stream.get("codec_name") if self.audio_stream else None
+
+    @property
+    def rotation(self) -> int:
+        """Rotation from the Display Matrix side data of the video stream."""
+        for side_data in (self.video_stream or {}).get("side_data_list", []):
+            if side_data.get("side_data_type") == "Display Matrix":
+                return side_data.get("rotation", 0)
+        return 0
+
+    def summary(self) -> dict:
+        """JSON-serializable summary of the most useful properties."""
+        props = self.properties()
+        return {
+            "width": props["width"],
+            "height": props["height"],
+            "display_width": props["display_width"],
+            "display_height": props["display_height"],
+            "rotation": props["rotation"],
+            "duration": self.duration,
+            "video_codec": self.video_codec,
+            "audio_codec": self.audio_codec,
+            "has_audio": self.has_audio,
+        }
+
+    def properties(self) -> dict:
+        """
+        Video properties including width, height, aspect ratio, and rotation.
+
+        Returns:
+            dict: Video properties including width, height, aspect_ratio, rotation,
+                duration (seconds, None if unknown), frame_rate and has_audio
+        """
+        stream = self.video_stream
+        if stream is None:
             raise ValueError("No video stream found in the file")
 
-        stream = data["streams"][0]
         width = int(stream["width"])
         height = int(stream["height"])
-
-        # Check for rotation metadata
-        rotation = 0
-        if "side_data_list" in stream:
-            for side_data in stream["side_data_list"]:
-                if side_data.get("side_data_type") == "Display Matrix":
-                    rotation = side_data.get("rotation", 0)
-                    break
+        rotation = self.rotation
 
         # Apply rotation to dimensions for display aspect ratio
         if abs(rotation) == 90 or abs(rotation) == 270:
@@ -68,13 +153,80 @@ def get_video_properties(video_path: Path):
             "aspect_ratio": aspect_ratio,
             "aspect_ratio_decimal": float(aspect_ratio),
             "rotation": rotation,
+            "duration": self.duration,
+            "frame_rate": self.frame_rate,
+            "has_audio": self.has_audio,
         }
 
+
+def probe_video(video_path: Path) -> VideoProbe:
+    """
+    Probe a video file with a single ffprobe call.
+
+    Results are memoized per (path, size, mtime), so a file that changes is
+    probed again. The least recently used entries are evicted once the cache
+    holds PROBE_CACHE_SIZE entries.
+
+    Args:
+        video_path: Path to the video file
+
+    Returns:
+        VideoProbe: Streams, format and side data of the file
+    """
+    video_path = Path(video_path)
+    stat = video_path.stat()
+    key = (str(video_path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+    with _probe_cache_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return _probe_cache[key]
+
+    cmd = [
+        "ffprobe",
+        "-v",
+        "quiet",
+        "-print_format",
+        "json",
+        "-show_streams",
+        "-show_format",
+        str(video_path),
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        data = json.loads(result.stdout)
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"Failed to get video properties: {e}")
     except json.JSONDecodeError as e:
         raise RuntimeError(f"Failed to parse ffprobe output: {e}")
 
+    probe = VideoProbe(video_path, data.get("streams", []), data.get("format", {}))
+    with _probe_cache_lock:
+        _probe_cache[key] = probe
+        _probe_cache.move_to_end(key)
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return probe
+
+
+def get_video_properties(video_path: Path, probe: VideoProbe = None):
+    """
+    Get video properties including width, height, aspect ratio, and rotation.
+
+    Args:
+        video_path: Path to the video file
+        probe: Already computed probe of the file (optional)
+
+    Returns:
+        dict: Video properties including width, height, aspect_ratio, rotation,
+            duration (seconds, None if unknown) and has_audio
+    """
+    return (probe or probe_video(video_path)).properties()
+
+
+# Rung qualities of the ladder (height, or width of portrait videos)
+LADDER_QUALITIES = (2160, 1440, 1080, 720, 480, 360, 240, 144)
+
 
 def generate_representations(
     display_width: int, display_height: int, aspect_ratio: Fraction
@@ -92,9 +244,7 @@ def generate_representations(
     """
     is_portrait = display_height > display_width
     max_quality = display_width if is_portrait else display_height
-    target_qualities = [
-        q for q in [2160, 1440, 1080, 720, 480, 360, 240, 144] if q <= max_quality
-    ]
+    target_qualities = [q for q in LADDER_QUALITIES if q <= max_quality]
 
     resolutions = []
     if is_portrait:
@@ -108,16 +258,16 @@ def generate_representations(
             target_width = int(target_height * aspect_ratio)
             resolutions.append((target_width, target_height))
 
-    # (video, audio) bitrates based on resolution
+    # Video bitrates based on resolution, audio is shared (see plan_audio_bitrates)
     bitrate_map = {
-        2160: (35840, 320),
-        1440: (16384, 320),
-        1080: (8192, 320),
-        720: (5120, 320),
-        480: (2560, 192),
-        360: (1024, 128),
-        240: (700, 94),
-        144: (340, 64),
+        2160: 35840,
+        1440: 16384,
+        1080: 8192,
+        720: 5120,
+        480: 2560,
+        360: 1024,
+        240: 700,
+        144: 340,
     }
 
     representations = []
@@ -133,19 +283,72 @@ def generate_representations(
         if height % 2 != 0:
             height += 1
 
-        bitrates = bitrate_map[quality]
-
         representations.append(
-            Representation(
-                Size(width, height), Bitrate(bitrates[0] * 1024, bitrates[1] * 1024)
-            )
+            Representation(Size(width, height), Bitrate(bitrate_map[quality] * 1024, None))
         )
 
     return representations
 
 
+# Shared AAC renditions as (kbps, smallest top rung quality offering it)
+AUDIO_LADDER = ((192, 720), (128, 0), (64, 0))
+
+
+def plan_audio_bitrates(representations: list) -> list:
+    """
+    Choose the audio renditions shared by all video representations.
+
+    Audio is encoded once per bitrate into its own adaptation set instead of
+    once per video rung, so players switch video quality without touching
+    audio. Sources whose top rung is below 720p don't get the 192k rendition.
+
+    Args:
+        representations: Video representations of the ladder
+
+    Returns:
+        list: Audio bitrates in kbps, highest first
+    """
+    if not representations:
+        return []
+    top = max(min(rep.size.width, rep.size.height) for rep in representations)
+    return [bitrate for bitrate, min_quality in AUDIO_LADDER if top >= min_quality]
+
+
+def group_representations(representations: list, workers: int):
+    """
+    Split representations into groups of roughly equal encoding cost.
+
+    The cost of a rung is estimated by its pixel count, so the top rungs end up
+    alone while the small ones are packed together.
+
+    Args:
+        representations: List of Representation objects
+        workers: Maximum number of groups
+
+    Returns:
+        list: Groups as lists of indexes into representations, in ladder order
+    """
+    workers = max(1, min(workers, len(representations)))
+    groups = [[] for _ in range(workers)]
+    loads = [0] * workers
+    by_cost = sorted(
+        range(len(representations)),
+        key=lambda i: representations[i].size.width * representations[i].size.height,
+        reverse=True,
+    )
+    for index in by_cost:
+        rep = representations[index]
+        target = loads.index(min(loads))
+        groups[target].append(index)
+        loads[target] += rep.size.width * rep.size.height
+    return [sorted(group) for group in groups if group]
+
+
 def preprocess_video_if_needed(
-    input_path: Path, temp_dir: Path = None, debug: bool = False
+    input_path: Path,
+    temp_dir: Path = None,
+    debug: bool = False,
+    probe: VideoProbe = None,
 ) -> Path:
     """
     Preprocess video files that may have problematic metadata streams.
@@ -154,36 +357,16 @@ def preprocess_video_if_needed(
     Args:
         input_path: Path to the input video file
         temp_dir: Directory for temporary files (optional)
+        probe: Already computed probe of the input (optional)
 
     Returns:
         Path to the video file to use (original or cleaned)
     """
     try:
-        # Get stream information
-        result = subprocess.run(
-            [
-                "ffprobe",
-                "-v",
-                "quiet",
-                "-print_format",
-                "json",
-                "-show_streams",
-                str(input_path),
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        streams_info = json.loads(result.stdout)
+        probe = probe or probe_video(input_path)
 
         # Check if there are problematic metadata streams
-        has_metadata_streams = any(
-            stream.get("codec_type") == "data"
-            and stream.get("codec_tag_string") == "mebx"
-            for stream in streams_info["streams"]
-        )
-
-        if not has_metadata_streams:
+        if not probe.has_metadata_streams:
             return input_path
 
         # Create a temporary cleaned file
@@ -198,6 +381,7 @@ def preprocess_video_if_needed(
             clean_path = temp_dir / f"cleaned_{input_path.name}"
 
         # Copy only video and audio streams while preserving metadata
+        audio_map = ["-map", "0:a:0"] if probe.has_audio else []
         subprocess.run(
             [
                 "ffmpeg",
@@ -206,8 +390,7 @@ def preprocess_video_if_needed(
                 str(input_path),
                 "-map",
                 "0:v:0",
-                "-map",
-                "0:a:0",
+                *audio_map,
                 "-c",
                 "copy",  # Copy streams without re-encoding for speed
                 "-map_metadata",
@@ -228,8 +411,1092 @@ def preprocess_video_if_needed(
         return input_path
 
 
+FFMPEG_PROGRESS_RE = re.compile(r"(frame|fps|time|speed)=\s*(\S+)")
+
+
+def parse_ffmpeg_progress(line: str) -> dict:
+    """
+    Parse an ffmpeg statistics line (``frame= .. fps= .. time= .. speed= ..``).
+
+    Args:
+        line: Line of ffmpeg output
+
+    Returns:
+        dict: frame, fps, out_time (seconds) and speed, or None if the line has no statistics
+    """
+    fields = dict(FFMPEG_PROGRESS_RE.findall(line))
+    if "time" not in fields or "frame" not in fields:
+        return None
+    try:
+        hours, minutes, seconds = fields["time"].lstrip("-").split(":")
+        out_time = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+    def number(value, cast):
+        try:
+            return cast(value.rstrip("x"))
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "frame": number(fields.get("frame"), int),
+        "fps": number(fields.get("fps"), float),
+        "out_time": out_time,
+        "speed": number(fields.get("speed"), float),
+    }
+
+
+class EncodeProgress:
+    """
+    Aggregate the progress of the ffmpeg processes encoding one video.
+
+    Each process covers a span of the source (the whole duration for a
+    representation group, a time range for a chunk). The callback receives
+    the combined percent, frame and fps counters and the job speed as a
+    multiple of realtime, at most once per interval.
+    """
+
+    def __init__(self, callback, duration: float, interval: float = 0.5):
+        """
+        Args:
+            callback: Callable receiving a progress dict
+            duration: Source duration in seconds
+            interval: Minimum number of seconds between callbacks
+        """
+        self.callback = callback
+        self.duration = duration
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._stats = {}
+        self._started = time.monotonic()
+        self._last_report = 0.0
+
+    def monitor(self, key: str, span: float = None, offset: float = 0.0):
+        """
+        Monitor hook for ``dash.output(monitor=...)`` of one ffmpeg process.
+
+        Args:
+            key: Unique name of the process
+            span: Seconds of source the process encodes (defaults to the duration)
+            offset: Source time the process starts at
+        """
+        span = span or self.duration
+        with self._lock:
+            self._spans[key] = span
+
+        def hook(line, *_):
+            stats = parse_ffmpeg_progress(line)
+            if stats is None:
+                return
+            out_time = stats["out_time"]
+            # Output timestamps may or may not include the chunk offset
+            if offset and out_time > span:
+                out_time -= offset
+            stats["covered"] = min(max(out_time, 0.0), span)
+            self._update(key, stats)
+
+        return hook
+
+    def _update(self, key: str, stats: dict):
+        with self._lock:
+            self._stats[key] = stats
+            now = time.monotonic()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            report = self._report(now)
+        self.callback(report)
+
+    def _report(self, now: float) -> dict:
+        total = sum(self._spans.values())
+        covered = sum(s["covered"] for s in self._stats.values())
+        fraction = covered / total if total else 0.0
+        elapsed = now - self._started
+        return {
+            "percent": round(100 * fraction, 1),
+            "out_time": round(fraction * self.duration, 3),
+            "frame": sum(s["frame"] or 0 for s in self._stats.values()),
+            "fps": round(sum(s["fps"] or 0 for s in self._stats.values()), 1),
+            "speed": round(fraction * self.duration / elapsed, 2) if elapsed else None,
+            "processes": len(self._stats),
+            "elapsed": round(elapsed, 1),
+        }
+
+
+SEG_DURATION = 4
+# Minimum scene-change score (0-1) of the select filter counted as a cut
+SCENE_CUT_THRESHOLD = 0.4
+# Cuts closer than this to another keyframe don't get their own
+MIN_KEYFRAME_GAP = 0.5
+INIT_SEG_NAME = "init_$RepresentationID$.m4s"
+MEDIA_SEG_NAME = "chunk_$RepresentationID$_$Number%03d$.m4s"
+MPD_NAMESPACE = "urn:mpeg:dash:schema:mpd:2011"
+# Filters turning decoded frames upright, by the Display Matrix rotation
+# reported by ffprobe (counter-clockwise degrees)
+UPRIGHT_FILTERS = {90: "transpose=cclock", 180: "hflip,vflip", 270: "transpose=clock"}
+# First ffmpeg release with the -display_rotation input option
+DISPLAY_ROTATION_VERSION = (6, 0)
+
+
+def upright_filter(rotation: float) -> str:
+    """Filter applying a Display Matrix rotation to the frames, or None if there is none."""
+    return UPRIGHT_FILTERS.get(round(rotation or 0) % 360)
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_version() -> tuple:
+    """
+    Release of the ffmpeg binary, checked once per process.
+
+    Returns:
+        tuple: (major, minor), or None for builds without a release number
+            (git snapshots, which are newer than any release) or if ffmpeg
+            can't be run
+    """
+    try:
+        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = re.match(r"ffmpeg version n?(\d+)\.(\d+)", result.stdout)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def upright_options(rotation: float) -> tuple:
+    """
+    Options resetting the Display Matrix of a source turned upright by upright_filter.
+
+    ffmpeg 6.0 and later override the matrix on the input
+    (``-display_rotation``). Older releases don't have that option: they
+    only skip their own rotation (``-noautorotate``) and reset the matrix
+    copied to the output with the ``rotate`` metadata tag.
+
+    Args:
+        rotation: Display Matrix rotation of the source
+
+    Returns:
+        tuple: (input options, output options), both empty without rotation
+    """
+    if not upright_filter(rotation):
+        return {}, {}
+    version = ffmpeg_version()
+    if version is None or version >= DISPLAY_ROTATION_VERSION:
+        return {"display_rotation:v:0": 0}, {}
+    return {"noautorotate": None}, {"metadata:s:v": "rotate=0"}
+
+
+@dataclass(frozen=True)
+class KeyframePlan:
+    """
+    Segment duration and keyframe positions shared by every process of an encode.
+
+    Without explicit times, keyframes are forced every gop_duration seconds,
+    so every segment starts with a closed GOP. With times (scene-cut mode),
+    exactly those keyframes are forced and the manifest uses a
+    SegmentTimeline. ffmpeg then ends a segment at the first keyframe at
+    least seg_duration after the start of that segment (not of the grid),
+    so the times must be planned from the actual segment starts (see
+    plan_keyframe_times).
+    """
+
+    seg_duration: int = SEG_DURATION
+    gop_duration: float = SEG_DURATION
+    times: tuple = ()
+    frame_rate: float = None
+
+    def dash_options(self) -> dict:
+        """ffmpeg DASH output options placing the keyframes."""
+        options = {"seg_duration": self.seg_duration}
+        max_interval = self.gop_duration
+        if self.times:
+            options["force_key_frames"] = ",".join(f"{t:.3f}" for t in self.times)
+            options["use_timeline"] = 1
+            # A forced keyframe lands on the first frame at or after its time, so
+            # a segment may start up to a frame late; its planned end must still
+            # close it instead of the keyframe after
+            frame = 1 / self.frame_rate if self.frame_rate else 0.05
+            options["seg_duration"] = round(self.seg_duration - frame, 6)
+            gaps = [b - a for a, b in zip((0,) + self.times, self.times)]
+            max_interval = max(gaps + [max_interval])
+        else:
+            options["force_key_frames"] = f"expr:gte(t,n_forced*{self.gop_duration:g})"
+        if self.frame_rate:
+            # Keep the encoder from inserting keyframes of its own between forced ones
+            options["g"] = math.ceil(max_interval * self.frame_rate) + 1
+        return options
+
+
+def detect_scene_cuts(
+    input_path: Path, threshold: float = SCENE_CUT_THRESHOLD, cpu: CpuLease = None
+) -> list:
+    """
+    Find the scene cuts of a video with ffmpeg's scene-change score.
+
+    Frames are scored at 320px wide, which is enough to tell cuts apart.
+
+    Args:
+        cpu: CPU budget of the job (optional)
+
+    Returns:
+        list: Timestamps of the cuts in seconds
+    """
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        *thread_args(cpu),
+        "-i",
+        str(input_path),
+        "-map",
+        "0:v:0",
+        "-vf",
+        f"scale=320:-2,select='gt(scene,{threshold})',showinfo",
+        "-f",
+        "null",
+        "-",
+    ]
+    result = run_ffmpeg(cmd, cpu)
+    return [float(t) for t in re.findall(r"pts_time:\s*([\d.]+)", result.stderr)]
+
+
+def plan_keyframe_times(
+    duration: float,
+    gop_duration: float,
+    cuts: list,
+    tolerance: float,
+    min_gap: float = MIN_KEYFRAME_GAP,
+    seg_duration: float = None,
+) -> tuple:
+    """
+    Place keyframes on the GOP grid, moved to nearby scene cuts.
+
+    A regular keyframe moves to the first cut at most ``tolerance`` seconds
+    after it. With a SegmentTimeline, ffmpeg ends a segment at the first
+    keyframe at least seg_duration after the segment's own start, so the
+    grid restarts from the keyframe that actually started each segment:
+    every segment lasts between seg_duration and seg_duration + tolerance.
+    On a fixed grid, one late keyframe would leave the next grid keyframe
+    too early to end the following segment, which would run on to the one
+    after, up to twice its duration. Cuts far from any keyframe get one of
+    their own inside the segment; min_gap keeps them clear of the segment
+    ends, so they never end a segment early.
+
+    Args:
+        duration: Source duration in seconds
+        gop_duration: Seconds between regular keyframes
+        cuts: Scene cut timestamps in seconds
+        tolerance: Maximum forward shift of a regular keyframe
+        min_gap: Cuts closer than this to a keyframe are not added
+        seg_duration: DASH segment duration, a multiple of gop_duration
+            (defaults to gop_duration)
+
+    Returns:
+        tuple: Sorted keyframe timestamps after the first frame
+    """
+    cuts = sorted(cuts)
+    gops_per_segment = max(1, round((seg_duration or gop_duration) / gop_duration))
+    times = []
+    start = 0.0
+    while True:
+        for i in range(1, gops_per_segment + 1):
+            nominal = start + i * gop_duration
+            if nominal >= duration:
+                break
+            times.append(next((c for c in cuts if nominal <= c <= nominal + tolerance), nominal))
+        else:
+            start = times[-1]
+            continue
+        break
+    for cut in cuts:
+        if cut >= min_gap and all(abs(cut - t) >= min_gap for t in times):
+            times.append(cut)
+    return tuple(sorted(times))
+
+
+def _dash_output(
+    input_path: Path,
+    representations: list,
+    input_options: dict = None,
+    profile: EncodingProfile = None,
+    audio: bool = False,
+    keyframes: KeyframePlan = None,
+    rotation: float = 0,
+    **options,
+):
+    """
+    Build a DASH output with the settings shared by all encode modes.
+
+    Every representation only maps the first video stream. With ``audio``,
+    the manifest gets an audio adaptation set for the renditions that
+    _run_dash adds to the command. Keyframes only come from the plan, so
+    segments of every rung and process start at the same closed GOP.
+
+    A rotated source is turned upright by a transpose in the filter of every
+    rung, before its scale, and its Display Matrix is reset (see
+    upright_options), so the renditions are stored upright without one and
+    players don't rotate them a second time.
+    """
+    profile = profile or PROFILES["default"]
+    keyframes = keyframes or KeyframePlan(profile.seg_duration, profile.gop)
+    transpose = upright_filter(rotation)
+    video_reps = []
+    for i, rep in enumerate(representations):
+        rep_options = {**rep.options, "map": "0:v:0"}
+        if transpose:
+            rep_options[f"filter:v:{i}"] = transpose
+        video_reps.append(Representation(rep.size, Bitrate(rep.bitrate.video_, None), **rep_options))
+    upright_input, upright_output = upright_options(rotation)
+    pre_opts = {"y": None, **upright_input}
+    pre_opts.update(input_options or {})
+    video = ffmpeg_streaming.input(str(input_path), pre_opts=pre_opts)
+    dash_options = {
+        "use_template": 1,
+        "use_timeline": 0,
+        "init_seg_name": INIT_SEG_NAME,
+        "media_seg_name": MEDIA_SEG_NAME,
+        "adaptation_sets": "id=0,streams=v id=1,streams=a" if audio else "id=0,streams=v",
+    }
+    dash_options.update(keyframes.dash_options())
+    dash_options.update(profile.keyframe_options())
+    dash_options.update(profile.output_options())
+    dash_options.update(upright_output)
+    dash_options.update(options)
+    dash = video.dash(profile.format(), **dash_options)
+    # ffmpeg_streaming reads the input through a shallow copy when it builds
+    # the media, which pops pre_opts from the shared options: put them back
+    # for the command, or -ss, -t and the rotation reset are silently dropped
+    video.inputs[0].options["pre_opts"] = pre_opts
+    dash.representations(*video_reps)
+    return dash
+
+
+def _audio_output_args(bitrates: list) -> list:
+    """ffmpeg arguments adding one AAC stream per bitrate from the first audio track."""
+    args = []
+    for _ in bitrates:
+        args += ["-map", "0:a:0"]
+    for i, bitrate in enumerate(bitrates):
+        args += [f"-b:a:{i}", f"{bitrate}k"]
+    return args
+
+
+def _encoder_thread_args(representations: list, threads: int) -> list:
+    """ffmpeg arguments splitting a process's threads between its rungs by pixel count."""
+    pixels = [rep.size.width * rep.size.height for rep in representations]
+    total = sum(pixels)
+    args = []
+    for i, count in enumerate(pixels):
+        args += [f"-threads:v:{i}", str(max(1, round(threads * count / total)))]
+    return args
+
+
+def _run_dash(
+    dash,
+    output_file: Path,
+    monitor=None,
+    extra_outputs: list = None,
+    audio_bitrates: list = None,
+    cpu: CpuLease = None,
+    share: float = 1.0,
+):
+    """
+    Run a DASH encode, optionally with more outputs fed by the same decode.
+
+    ffmpeg decodes the input once and feeds every output of the command, so
+    extra outputs appended after the manifest (e.g. preview images) cost
+    their own filtering and encoding but no extra decode.
+
+    Args:
+        dash: DASH output built by _dash_output
+        output_file: Path of the ``video.mpd``
+        monitor: Optional ffmpeg_streaming monitor hook
+        extra_outputs: ffmpeg arguments of additional outputs (optional)
+        audio_bitrates: Audio renditions in kbps added to the DASH output,
+            which must have been built with ``audio=True`` (optional)
+        cpu: CPU budget of the job (optional); the process gets ``share`` of
+            its threads and is kept on the job's CPUs
+        share: Fraction of the job's work done by this process
+    """
+    if not extra_outputs and not audio_bitrates and cpu is None:
+        dash.output(str(output_file), monitor=monitor)
+        return
+    dash.output(str(output_file), run_command=False)
+    args = shlex.split(command_builder("ffmpeg", dash))
+    # The library ends the DASH output with "-strict -2 <manifest>"
+    args[-3:-3] = _audio_output_args(audio_bitrates or [])
+    if cpu:
+        threads = cpu.share(share)
+        args[-3:-3] = _encoder_thread_args(dash.reps, threads)
+        # Decoding and scaling take a fraction of the encoders' work
+        helpers = str(max(1, threads // 4))
+        args[1:1] = ["-threads", helpers, "-filter_threads", helpers]
+    command = shlex.join(args + (extra_outputs or []))
+    with Process(dash, command, monitor) as process:
+        if cpu:
+            cpu.attach(process.process.pid)
+        try:
+            process.run()
+        finally:
+            if cpu:
+                cpu.detach(process.process.pid)
+
+
+def _segment_files(part_dir: Path, representation_id: str):
+    """List the init and media segment files of one representation."""
+    init = part_dir / INIT_SEG_NAME.replace("$RepresentationID$", representation_id)
+    media_prefix = MEDIA_SEG_NAME.split("$Number")[0].replace(
+        "$RepresentationID$", representation_id
+    )
+    # Numeric order, names only have 3 digits of padding
+    return [init] + sorted(part_dir.glob(f"{media_prefix}*.m4s"), key=_segment_number)
+
+
+def _segment_number(path: Path) -> int:
+    return int(path.stem.rsplit("_", 1)[1])
+
+
+def merge_dash_manifests(part_dirs: list, output_file: Path):
+    """
+    Merge the manifests of separately encoded representation groups.
+
+    Representations are renumbered (video first, then audio, highest bandwidth
+    first) and their segment files are moved next to the merged manifest.
+
+    Args:
+        part_dirs: Directories holding one ``video.mpd`` each
+        output_file: Path of the merged manifest
+    """
+    ET.register_namespace("", MPD_NAMESPACE)
+    ns = {"mpd": MPD_NAMESPACE}
+
+    base_tree = None
+    base_sets = {}
+    collected = {}
+    for part_dir in part_dirs:
+        tree = ET.parse(part_dir / "video.mpd")
+        if base_tree is None:
+            base_tree = tree
+        base_period = base_tree.getroot().find("mpd:Period", ns)
+        for adaptation_set in tree.getroot().find("mpd:Period", ns).findall(
+            "mpd:AdaptationSet", ns
+        ):
+            content_type = adaptation_set.get("contentType")
+            if content_type not in base_sets:
+                if tree is not base_tree:
+                    base_period.append(adaptation_set)
+                base_sets[content_type] = adaptation_set
+            target = base_sets[content_type]
+            for attr in ("maxWidth", "maxHeight"):
+                if adaptation_set.get(attr) and target.get(attr):
+                    largest = max(int(target.get(attr)), int(adaptation_set.get(attr)))
+                    target.set(attr, str(largest))
+            for rep in adaptation_set.findall("mpd:Representation", ns):
+                adaptation_set.remove(rep)
+                collected.setdefault(content_type, []).append((part_dir, rep))
+
+    order = {"video": 0, "audio": 1}
+    new_id = 0
+    for content_type in sorted(collected, key=lambda c: order.get(c, 2)):
+        reps = sorted(
+            collected[content_type],
+            key=lambda item: int(item[1].get("bandwidth", 0)),
+            reverse=True,
+        )
+        for part_dir, rep in reps:
+            old_id = rep.get("id")
+            for path in _segment_files(part_dir, old_id):
+                new_name = _rename_segment(path.name, old_id, str(new_id))
+                shutil.move(str(path), str(output_file.parent / new_name))
+            rep.set("id", str(new_id))
+            base_sets[content_type].append(rep)
+            new_id += 1
+
+    ET.indent(base_tree, space="\t")
+    # Players never load a partially written manifest
+    tmp_file = output_file.with_name(f".{output_file.name}.tmp")
+    base_tree.write(tmp_file, xml_declaration=True, encoding="utf-8")
+    tmp_file.replace(output_file)
+
+
+def publish_rendition(rendition_dir: Path, output_file: Path):
+    """
+    Publish the manifest of a rendition stored in a subdirectory.
+
+    The manifest is copied next to the video's other files with a BaseURL
+    pointing into the subdirectory, and atomically replaces the current one,
+    so players switch to the new rendition on their next manifest load while
+    the old segments stay available.
+
+    Args:
+        rendition_dir: Directory holding the rendition's ``video.mpd`` and segments
+        output_file: Path of the published ``video.mpd``
+    """
+    ET.register_namespace("", MPD_NAMESPACE)
+    tree = ET.parse(rendition_dir / "video.mpd")
+    root = tree.getroot()
+    base_url = ET.Element(f"{{{MPD_NAMESPACE}}}BaseURL")
+    base_url.text = f"{rendition_dir.name}/"
+    first_period = next(
+        i for i, child in enumerate(root) if child.tag == f"{{{MPD_NAMESPACE}}}Period"
+    )
+    root.insert(first_period, base_url)
+    ET.indent(tree, space="\t")
+    tmp_file = output_file.with_name(f".{output_file.name}.tmp")
+    tree.write(tmp_file, xml_declaration=True, encoding="utf-8")
+    tmp_file.replace(output_file)
+
+
+def _rename_segment(name: str, old_id: str, new_id: str) -> str:
+    if name == INIT_SEG_NAME.replace("$RepresentationID$", old_id):
+        return INIT_SEG_NAME.replace("$RepresentationID$", new_id)
+    media_prefix = MEDIA_SEG_NAME.split("$Number")[0]
+    old_prefix = media_prefix.replace("$RepresentationID$", old_id)
+    return media_prefix.replace("$RepresentationID$", new_id) + name[len(old_prefix) :]
+
+
+def _set_presentation_duration(tree: ET.ElementTree, duration: float):
+    """Set the duration of a single-period manifest."""
+    total = f"PT{duration:.3f}S"
+    tree.getroot().set("mediaPresentationDuration", total)
+    period = tree.getroot().find(f"{{{MPD_NAMESPACE}}}Period")
+    if period.get("duration"):
+        period.set("duration", total)
+
+
+def _complete_segments(part_dir: Path, rep_ids: list) -> dict:
+    """
+    Count the complete media segments of each representation of a part.
+
+    Only consecutive segments from the first one count, and none without the
+    init segment. ffmpeg writes segments under ``.tmp`` names and renames
+    them once complete, so a partially written segment never counts.
+
+    Returns:
+        dict: Number of complete segments by representation id
+    """
+    counts = {}
+    for rep_id in rep_ids:
+        init, *media = _segment_files(part_dir, rep_id)
+        numbers = {_segment_number(path) for path in media}
+        count = 0
+        while init.exists() and count + 1 in numbers:
+            count += 1
+        counts[rep_id] = count
+    return counts
+
+
+def _truncate_part(part_dir: Path, rep_ids: list, count: int):
+    """Delete every file of a part but the init and first count media segments."""
+    keep = set()
+    for rep_id in rep_ids:
+        init, *media = _segment_files(part_dir, rep_id)
+        keep.add(init)
+        keep.update(path for path in media if _segment_number(path) <= count)
+    for path in part_dir.iterdir():
+        if path.is_file() and path not in keep:
+            path.unlink()
+
+
+def _append_segments(
+    part_dir: Path, source_dir: Path, rep_ids: list, offset: int, start: float, count: int = None
+):
+    """
+    Move media segments of source_dir into part_dir, numbered after offset.
+
+    ffmpeg starts every output at decode time 0, so the moved segments are
+    first retimed to the time they cover in part_dir (see retime_segments).
+
+    Args:
+        start: Time of the first moved segment on the timeline of part_dir,
+            in seconds
+        count: Number of segments moved per representation (all by default)
+    """
+    media_prefix = MEDIA_SEG_NAME.split("$Number")[0]
+    for rep_id in rep_ids:
+        prefix = media_prefix.replace("$RepresentationID$", rep_id)
+        init = part_dir / INIT_SEG_NAME.replace("$RepresentationID$", rep_id)
+        media = _segment_files(source_dir, rep_id)[1:]
+        retime_segments(init, media[:count], start)
+        for number, segment in enumerate(media[:count], start=offset + 1):
+            shutil.move(str(segment), str(part_dir / f"{prefix}{number:03d}.m4s"))
+
+
+def _part_monitor(progress, checkpoint, key: str, span: float, offset: float, scan):
+    """Monitor hook reporting the progress of a part and checkpointing its segments."""
+    hook = progress.monitor(key, span=span, offset=offset) if progress else None
+    if checkpoint is None:
+        return hook
+
+    def monitor(line, *args):
+        if hook:
+            hook(line, *args)
+        checkpoint.update(key, scan)
+
+    return monitor
+
+
+@contextmanager
+def _working_dir(path: Path, keep_on_error: bool):
+    """Remove a working directory when done, and on errors unless it is checkpointed."""
+    try:
+        yield path
+    except BaseException:
+        if not keep_on_error:
+            shutil.rmtree(path, ignore_errors=True)
+        raise
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _encode_part(
+    input_path: Path,
+    part_dir: Path,
+    representations: list,
+    duration: float = None,
+    start: float = 0.0,
+    length: float = None,
+    profile: EncodingProfile = None,
+    keyframes: KeyframePlan = None,
+    audio_bitrates: list = None,
+    extra_outputs: list = None,
+    progress: EncodeProgress = None,
+    checkpoint: EncodeCheckpoint = None,
+    cpu: CpuLease = None,
+    share: float = 1.0,
+    rotation: float = 0,
+) -> bool:
+    """
+    Encode representations over a time range of the source in one ffmpeg process.
+
+    With a checkpoint, a part finished by a previous attempt is kept, and an
+    interrupted one resumes at the end of the last segment that is complete
+    for every representation: the remaining time range is encoded into
+    ``resume/``, and its segments are renumbered after the kept ones and
+    retimed to the resume point. A resumed part only has video, since
+    the audio and the extra outputs need the whole source. Keyframe plans
+    with explicit times are not resumed, their segments don't start on
+    multiples of the segment duration.
+
+    Args:
+        input_path: Path to input video file
+        part_dir: Directory of the part's manifest and segments
+        representations: Video representations of the part
+        duration: Source duration in seconds (None if unknown)
+        start: Source time the part starts at
+        length: Seconds of source encoded (None until the end)
+        profile: Encoding profile (optional, defaults to "default")
+        keyframes: Keyframe plan (optional, defaults to the profile's grid)
+        audio_bitrates: Shared audio renditions in kbps added to the part (optional)
+        extra_outputs: ffmpeg arguments of additional outputs (optional)
+        progress: Optional progress aggregator
+        checkpoint: Checkpoint of the encode (optional, no resume without)
+        cpu: CPU budget of the job (optional)
+        share: Fraction of the job's work done by this part
+        rotation: Display Matrix rotation of the source, applied to the frames
+
+    Returns:
+        bool: Whether the part was resumed, so it lacks its audio and extra outputs
+    """
+    profile = profile or PROFILES["default"]
+    keyframes = keyframes or KeyframePlan(profile.seg_duration, profile.gop)
+    key = part_dir.name
+    rep_ids = [str(i) for i in range(len(representations))]
+    span = length if length is not None else (duration - start if duration else None)
+    state = checkpoint.part(key) if checkpoint else {}
+    if state.get("done") and (part_dir / "video.mpd").exists():
+        return bool(state.get("resumed_from"))
+
+    completed = 0
+    resume_dir = part_dir / "resume"
+    if checkpoint is not None and not keyframes.times and part_dir.is_dir():
+        completed = min(_complete_segments(part_dir, rep_ids).values(), default=0)
+        if completed and completed == state.get("resumed_from") and resume_dir.is_dir():
+            # Segments of an interrupted resume continue the kept ones
+            _truncate_part(part_dir, rep_ids, completed)
+            resumed = min(_complete_segments(resume_dir, rep_ids).values(), default=0)
+            _append_segments(
+                part_dir, resume_dir, rep_ids, completed, completed * keyframes.seg_duration, resumed
+            )
+            completed += resumed
+        if span:
+            # The last segment ends with the source, only a finished process completes it
+            completed = min(completed, math.ceil(span / keyframes.seg_duration) - 1)
+    shutil.rmtree(resume_dir, ignore_errors=True)
+
+    if completed <= 0:
+        shutil.rmtree(part_dir, ignore_errors=True)
+        part_dir.mkdir(parents=True)
+        input_options = None
+        if start or length is not None:
+            input_options = {"ss": start}
+            if length is not None:
+                input_options["t"] = length
+        dash = _dash_output(
+            input_path,
+            representations,
+            input_options=input_options,
+            profile=profile,
+            audio=bool(audio_bitrates),
+            keyframes=keyframes,
+            rotation=rotation,
+        )
+        monitor = _part_monitor(
+            progress, checkpoint, key, span, start, lambda: _complete_segments(part_dir, rep_ids)
+        )
+        _run_dash(
+            dash,
+            part_dir / "video.mpd",
+            monitor=monitor,
+            extra_outputs=extra_outputs,
+            audio_bitrates=audio_bitrates,
+            cpu=cpu,
+            share=share,
+        )
+        if checkpoint:
+            checkpoint.finish(key, _complete_segments(part_dir, rep_ids))
+        return False
+
+    resume_at = completed * keyframes.seg_duration
+    _truncate_part(part_dir, rep_ids, completed)
+    checkpoint.update(key, lambda: {r: completed for r in rep_ids}, force=True, resumed_from=completed)
+    resume_dir.mkdir()
+    input_options = {"ss": start + resume_at}
+    if length is not None:
+        input_options["t"] = length - resume_at
+    dash = _dash_output(
+        input_path,
+        representations,
+        input_options=input_options,
+        profile=profile,
+        keyframes=keyframes,
+        rotation=rotation,
+    )
+    monitor = _part_monitor(
+        progress,
+        checkpoint,
+        key,
+        span - resume_at if span else None,
+        start + resume_at,
+        lambda: {r: completed + n for r, n in _complete_segments(resume_dir, rep_ids).items()},
+    )
+    _run_dash(dash, resume_dir / "video.mpd", monitor=monitor, cpu=cpu, share=share)
+
+    _append_segments(part_dir, resume_dir, rep_ids, completed, resume_at)
+    # The resumed manifest describes the whole part once its start is reset
+    ET.register_namespace("", MPD_NAMESPACE)
+    tree = ET.parse(resume_dir / "video.mpd")
+    for template in tree.getroot().iter(f"{{{MPD_NAMESPACE}}}SegmentTemplate"):
+        template.attrib.pop("presentationTimeOffset", None)
+        template.set("startNumber", "1")
+    if span:
+        _set_presentation_duration(tree, span)
+    tree.write(part_dir / "video.mpd", xml_declaration=True, encoding="utf-8")
+    shutil.rmtree(resume_dir)
+    checkpoint.finish(key, _complete_segments(part_dir, rep_ids), resumed_from=completed)
+    return True
+
+
+def encode_dash_parallel(
+    input_path: Path,
+    output_file: Path,
+    representations: list,
+    workers: int,
+    progress: EncodeProgress = None,
+    extra_outputs: list = None,
+    profile: EncodingProfile = None,
+    audio_bitrates: list = None,
+    keyframes: KeyframePlan = None,
+    duration: float = None,
+    checkpoint: EncodeCheckpoint = None,
+    cpu: CpuLease = None,
+    rotation: float = 0,
+):
+    """
+    Encode groups of representations in separate ffmpeg processes and merge them.
+
+    Every process uses the same keyframe plan with encoder scene-cut
+    keyframes disabled, so segment boundaries line up across all rungs. The
+    shared audio renditions are encoded by the first group only, or by a
+    process of their own when the first group resumed from a checkpoint.
+
+    Args:
+        input_path: Path to input video file
+        output_file: Path of the merged ``video.mpd``
+        representations: List of Representation objects
+        workers: Maximum number of concurrent ffmpeg processes
+        progress: Optional progress aggregator
+        extra_outputs: ffmpeg arguments of additional outputs, added to the
+            process of the first group (optional, not written when that
+            group resumed)
+        profile: Encoding profile (optional, defaults to "default")
+        audio_bitrates: Shared audio renditions in kbps (optional, none
+            for silent sources)
+        keyframes: Keyframe plan (optional, defaults to the profile's grid)
+        duration: Source duration in seconds (optional)
+        checkpoint: Checkpoint resuming the groups of an interrupted attempt
+            (optional, the working directory is removed on errors without)
+        cpu: CPU budget of the job, split between the groups by pixel count
+            (optional)
+        rotation: Display Matrix rotation of the source, applied to the frames
+
+    Returns:
+        list: The representation index groups that were encoded
+    """
+    profile = profile or PROFILES["default"]
+    keyframes = keyframes or KeyframePlan(profile.seg_duration, profile.gop)
+    groups = group_representations(representations, workers)
+    parts_root = output_file.parent / PARTS_DIR
+    part_dirs = [parts_root / f"group_{i}" for i in range(len(groups))]
+    total_pixels = sum(rep.size.width * rep.size.height for rep in representations)
+
+    def encode_group(args):
+        group, part_dir = args
+        first = part_dir == part_dirs[0]
+        pixels = sum(representations[i].size.width * representations[i].size.height for i in group)
+        return _encode_part(
+            input_path,
+            part_dir,
+            [representations[i] for i in group],
+            duration=duration,
+            profile=profile,
+            keyframes=keyframes,
+            audio_bitrates=audio_bitrates if first else None,
+            extra_outputs=extra_outputs if first else None,
+            progress=progress,
+            checkpoint=checkpoint,
+            cpu=cpu,
+            share=pixels / total_pixels,
+            rotation=rotation,
+        )
+
+    with _working_dir(parts_root, keep_on_error=checkpoint is not None):
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            # Each thread drives its own ffmpeg process
+            resumed = list(pool.map(encode_group, zip(groups, part_dirs)))
+        if audio_bitrates and resumed[0]:
+            part_dirs.append(parts_root / "audio")
+            _encode_dash_audio(
+                input_path, part_dirs[-1], audio_bitrates, keyframes.seg_duration, checkpoint, cpu
+            )
+        if checkpoint:
+            checkpoint.assemble()
+        merge_dash_manifests(part_dirs, output_file)
+
+    return groups
+
+
+def plan_chunks(duration: float, chunks: int, seg_duration: int = SEG_DURATION):
+    """
+    Split a duration into time chunks that start on segment boundaries.
+
+    Every chunk but the last is a whole number of segments long, so forced
+    keyframes and segment numbering continue seamlessly across chunks.
+
+    Args:
+        duration: Source duration in seconds
+        chunks: Requested number of chunks
+        seg_duration: DASH segment duration in seconds
+
+    Returns:
+        list: (start, length) tuples in seconds, the last length is None (until the end)
+    """
+    total_segments = max(1, math.ceil(duration / seg_duration))
+    chunks = max(1, min(chunks, total_segments))
+    segments_per_chunk = math.ceil(total_segments / chunks)
+    plan = []
+    for start_segment in range(0, total_segments, segments_per_chunk):
+        start = start_segment * seg_duration
+        length = segments_per_chunk * seg_duration
+        plan.append((start, length if start + length < duration else None))
+    return plan
+
+
+def _encode_dash_audio(
+    input_path: Path,
+    part_dir: Path,
+    bitrates: list,
+    seg_duration: int = SEG_DURATION,
+    checkpoint: EncodeCheckpoint = None,
+    cpu: CpuLease = None,
+):
+    """Encode the audio track once for the whole source as a DASH output."""
+    if checkpoint and checkpoint.part(part_dir.name).get("done") and (part_dir / "video.mpd").exists():
+        return  # Encoded by a previous attempt
+    shutil.rmtree(part_dir, ignore_errors=True)
+    part_dir.mkdir(parents=True)
+    cmd = ["ffmpeg", "-y", "-i", str(input_path), *_audio_output_args(bitrates), "-c:a", "aac"]
+    cmd += [
+        "-f",
+        "dash",
+        "-seg_duration",
+        str(seg_duration),
+        "-use_template",
+        "1",
+        "-use_timeline",
+        "0",
+        "-init_seg_name",
+        INIT_SEG_NAME,
+        "-media_seg_name",
+        MEDIA_SEG_NAME,
+        "-adaptation_sets",
+        "id=0,streams=a",
+        str(part_dir / "video.mpd"),
+    ]
+    run_ffmpeg(cmd, cpu)
+    if checkpoint:
+        checkpoint.finish(part_dir.name, {})
+
+
+def _stitch_chunks(chunk_dirs: list, starts: list, part_dir: Path, duration: float):
+    """
+    Join the video segments of consecutive chunks into one continuous part.
+
+    Init segments and the manifest come from the first chunk, media segments
+    of later chunks are renumbered to follow the previous chunk and moved to
+    their start time in the source.
+    """
+    part_dir.mkdir(parents=True, exist_ok=True)
+    ET.register_namespace("", MPD_NAMESPACE)
+    tree = ET.parse(chunk_dirs[0] / "video.mpd")
+    rep_ids = [rep.get("id") for rep in tree.getroot().iter(f"{{{MPD_NAMESPACE}}}Representation")]
+
+    for rep_id in rep_ids:
+        init_name = INIT_SEG_NAME.replace("$RepresentationID$", rep_id)
+        shutil.move(str(chunk_dirs[0] / init_name), str(part_dir / init_name))
+    number = 0
+    for chunk_dir, start in zip(chunk_dirs, starts):
+        _append_segments(part_dir, chunk_dir, rep_ids, number, start)
+        number = min(_complete_segments(part_dir, rep_ids).values())
+
+    # The first chunk's manifest only covers its own duration
+    _set_presentation_duration(tree, duration)
+    tree.write(part_dir / "video.mpd", xml_declaration=True, encoding="utf-8")
+
+
+def encode_dash_chunked(
+    input_path: Path,
+    output_file: Path,
+    representations: list,
+    duration: float,
+    chunks: int,
+    audio_bitrates: list = None,
+    progress: EncodeProgress = None,
+    profile: EncodingProfile = None,
+    keyframes: KeyframePlan = None,
+    checkpoint: EncodeCheckpoint = None,
+    cpu: CpuLease = None,
+    rotation: float = 0,
+):
+    """
+    Encode time chunks of the source concurrently and stitch them together.
+
+    Each chunk encodes the whole video ladder for its time range in its own
+    ffmpeg process, and its segments are retimed to the chunk start so the
+    stitched segments form one continuous timeline. Audio is encoded once for
+    the full duration to avoid encoder priming gaps at chunk boundaries.
+
+    Args:
+        input_path: Path to input video file
+        output_file: Path of the final ``video.mpd``
+        representations: List of Representation objects
+        duration: Source duration in seconds
+        chunks: Number of time chunks to encode concurrently
+        audio_bitrates: Shared audio renditions in kbps (optional, none
+            for silent sources)
+        progress: Optional progress aggregator
+        profile: Encoding profile (optional, defaults to "default")
+        keyframes: Keyframe plan on the regular GOP grid (optional, defaults
+            to the profile's); explicit keyframe times are not supported
+        checkpoint: Checkpoint resuming the chunks of an interrupted attempt
+            (optional, the working directory is removed on errors without)
+        cpu: CPU budget of the job, split evenly between the chunks (optional)
+        rotation: Display Matrix rotation of the source, applied to the frames
+
+    Returns:
+        list: The (start, length) chunk plan that was encoded
+    """
+    profile = profile or PROFILES["default"]
+    keyframes = keyframes or KeyframePlan(profile.seg_duration, profile.gop)
+    plan = plan_chunks(duration, chunks, keyframes.seg_duration)
+    parts_root = output_file.parent / PARTS_DIR
+    chunk_dirs = [parts_root / f"chunk_{i}" for i in range(len(plan))]
+
+    def encode_chunk(args):
+        (start, length), chunk_dir = args
+        _encode_part(
+            input_path,
+            chunk_dir,
+            representations,
+            duration=duration,
+            start=start,
+            length=length,
+            profile=profile,
+            keyframes=keyframes,
+            progress=progress,
+            checkpoint=checkpoint,
+            cpu=cpu,
+            share=1 / len(plan),
+            rotation=rotation,
+        )
+
+    with _working_dir(parts_root, keep_on_error=checkpoint is not None):
+        # Each thread drives its own ffmpeg process
+        with ThreadPoolExecutor(max_workers=len(plan) + 1) as pool:
+            futures = [pool.submit(encode_chunk, item) for item in zip(plan, chunk_dirs)]
+            if audio_bitrates:
+                futures.append(
+                    pool.submit(
+                        _encode_dash_audio,
+                        input_path,
+                        parts_root / "audio",
+                        audio_bitrates,
+                        keyframes.seg_duration,
+                        checkpoint,
+                        cpu,
+                    )
+                )
+            for future in futures:
+                future.result()
+
+        if checkpoint:
+            checkpoint.assemble()
+        _stitch_chunks(chunk_dirs, [start for start, _ in plan], parts_root / "video", duration)
+        part_dirs = [parts_root / "video"]
+        if audio_bitrates:
+            part_dirs.append(parts_root / "audio")
+        merge_dash_manifests(part_dirs, output_file)
+
+    return plan
+
+
+def _stage(timeline, name: str, **attributes):
+    """Span of a stage on the timeline, or a no-op without a timeline."""
+    if timeline is None:
+        return nullcontext({})
+    return timeline.span(name, **attributes)
+
+
 def create_dash_stream(
-    input_path: Path, output_dir: Path, log_path: Path = None, debug: bool = False
+    input_path: Path,
+    output_dir: Path,
+    log_path: Path = None,
+    debug: bool = False,
+    parallel_workers: int = 1,
+    chunks: int = 1,
+    probe: VideoProbe = None,
+    progress=None,
+    progressive: bool = False,
+    per_title: bool = False,
+    previews: bool = False,
+    timeline=None,
+    profile: EncodingProfile = None,
+    cpu: CpuLease = None,
+    single_file: bool = False,
+    min_quality: int = None,
+    max_quality: int = None,
+    audio: bool = True,
+    storage: Storage = None,
+    storage_prefix: str = "",
 ):
     """
     Create DASH streaming files from input video.
@@ -239,13 +1506,58 @@ def create_dash_stream(
         input_path: Path to input video file
         output_dir: Directory to save DASH files
         log_path: Optional path to log file
+        parallel_workers: Encode representation groups in up to this many
+            concurrent ffmpeg processes (1 keeps a single process)
+        chunks: Split the source into this many time chunks encoded
+            concurrently (takes precedence over parallel_workers)
+        probe: Already computed probe of the input (optional)
+        progress: Optional callable receiving encode progress dicts (percent,
+            out_time, frame, fps, speed)
+        progressive: Publish a dynamic SegmentTimeline manifest that grows as
+            segments complete and turns static when encoding finishes, so the
+            video can be watched while it is transcoded (single ffmpeg process,
+            takes precedence over chunks and parallel_workers)
+        per_title: Fit the number of rungs and their bitrates to the content
+            complexity measured with CRF probe encodes (report in ladder.json)
+        previews: Also write the poster thumbnail, seek-preview sprite sheets
+            and their WebVTT track, from the same decode as the ladder
+        timeline: Optional metrics.Timeline receiving the preprocess, encode
+            and cleanup spans
+        profile: Encoding profile (codec, preset and bitrate scale), defaults
+            to "default"
+        cpu: CPU budget of the job from a cpu_budget.CpuScheduler (optional).
+            Every ffmpeg process gets explicit thread counts from it instead
+            of sizing its thread pools for the whole machine
+        single_file: Repackage every representation into one fragmented MP4
+            with a ``sidx``, referenced by a SegmentBase manifest and fetched
+            with byte-range requests (see dash_packaging.package_single_file)
+        min_quality: Only encode the rungs of at least this quality (height,
+            or width of portrait videos), e.g. the on-demand tier of a ladder
+        max_quality: Only encode the rungs of at most this quality
+        audio: Encode the shared audio renditions (if the source has audio)
+        storage: Storage backend receiving the segments, previews and
+            manifest once complete, segments several at a time and the
+            manifest last (see storage.Storage.upload_dir)
+        storage_prefix: Key of output_dir in the storage, ending with ``/``
+
+    Encodes other than progressive ones run in the ``parts/`` working
+    directory and are checkpointed in ``checkpoint.json``, so after a crash or
+    restart, a call with the same input and settings resumes where the
+    interrupted one stopped. Segments and the manifest only appear in
+    output_dir once the whole encode is complete.
     """
     try:
+        probe = probe or probe_video(input_path)
+        tracker = None
+        if progress and probe.duration:
+            tracker = EncodeProgress(progress, probe.duration)
+
         # Preprocess the video if needed to handle metadata streams
-        processed_input = preprocess_video_if_needed(input_path, debug=debug)
+        with _stage(timeline, "preprocess", needed=probe.has_metadata_streams):
+            processed_input = preprocess_video_if_needed(input_path, debug=debug, probe=probe)
 
-        # Get video properties
-        video_props = get_video_properties(processed_input)
+        # Get video properties (stream copy keeps them identical to the original)
+        video_props = get_video_properties(processed_input, probe=probe)
 
         # Generate representations that maintain the display aspect ratio
         representations = generate_representations(
@@ -254,6 +1566,46 @@ def create_dash_stream(
             video_props["aspect_ratio"],
         )
 
+        if per_title and representations and video_props["duration"]:
+            try:
+                with _stage(timeline, "complexity"):
+                    complexity = measure_complexity(
+                        processed_input,
+                        video_props["duration"],
+                        video_props["display_width"],
+                        video_props["display_height"],
+                        cpu=cpu,
+                    )
+                representations, ladder_report = per_title_representations(
+                    representations, complexity, video_props["duration"]
+                )
+                write_json_atomic(output_dir / "ladder.json", ladder_report)
+                if log_path:
+                    with open(log_path, "a") as logf:
+                        logf.write(
+                            f"Per-title ladder: complexity {ladder_report['complexity_bps'] // 1024}k, "
+                            f"{len(representations)} rungs, "
+                            f"{ladder_report.get('estimated_bytes_saved', 0) / 1e6:.1f} MB saved vs static ladder\n"
+                        )
+            except subprocess.CalledProcessError as e:
+                if log_path:
+                    with open(log_path, "a") as logf:
+                        logf.write(f"Per-title analysis failed, using static ladder: {e}\n")
+
+        profile = profile or PROFILES["default"]
+        representations = profile.scale_representations(representations)
+        # Audio is planned for the whole ladder, whichever rungs are encoded now
+        ladder = representations
+        if min_quality or max_quality:
+            representations = [
+                rep
+                for rep in representations
+                if rung_quality(rep) >= (min_quality or 0)
+                and rung_quality(rep) <= (max_quality or rung_quality(rep))
+            ]
+            if not representations:
+                raise ValueError(f"No rungs between {min_quality}p and {max_quality}p")
+
         # Create DASH stream from the (possibly cleaned) input
         if log_path:
             with open(log_path, "a") as logf:
@@ -261,58 +1613,233 @@ def create_dash_stream(
                 logf.write(f"Input: {processed_input}\n")
                 logf.write(f"Video properties: {video_props}\n")
                 logf.write(f"Generated {len(representations)} representations\n")
+                logf.write(f"Encoding profile: {profile.summary()}\n")
 
-        video = ffmpeg_streaming.input(str(processed_input))
-        dash = video.dash(
-            Formats.h264(),
-            seg_duration=4,
-            use_template=1,
-            use_timeline=0,
-            force_key_frames="expr:gte(t,n_forced*1)",
-            init_seg_name="init_$RepresentationID$.m4s",
-            media_seg_name="chunk_$RepresentationID$_$Number%03d$.m4s",
+        # Rotated sources get the whole ladder, their frames are transposed
+        # upright in the filter of every rung
+        active_reps = representations
+        if upright_filter(video_props["rotation"]) and log_path:
+            with open(log_path, "a") as logf:
+                logf.write(
+                    f"Rotation {video_props['rotation']}° applied with "
+                    f"{upright_filter(video_props['rotation'])} on all {len(active_reps)} rungs\n"
+                )
+        audio_bitrates = (
+            plan_audio_bitrates(ladder) if video_props["has_audio"] and audio else []
         )
 
-        # For portrait videos, we might need to handle aspect ratios more carefully
-        # Let's try adding some tolerance or using fewer representations initially
-        if video_props.get("rotation", 0) != 0:
-            # For rotated videos, let's use fewer representations to avoid conflicts
-            limited_reps = representations[:2]  # Use only top 2 quality levels
-            if log_path:
-                with open(log_path, "a") as logf:
-                    logf.write(
-                        f"Using limited representations ({len(limited_reps)}) for rotated video\n"
-                    )
-            dash.representations(*limited_reps)
-        else:
-            dash.representations(*representations)
+        output_file = output_dir / "video.mpd"
 
-        output_file = str(output_dir / "video.mpd")
+        preview_plan = None
+        preview_outputs = None
+        if previews:
+            preview_plan = plan_previews(
+                video_props["display_width"],
+                video_props["display_height"],
+                video_props["duration"],
+            )
+            # They share the decode of the encode, whose input is not rotated
+            preview_outputs = preview_output_args(
+                output_dir, preview_plan, upright_filter(video_props["rotation"])
+            )
 
         if log_path:
             with open(log_path, "a") as logf:
                 logf.write(f"DASH output file: {output_file}\n")
+                logf.write(f"Shared audio renditions: {audio_bitrates or 'none'} kbps\n")
                 logf.write("Starting DASH processing...\n")
+                if cpu:
+                    logf.write(f"CPU budget: {cpu.threads} threads, CPUs {sorted(cpu.cpus or []) or 'any'}\n")
+
+        if progressive:
+            encode_mode = "progressive"
+        elif chunks > 1 and video_props["duration"]:
+            encode_mode = "chunked"
+        elif parallel_workers > 1 and len(active_reps) > 1:
+            encode_mode = "parallel"
+        else:
+            encode_mode = "single"
+
+        keyframes = KeyframePlan(
+            profile.seg_duration, profile.gop, frame_rate=video_props["frame_rate"]
+        )
+        if profile.scene_cuts and encode_mode != "chunked" and video_props["duration"]:
+            try:
+                with _stage(timeline, "scene_detection") as span:
+                    cuts = detect_scene_cuts(processed_input, cpu=cpu)
+                    span["cuts"] = len(cuts)
+                keyframes = replace(
+                    keyframes,
+                    times=plan_keyframe_times(
+                        video_props["duration"],
+                        profile.gop,
+                        cuts,
+                        profile.scene_cut_tolerance,
+                        seg_duration=profile.seg_duration,
+                    ),
+                )
+            except subprocess.CalledProcessError as e:
+                if log_path:
+                    with open(log_path, "a") as logf:
+                        logf.write(f"Scene detection failed, using regular keyframes: {e}\n")
+        if log_path:
+            with open(log_path, "a") as logf:
+                logf.write(
+                    f"Segments of {keyframes.seg_duration}s, closed GOPs of {keyframes.gop_duration:g}s\n"
+                )
+                if keyframes.times:
+                    logf.write(f"Scene-cut keyframes at: {keyframes.times}\n")
+
+        checkpoint = None
+        if encode_mode != "progressive":
+            source = Path(input_path).stat()
+            checkpoint = EncodeCheckpoint(
+                output_dir,
+                encode_fingerprint(
+                    {
+                        "source": [source.st_size, source.st_mtime_ns],
+                        "mode": encode_mode,
+                        "parallel_workers": parallel_workers if encode_mode == "parallel" else 1,
+                        "chunks": chunks if encode_mode == "chunked" else 1,
+                        "representations": [
+                            [rep.size.width, rep.size.height, rep.bitrate.video_]
+                            for rep in active_reps
+                        ],
+                        "audio": audio_bitrates,
+                        "profile": repr(profile),
+                        "keyframes": repr(keyframes),
+                        "previews": preview_plan,
+                    }
+                ),
+            )
+            if not checkpoint.restored:
+                # Left by an attempt with other settings, or interrupted while merging
+                shutil.rmtree(output_dir / PARTS_DIR, ignore_errors=True)
+            elif log_path:
+                with open(log_path, "a") as logf:
+                    logf.write(f"Resuming from checkpoint: {checkpoint.state['parts']}\n")
 
         # Add progress monitoring if possible
         try:
             if log_path:
                 with open(log_path, "a") as logf:
                     logf.write("About to start DASH output generation...\n")
-                    if video_props.get("rotation", 0) != 0:
-                        active_reps = limited_reps
-                    else:
-                        active_reps = representations
-
                     for i, rep in enumerate(active_reps):
                         logf.write(
                             f"  Rep {i}: {rep.size.width}x{rep.size.height} (AR: {rep.size.width / rep.size.height:.4f})\n"
                         )
 
-            dash.output(output_file)
+            with _stage(
+                timeline,
+                "encode",
+                media_seconds=video_props["duration"],
+                rungs=len(active_reps),
+                audio_rungs=len(audio_bitrates),
+                mode=encode_mode,
+                profile=profile.name,
+            ) as span:
+                if progressive:
+                    # ffmpeg rewrites the manifest (type="dynamic") after every
+                    # segment and writes the final static one when it finishes
+                    monitor = tracker.monitor("dash") if tracker else None
+                    _run_dash(
+                        _dash_output(
+                            processed_input,
+                            active_reps,
+                            profile=profile,
+                            audio=bool(audio_bitrates),
+                            keyframes=keyframes,
+                            rotation=video_props["rotation"],
+                            use_timeline=1,
+                        ),
+                        output_file,
+                        monitor=monitor,
+                        extra_outputs=preview_outputs,
+                        audio_bitrates=audio_bitrates,
+                        cpu=cpu,
+                    )
+                    if log_path:
+                        with open(log_path, "a") as logf:
+                            logf.write("Encoded with a progressively published manifest\n")
+                elif chunks > 1 and video_props["duration"]:
+                    plan = encode_dash_chunked(
+                        processed_input,
+                        output_file,
+                        active_reps,
+                        video_props["duration"],
+                        chunks,
+                        audio_bitrates=audio_bitrates,
+                        progress=tracker,
+                        profile=profile,
+                        keyframes=keyframes,
+                        checkpoint=checkpoint,
+                        cpu=cpu,
+                        rotation=video_props["rotation"],
+                    )
+                    if log_path:
+                        with open(log_path, "a") as logf:
+                            logf.write(f"Encoded {len(plan)} time chunks in parallel: {plan}\n")
+                else:
+                    # A single process is one group of the whole ladder
+                    groups = encode_dash_parallel(
+                        processed_input,
+                        output_file,
+                        active_reps,
+                        parallel_workers if encode_mode == "parallel" else 1,
+                        progress=tracker,
+                        extra_outputs=preview_outputs,
+                        profile=profile,
+                        audio_bitrates=audio_bitrates,
+                        keyframes=keyframes,
+                        duration=video_props["duration"],
+                        checkpoint=checkpoint,
+                        cpu=cpu,
+                        rotation=video_props["rotation"],
+                    )
+                    if log_path and encode_mode == "parallel":
+                        with open(log_path, "a") as logf:
+                            logf.write(
+                                f"Encoded {len(groups)} representation groups in parallel: {groups}\n"
+                            )
+                resumed_parts = checkpoint.resumed_parts() if checkpoint else {}
+                if resumed_parts:
+                    span["resumed_parts"] = resumed_parts
+                    if log_path:
+                        with open(log_path, "a") as logf:
+                            logf.write(f"Resumed from the segments after: {resumed_parts}\n")
+            if preview_plan and (encode_mode == "chunked" or "group_0" in resumed_parts):
+                # No process decoded the whole source, previews need their own pass
+                with _stage(timeline, "thumbnail", standalone=True):
+                    extract_previews(processed_input, output_dir, preview_plan, cpu=cpu)
+            if preview_plan:
+                write_sprite_vtt(output_dir, preview_plan)
+            if single_file:
+                with _stage(timeline, "package") as span:
+                    packaged = package_single_file(
+                        output_file, lambda rep_id: _segment_files(output_dir, rep_id)
+                    )
+                    span.update(packaged)
+                if log_path:
+                    with open(log_path, "a") as logf:
+                        logf.write(
+                            f"Packaged {packaged['segments']} segments into "
+                            f"{packaged['representations']} single files\n"
+                        )
+            if storage is not None and not storage.in_place:
+                # Before the checkpoint goes, so a failed upload doesn't re-encode
+                with _stage(timeline, "upload") as span:
+                    stored = storage.upload_dir(output_dir, storage_prefix)
+                    span.update(stored)
+                if log_path:
+                    with open(log_path, "a") as logf:
+                        logf.write(f"Stored {stored['files']} files ({stored['bytes'] / 1e6:.1f} MB)\n")
+            if checkpoint:
+                checkpoint.remove()
             if log_path:
                 with open(log_path, "a") as logf:
                     logf.write("DASH conversion completed successfully\n")
+                    if preview_plan:
+                        logf.write(f"Previews written from the same decode: {preview_plan}\n")
         except Exception as dash_error:
             if log_path:
                 with open(log_path, "a") as logf:
@@ -344,16 +1871,17 @@ def create_dash_stream(
         if processed_input != input_path and "debug_preprocessed" not in str(
             processed_input
         ):
-            try:
-                processed_input.unlink()
-                # Also clean up parent temp directory if it's empty
-                if processed_input.parent.name == "temp":
-                    try:
-                        processed_input.parent.rmdir()
-                    except OSError:
-                        pass  # Directory not empty
-            except Exception:
-                pass  # Ignore cleanup errors
+            with _stage(timeline, "cleanup"):
+                try:
+                    processed_input.unlink()
+                    # Also clean up parent temp directory if it's empty
+                    if processed_input.parent.name == "temp":
+                        try:
+                            processed_input.parent.rmdir()
+                        except OSError:
+                            pass  # Directory not empty
+                except Exception:
+                    pass  # Ignore cleanup errors
 
     except Exception as e:
         if log_path:
@@ -362,7 +1890,13 @@ def create_dash_stream(
         raise
 
 
-def extract_thumbnail(video_path: Path, output_path: Path, timestamp: str = "00:00:01"):
+def extract_thumbnail(
+    video_path: Path,
+    output_path: Path,
+    timestamp: str = "00:00:01",
+    probe: VideoProbe = None,
+    cpu: CpuLease = None,
+):
     """
     Extract a thumbnail from a video at the specified timestamp.
 
@@ -370,22 +1904,39 @@ def extract_thumbnail(video_path: Path, output_path: Path, timestamp: str = "00:
         video_path: Path to the input video file
         output_path: Path where the thumbnail should be saved
         timestamp: Timestamp in format HH:MM:SS (default: 00:00:01)
+        probe: Already computed probe of the input (optional), used to keep
+            the timestamp inside short videos
+        cpu: CPU budget of the job (optional)
     """
+    if probe and probe.duration:
+        hours, minutes, seconds = (float(part) for part in timestamp.split(":"))
+        if hours * 3600 + minutes * 60 + seconds >= probe.duration:
+            timestamp = f"{probe.duration / 2:.3f}"
+
+    # Seeking before -i jumps to the nearest keyframe instead of decoding from the start
     thumb_cmd = [
         "ffmpeg",
         "-y",
-        "-i",
-        str(video_path),
         "-ss",
         timestamp,
+        *thread_args(cpu),
+        "-i",
+        str(video_path),
         "-vframes",
         "1",
         str(output_path),
     ]
-    subprocess.run(thumb_cmd, check=True, capture_output=True, text=True)
+    run_ffmpeg(thumb_cmd, cpu)
 
 
-def create_debug_mp4(input_path: Path, output_path: Path, log_path: Path = None):
+def create_debug_mp4(
+    input_path: Path,
+    output_path: Path,
+    log_path: Path = None,
+    probe: VideoProbe = None,
+    profile: EncodingProfile = None,
+    cpu: CpuLease = None,
+):
     """
     Create a simple MP4 conversion for debugging purposes.
     This uses the same preprocessing as DASH but outputs a regular MP4.
@@ -394,13 +1945,19 @@ def create_debug_mp4(input_path: Path, output_path: Path, log_path: Path = None)
         input_path: Path to input video file
         output_path: Path for output MP4 file
         log_path: Optional path to log file
+        probe: Already computed probe of the input (optional)
+        profile: Encoding profile (optional, defaults to "default")
+        cpu: CPU budget of the job (optional)
     """
+    profile = profile or PROFILES["default"]
     try:
+        probe = probe or probe_video(input_path)
+
         # Preprocess the video if needed
-        processed_input = preprocess_video_if_needed(input_path, debug=True)
+        processed_input = preprocess_video_if_needed(input_path, debug=True, probe=probe)
 
         # Get video properties
-        video_props = get_video_properties(processed_input)
+        video_props = get_video_properties(processed_input, probe=probe)
 
         # Create a simple MP4 conversion with moderate quality
         cmd = [
@@ -408,12 +1965,8 @@ def create_debug_mp4(input_path: Path, output_path: Path, log_path: Path = None)
             "-y",
             "-i",
             str(processed_input),
-            "-c:v",
-            "libx264",
-            "-preset",
-            "medium",
-            "-crf",
-            "23",
+            *profile.encoder_args(),
+            *thread_args(cpu),
             "-c:a",
             "aac",
             "-b:a",
@@ -421,7 +1974,7 @@ def create_debug_mp4(input_path: Path, output_path: Path, log_path: Path = None)
             str(output_path),
         ]
 
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        run_ffmpeg(cmd, cpu)
 
         if log_path:
             with open(log_path, "a") as logf: